@@ -0,0 +1,185 @@
+"""Library to log the changes made to a SymFs by each run.
+
+Consumers of a SymFs (e.g. indexers) otherwise have to walk all of it after
+each run to find out what changed. A `ChangeLog` instead appends the items
+added to and removed from each group key to a log file, as computed by
+diffing the mapping of the run against the mapping last logged, which is kept
+in a state file next to the log.
+
+The log is append-only, in one of `FORMATS`:
+
+- `json`: one JSON object per line, with the fields of `Change`;
+- `proto`: `Change` protos, each preceded by its size as a varint (as with
+  `writeDelimitedTo` in Java).
+
+The changes are appended before the state file is replaced, so if a run is
+killed in between, the next run appends them again: consumers see each change
+at least once.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import json
+import pathlib
+import time
+
+from absl import logging
+
+import mapping_lib
+import protos.symfs_pb2 as symfs_pb2
+
+FORMATS = ('json', 'proto')
+
+
+def diff(
+    previous: mapping_lib.GroupToKeyToPathMapping,
+    current: mapping_lib.GroupToKeyToPathMapping) -> List[symfs_pb2.Change]:
+  """Returns the changes from the previous mapping to the current one.
+
+  The changes are sorted by group and key; within a key, removals come first.
+  """
+  changes = []
+  for group_name in sorted(previous.keys() | current.keys()):
+    previous_group = previous.get(group_name, {})
+    group = current.get(group_name, {})
+    for group_key in sorted(previous_group.keys() | group.keys()):
+      previous_items = previous_group.get(group_key, set())
+      items = group.get(group_key, set())
+      for kind, changed in ((symfs_pb2.Change.REMOVED, previous_items - items),
+                            (symfs_pb2.Change.ADDED, items - previous_items)):
+        changes.extend(
+            symfs_pb2.Change(
+                kind=kind, group=group_name, key=group_key, item=str(item))
+            for item in sorted(changed))
+  return changes
+
+
+def _encode_varint(value: int) -> bytes:
+  encoded = bytearray()
+  while value > 0x7f:
+    encoded.append(value & 0x7f | 0x80)
+    value >>= 7
+  encoded.append(value)
+  return bytes(encoded)
+
+
+def _decode_varint(content: bytes, position: int) -> Tuple[int, int]:
+  """Returns the varint at position in content, and the position after it."""
+  value = shift = 0
+  while True:
+    if position >= len(content):
+      raise ValueError('Truncated varint.')
+    byte = content[position]
+    position += 1
+    value |= (byte & 0x7f) << shift
+    shift += 7
+    if not byte & 0x80:
+      return value, position
+
+
+def encode(change: symfs_pb2.Change, log_format: str) -> bytes:
+  """Returns change as an entry of a log in log_format."""
+  if log_format == 'json':
+    return (json.dumps({
+        'kind': symfs_pb2.Change.Kind.Name(change.kind),
+        'group': change.group,
+        'key': change.key,
+        'item': change.item,
+        'time_ns': change.time_ns,
+    }) + '\n').encode()
+  if log_format == 'proto':
+    content = change.SerializeToString()
+    return _encode_varint(len(content)) + content
+  raise ValueError(f'Unknown change log format: {log_format}.')
+
+
+def read_changes(path: pathlib.Path,
+                 log_format: str) -> Iterator[symfs_pb2.Change]:
+  """Yields the changes in the log at path, in log_format."""
+  content = path.read_bytes()
+  if log_format == 'json':
+    for line in content.decode().splitlines():
+      fields = json.loads(line)
+      fields['kind'] = symfs_pb2.Change.Kind.Value(fields['kind'])
+      yield symfs_pb2.Change(**fields)
+  elif log_format == 'proto':
+    position = 0
+    while position < len(content):
+      size, position = _decode_varint(content, position)
+      if position + size > len(content):
+        raise ValueError(f'Truncated change in {path}.')
+      yield symfs_pb2.Change.FromString(content[position:position + size])
+      position += size
+  else:
+    raise ValueError(f'Unknown change log format: {log_format}.')
+
+
+class ChangeLog:
+  """Appends the changes made by each run of a SymFs to a log file.
+
+  Attributes:
+    path: The path of the log file.
+    log_format: One of `FORMATS`.
+    state_path: The path of the mapping last logged.
+  """
+
+  def __init__(self, path: pathlib.Path, log_format: str = 'json') -> None:
+    if log_format not in FORMATS:
+      raise ValueError(f'Unknown change log format: {log_format}.')
+    self.path = path
+    self.log_format = log_format
+    self.state_path = path.with_name(f'.{path.name}.mapping')
+
+    self._previous: Optional[Dict[str, Dict[str, Set[pathlib.Path]]]] = None
+
+  def _read_previous(self) -> Dict[str, Dict[str, Set[pathlib.Path]]]:
+    """Returns the mapping last logged, or an empty one if none was."""
+    proto = mapping_lib.read_proto_or_none(self.state_path,
+                                           'previous mapping',
+                                           'logging all items as added')
+    return {} if proto is None else mapping_lib.from_proto(proto)
+
+  def append(self,
+             mapping: mapping_lib.GroupToKeyToPathMapping,
+             unchanged_groups: Iterable[str] = (),
+             removes: bool = True) -> int:
+    """Appends the changes since the mapping last logged, and records mapping.
+
+    Args:
+      mapping: The mapping the SymFs now has.
+      unchanged_groups: Groups that were not generated (e.g. deferred by a
+        deadline), whose changes are left for a later run to log.
+      removes: Whether the run removed the links of items missing from
+        mapping. If not, those links are still there, so they are neither
+        logged as removed nor dropped from the mapping recorded.
+
+    Returns:
+      The number of changes appended.
+    """
+    if self._previous is None:
+      self._previous = self._read_previous()
+    unchanged_groups = set(unchanged_groups)
+    current = mapping_lib.merge([{
+        group_name: group
+        for group_name, group in mapping.items()
+        if group_name not in unchanged_groups
+    }])
+    for group_name in unchanged_groups:
+      if group_name in self._previous:
+        current[group_name] = self._previous[group_name]
+    if not removes:
+      current = mapping_lib.merge([self._previous, current])
+
+    changes = diff(self._previous, current)
+    if changes:
+      time_ns = time.time_ns()
+      self.path.parent.mkdir(parents=True, exist_ok=True)
+      with self.path.open('ab') as stream:
+        for change in changes:
+          change.time_ns = time_ns
+          stream.write(encode(change, self.log_format))
+      mapping_lib.write_mapping(self.state_path,
+                                mapping_lib.to_proto(current))
+    self._previous = current
+    logging.info('Logged %d changes to %s.', len(changes), self.path)
+    return len(changes)
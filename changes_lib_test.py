@@ -0,0 +1,97 @@
+import pathlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+import changes_lib
+import protos.symfs_pb2 as symfs_pb2
+
+_PREVIOUS = {
+    'by_studio': {
+        's': {pathlib.Path('/a/1'), pathlib.Path('/a/2')},
+    },
+    'by_cast': {
+        'x': {pathlib.Path('/a/1')},
+    },
+}
+_CURRENT = {
+    'by_studio': {
+        's': {pathlib.Path('/a/1'), pathlib.Path('/a/3')},
+    },
+    'by_cast': {
+        'x': {pathlib.Path('/a/1')},
+        'y': {pathlib.Path('/a/3')},
+    },
+}
+
+
+def _change(kind, group, key, item):
+  return symfs_pb2.Change(
+      kind=getattr(symfs_pb2.Change, kind), group=group, key=key, item=item)
+
+
+class ChangesLibTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.path = pathlib.Path(self.create_tempdir().full_path) / 'changes'
+
+  def test_diff(self):
+    self.assertEqual(
+        changes_lib.diff(_PREVIOUS, _CURRENT), [
+            _change('ADDED', 'by_cast', 'y', '/a/3'),
+            _change('REMOVED', 'by_studio', 's', '/a/2'),
+            _change('ADDED', 'by_studio', 's', '/a/3'),
+        ])
+
+  @parameterized.parameters(*changes_lib.FORMATS)
+  def test_append(self, log_format):
+    """Ensures each run appends its changes since the previous run."""
+    changes_lib.ChangeLog(self.path, log_format).append(_PREVIOUS)
+    change_log = changes_lib.ChangeLog(self.path, log_format)
+
+    self.assertEqual(change_log.append(_CURRENT), 3)
+    self.assertEqual(change_log.append(_CURRENT), 0)
+
+    changes = list(changes_lib.read_changes(self.path, log_format))
+    self.assertLen(changes, 6)
+    self.assertEqual(changes[3].item, '/a/3')
+    self.assertEqual(changes[3].kind, symfs_pb2.Change.ADDED)
+    self.assertEqual(len({change.time_ns for change in changes}), 2)
+
+  def test_append_unchanged_groups(self):
+    """Ensures the changes of groups not generated are left for later."""
+    change_log = changes_lib.ChangeLog(self.path)
+    change_log.append(_PREVIOUS)
+
+    self.assertEqual(
+        change_log.append(_CURRENT, unchanged_groups=['by_studio']), 1)
+    self.assertEqual(change_log.append(_CURRENT), 2)
+
+  def test_append_without_removing(self):
+    """Ensures items whose links were left are not logged as removed."""
+    change_log = changes_lib.ChangeLog(self.path)
+    change_log.append(_PREVIOUS)
+
+    self.assertEqual(change_log.append(_CURRENT, removes=False), 2)
+    # The link of /a/2 is only removed now.
+    self.assertEqual(change_log.append(_CURRENT), 1)
+    change = list(changes_lib.read_changes(self.path, 'json'))[-1]
+    change.ClearField('time_ns')
+    self.assertEqual(change, _change('REMOVED', 'by_studio', 's', '/a/2'))
+
+  def test_append_corrupted_state(self):
+    """Ensures a corrupted state file logs all items as added."""
+    change_log = changes_lib.ChangeLog(self.path)
+    change_log.state_path.write_bytes(b'not a mapping')
+
+    with self.assertLogs(level='WARNING'):
+      self.assertEqual(change_log.append(_PREVIOUS), 3)
+
+  def test_invalid_format(self):
+    with self.assertRaises(ValueError):
+      changes_lib.ChangeLog(self.path, 'xml')
+
+
+if __name__ == '__main__':
+  absltest.main()
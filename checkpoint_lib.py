@@ -0,0 +1,153 @@
+"""Library to checkpoint the progress of generating a SymFs.
+
+A `Checkpointer` writes the mapping computed by the scan, and then, as the
+links of each group key are created, the completed group keys to a state file.
+If the run is killed, the next run can resume from the state file: the scan is
+skipped, and so are the completed group keys. The state file is removed once
+the run finishes.
+
+Before resuming, the state is verified quickly: the config must be the same,
+the source paths must not have been modified since the scan (as per their
+modification time, which only covers their direct children), and the
+directory of each completed group key must still exist; group keys that fail
+the last check are redone.
+"""
+
+from typing import List, Optional, Set, Tuple
+
+import pathlib
+import time
+
+from absl import logging
+
+import fs_lib
+import mapping_lib
+import metrics_lib
+import protos.symfs_pb2 as symfs_pb2
+
+# A group name and group key.
+GroupKey = Tuple[str, str]
+
+
+class Checkpointer:
+  """Records the progress of generating a single SymFs in a state file.
+
+  Attributes:
+    path: The path of the state file.
+    filesystem: The filesystem of the source paths and SymFs.
+    interval: The minimum number of seconds between writes of the state file.
+    metrics: Where to record metrics.
+  """
+
+  def __init__(self,
+               path: pathlib.Path,
+               filesystem: fs_lib.FileSystem,
+               interval: float = 30,
+               metrics: Optional[metrics_lib.Metrics] = None) -> None:
+    self.path = path
+    self.filesystem = filesystem
+    self.interval = interval
+    self.metrics = metrics or metrics_lib.Metrics()
+
+    self._checkpoint = symfs_pb2.Checkpoint()
+    self._completed: Set[GroupKey] = set()
+    self._last_write = time.monotonic()
+
+  def _get_source_paths(
+      self,
+      config: symfs_pb2.Config) -> List[symfs_pb2.Checkpoint.SourcePath]:
+    """Returns the current state of the source paths of config."""
+    source_paths = []
+    for path in config.source_paths:
+      try:
+        mtime_ns = self.filesystem.stat(pathlib.Path(path)).st_mtime_ns
+      except OSError:
+        mtime_ns = -1
+      source_paths.append(
+          symfs_pb2.Checkpoint.SourcePath(path=path, mtime_ns=mtime_ns))
+    return source_paths
+
+  def resume(
+      self, config: symfs_pb2.Config
+  ) -> Optional[mapping_lib.GroupToKeyToPathMapping]:
+    """Loads the state file, if any, to resume the generation of config.
+
+    Args:
+      config: The config of the run, as given (before any defaults are set).
+
+    Returns:
+      The mapping to generate, or None if there is nothing (valid) to resume,
+      in which case the run should start from scratch.
+    """
+    checkpoint = mapping_lib.read_proto_or_none(
+        self.path,
+        'state file',
+        'starting from scratch',
+        message_type=symfs_pb2.Checkpoint)
+    if checkpoint is None:
+      return None
+
+    if checkpoint.config != config:
+      logging.warning('The config changed since %s was written; starting '
+                      'from scratch.', self.path)
+      return None
+    if list(checkpoint.source_paths) != self._get_source_paths(config):
+      logging.warning('The source paths changed since %s was written; '
+                      'starting from scratch.', self.path)
+      return None
+
+    output_path = pathlib.Path(config.path)
+    for key in checkpoint.completed_keys:
+      if self.filesystem.is_dir(output_path / key.group / key.key):
+        self._completed.add((key.group, key.key))
+      else:
+        logging.warning('%s/%s is missing; redoing it.', key.group, key.key)
+    self._checkpoint = checkpoint
+    logging.info('Resuming from %s with %d completed group keys.', self.path,
+                 len(self._completed))
+    return mapping_lib.from_proto(checkpoint.mapping)
+
+  def start(self, config: symfs_pb2.Config,
+            mapping: mapping_lib.GroupToKeyToPathMapping) -> None:
+    """Records the scan of config, before any link is created.
+
+    Args:
+      config: The config of the run, as given (before any defaults are set).
+      mapping: The mapping computed by the scan.
+    """
+    self._checkpoint = symfs_pb2.Checkpoint(
+        config=config,
+        mapping=mapping_lib.to_proto(mapping, config.source_paths),
+        source_paths=self._get_source_paths(config))
+    self._completed.clear()
+    self.write()
+
+  def is_completed(self, group_name: str, group_key: str) -> bool:
+    """Returns whether the links of the group key were already created."""
+    return (group_name, group_key) in self._completed
+
+  def complete(self, group_name: str, group_key: str) -> None:
+    """Records that all links of the group key were created."""
+    self._completed.add((group_name, group_key))
+    if time.monotonic() - self._last_write >= self.interval:
+      self.write()
+
+  def discard(self, group_name: str, group_key: str) -> None:
+    """Records that the links of the group key were removed again."""
+    self._completed.discard((group_name, group_key))
+
+  def write(self) -> None:
+    """Writes the state file."""
+    with self.metrics.phase('checkpoint'):
+      del self._checkpoint.completed_keys[:]
+      for group_name, group_key in sorted(self._completed):
+        self._checkpoint.completed_keys.add(group=group_name, key=group_key)
+      # The state file is local, whatever filesystem the SymFs is on.
+      fs_lib.LocalFileSystem().write_bytes_atomically(
+          self.path, self._checkpoint.SerializeToString())
+    self.metrics.increment('checkpoints_written', phase='checkpoint')
+    self._last_write = time.monotonic()
+
+  def finish(self) -> None:
+    """Removes the state file, as there is nothing left to resume."""
+    self.path.unlink(missing_ok=True)
@@ -0,0 +1,108 @@
+import pathlib
+
+from absl.testing import absltest
+
+import checkpoint_lib
+import fs_lib
+import protos.symfs_pb2 as symfs_pb2
+
+_SOURCE = pathlib.Path('/media')
+_OUTPUT = pathlib.Path('/views')
+_MAPPING = {
+    'by_studio': {
+        's': {_SOURCE / 'a', _SOURCE / 'b'},
+        't': {_SOURCE / 'c'},
+    },
+}
+
+
+class CheckpointerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.filesystem = fs_lib.InMemoryFileSystem()
+    self.filesystem.mkdir(_SOURCE / 'a', parents=True)
+    self.filesystem.mkdir(_OUTPUT / 'by_studio' / 's', parents=True)
+    self.config = symfs_pb2.Config(path=str(_OUTPUT), source_paths=[
+        str(_SOURCE)
+    ])
+    self.path = pathlib.Path(self.create_tempdir().full_path) / 'state.pb'
+
+  def _make_checkpointer(self):
+    return checkpoint_lib.Checkpointer(self.path, self.filesystem, interval=0)
+
+  def test_resume(self):
+    """Ensures the mapping and completed keys are resumed."""
+    checkpointer = self._make_checkpointer()
+    checkpointer.start(self.config, _MAPPING)
+    checkpointer.complete('by_studio', 's')
+
+    resumed = self._make_checkpointer()
+
+    self.assertEqual(resumed.resume(self.config), _MAPPING)
+    self.assertTrue(resumed.is_completed('by_studio', 's'))
+    self.assertFalse(resumed.is_completed('by_studio', 't'))
+
+  def test_resume_interval(self):
+    """Ensures completed keys are only written after the interval."""
+    checkpointer = checkpoint_lib.Checkpointer(
+        self.path, self.filesystem, interval=3600)
+    checkpointer.start(self.config, _MAPPING)
+    checkpointer.complete('by_studio', 's')
+
+    resumed = self._make_checkpointer()
+
+    self.assertEqual(resumed.resume(self.config), _MAPPING)
+    self.assertFalse(resumed.is_completed('by_studio', 's'))
+
+  def test_resume_missing_key(self):
+    """Ensures completed keys whose directory is missing are redone."""
+    checkpointer = self._make_checkpointer()
+    checkpointer.start(self.config, _MAPPING)
+    checkpointer.complete('by_studio', 's')
+    checkpointer.complete('by_studio', 't')
+
+    resumed = self._make_checkpointer()
+
+    with self.assertLogs(level='WARNING'):
+      self.assertEqual(resumed.resume(self.config), _MAPPING)
+    self.assertTrue(resumed.is_completed('by_studio', 's'))
+    self.assertFalse(resumed.is_completed('by_studio', 't'))
+
+  def test_resume_changed_config(self):
+    checkpointer = self._make_checkpointer()
+    checkpointer.start(self.config, _MAPPING)
+    self.config.clear = True
+
+    with self.assertLogs(level='WARNING'):
+      self.assertIsNone(self._make_checkpointer().resume(self.config))
+
+  def test_resume_changed_source_paths(self):
+    checkpointer = self._make_checkpointer()
+    checkpointer.start(self.config, _MAPPING)
+    self.filesystem.mkdir(_SOURCE / 'd')
+
+    with self.assertLogs(level='WARNING'):
+      self.assertIsNone(self._make_checkpointer().resume(self.config))
+
+  def test_resume_invalid(self):
+    """Ensures missing or corrupted state files start from scratch."""
+    self.assertIsNone(self._make_checkpointer().resume(self.config))
+
+    self.path.write_bytes(b'not a checkpoint')
+    with self.assertLogs(level='WARNING'):
+      self.assertIsNone(self._make_checkpointer().resume(self.config))
+
+  def test_finish(self):
+    checkpointer = self._make_checkpointer()
+    checkpointer.start(self.config, _MAPPING)
+    self.assertTrue(self.path.exists())
+
+    checkpointer.finish()
+
+    self.assertFalse(self.path.exists())
+    self.assertEqual(checkpointer.metrics.counters['checkpoints_written'], 1)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,113 @@
+"""Library to group items by scalar fields with vectorized NumPy operations.
+
+For a group_by whose fields are all scalar, each item belongs to exactly one
+group key: its values of the fields, joined as by `symfs.generate_groups`.
+Instead of generating the key of each item in Python, a `Table` collects the
+values of the fields of each item during the scan. `Table.group` then
+dictionary-encodes them as columns (an array of codes per field, indexing the
+distinct values of that field) and finds the rows of each distinct combination
+of codes with `numpy.unique`, `argsort`, and `split`.
+
+SymFs only groups items this way with `Config.columnar`, which requires NumPy
+(see `AVAILABLE`); otherwise, it generates the key of each item as usual.
+"""
+
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+import importlib.util
+import operator
+import os
+import pathlib
+
+from google.protobuf import descriptor
+from google.protobuf import message
+
+# Checked without importing NumPy, which is slow to import.
+AVAILABLE = importlib.util.find_spec('numpy') is not None
+
+# Returns the values of the fields of a group_by in a message, as strings.
+Extractor = Callable[[message.Message], Tuple[str, ...]]
+
+
+def is_scalar(message_descriptor: descriptor.Descriptor, field: str) -> bool:
+  """Returns whether field (e.g. "a.b") has exactly one non-message value.
+
+  Fields that do not exist are not scalar, so that they are reported as usual.
+  """
+  field_descriptor = None
+  for name in field.split('.'):
+    if message_descriptor is None:
+      return False
+    field_descriptor = message_descriptor.fields_by_name.get(name)
+    if (field_descriptor is None or
+        field_descriptor.label == descriptor.FieldDescriptor.LABEL_REPEATED):
+      return False
+    message_descriptor = field_descriptor.message_type
+  return field_descriptor is not None and message_descriptor is None
+
+
+def make_extractor(fields: Sequence[str]) -> Extractor:
+  """Returns a function to extract the values of the scalar fields."""
+  # Resolves (nested) fields in C, which matters as it is called per item.
+  getter = operator.attrgetter(*fields)
+  if len(fields) == 1:
+    return lambda message: (str(getter(message)),)
+  return lambda message: tuple(map(str, getter(message)))
+
+
+class Table:
+  """The values of the scalar fields of a group_by, with a row per item.
+
+  Values are encoded as strings, as they appear in group keys, so values that
+  are equal as group keys are grouped together.
+  """
+
+  def __init__(self) -> None:
+    self._paths: List[pathlib.Path] = []
+    self._rows: List[Tuple[str, ...]] = []
+
+  def __len__(self) -> int:
+    return len(self._paths)
+
+  def append(self, path: pathlib.Path, values: Tuple[str, ...]) -> None:
+    """Adds a row for path with the values of the fields."""
+    self._paths.append(path)
+    self._rows.append(values)
+
+  def group(self) -> Iterator[Tuple[str, List[pathlib.Path]]]:
+    """Yields each group key and the paths of the rows with that key."""
+    if not self._paths:
+      return
+    # Imported here, as it is slow to import and only needed to group.
+    import numpy  # pylint: disable=g-import-not-at-top
+
+    values = []
+    columns = []
+    for column in zip(*self._rows):
+      # The distinct values, in order of appearance, and their codes.
+      values.append(list(dict.fromkeys(column)))
+      codes = {value: code for code, value in enumerate(values[-1])}
+      columns.append(
+          numpy.fromiter(
+              map(codes.__getitem__, column),
+              dtype=numpy.int64,
+              count=len(column)))
+    sizes = [len(field_values) for field_values in values]
+    try:
+      # Number each combination of codes, to sort integers rather than rows.
+      combined = numpy.ravel_multi_index(columns, sizes)
+      unique, inverse = numpy.unique(combined, return_inverse=True)
+      key_codes = numpy.stack(numpy.unravel_index(unique, sizes), axis=1)
+    except ValueError:
+      # There are too many combinations to number; compare the rows instead.
+      key_codes, inverse = numpy.unique(
+          numpy.stack(columns, axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    order = numpy.argsort(inverse, kind='stable')
+    boundaries = numpy.flatnonzero(numpy.diff(inverse[order])) + 1
+    paths = numpy.fromiter(self._paths, dtype=object, count=len(self._paths))
+    for codes, rows in zip(key_codes.tolist(), numpy.split(order, boundaries)):
+      yield (os.path.join(*(values[field][code]
+                            for field, code in enumerate(codes))),
+             paths[rows].tolist())
@@ -0,0 +1,74 @@
+from unittest import mock
+
+import pathlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+import columnar_lib
+import protos.ext_pb2 as ext_pb2
+
+
+class ColumnarLibTest(parameterized.TestCase):
+
+  @parameterized.parameters(
+      ('s', True),
+      ('m.value', True),
+      ('rs', False),
+      ('m', False),
+      ('m.rv', False),
+      ('rm.value', False),
+      ('s.value', False),
+      ('does_not_exist', False),
+  )
+  def test_is_scalar(self, field, expected):
+    self.assertEqual(
+        columnar_lib.is_scalar(ext_pb2.TestMessage.DESCRIPTOR, field),
+        expected)
+
+  @parameterized.parameters(
+      (['s'], ('a',)),
+      (['s', 'm.value'], ('a', 'b')),
+      (['m.value', 's'], ('b', 'a')),
+  )
+  def test_make_extractor(self, fields, expected):
+    message = ext_pb2.TestMessage(
+        s='a', m=ext_pb2.TestMessage.InnerTestMessage(value='b'))
+
+    self.assertEqual(columnar_lib.make_extractor(fields)(message), expected)
+
+  @parameterized.parameters(False, True)
+  @absltest.skipUnless(columnar_lib.AVAILABLE, 'NumPy is not installed.')
+  def test_group(self, too_many_combinations):
+    """Ensures rows are grouped by the combination of their values."""
+    table = columnar_lib.Table()
+    rows = {
+        '/0': ('a', 'x'),
+        '/1': ('b', 'x'),
+        '/2': ('a', 'y'),
+        '/3': ('a', 'x'),
+        '/4': ('', 'y'),
+    }
+    for path, values in rows.items():
+      table.append(pathlib.Path(path), values)
+
+    if too_many_combinations:
+      self.enter_context(
+          mock.patch('numpy.ravel_multi_index', side_effect=ValueError))
+    groups = {key: sorted(map(str, paths)) for key, paths in table.group()}
+
+    self.assertLen(table, 5)
+    self.assertEqual(groups, {
+        'a/x': ['/0', '/3'],
+        'b/x': ['/1'],
+        'a/y': ['/2'],
+        'y': ['/4'],
+    })
+
+  @absltest.skipUnless(columnar_lib.AVAILABLE, 'NumPy is not installed.')
+  def test_group_empty(self):
+    self.assertEqual(list(columnar_lib.Table().group()), [])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,188 @@
+"""Library to generate synthetic SymFs source trees for benchmarks and tests.
+
+A corpus is a tree of item directories under a root, each with a metadata file
+(see `Config.metadata_files`) and optionally some plain files (e.g. for
+`Config.derived_metadata`). Items are spread evenly over `depth` levels of
+intermediate directories with `fanout` directories per level:
+
+    <root>/d0_<i>/d1_<j>/.../item_<n>/metadata.textproto
+
+The metadata is written in the text format, or in the binary wire format (as
+`metadata.binpb`) to benchmark the fast path of parsing it.
+
+The values of each field are drawn from a fixed set of `cardinality` values,
+either uniformly or following a Zipf-like distribution (to model, e.g., a few
+very popular tags). Generation is deterministic given the seed.
+"""
+
+from typing import Callable, List
+
+import pathlib
+import random
+import re
+
+from google.protobuf import message
+from google.protobuf import text_format
+
+import protos.ext_pb2 as ext_pb2
+import protos.symfs_pb2 as symfs_pb2
+
+METADATA_FILE_NAME = 'metadata.textproto'
+BINARY_METADATA_FILE_NAME = 'metadata.binpb'
+
+# The supported metadata types, distributions, and metadata formats.
+METADATA_TYPES = ('Media', 'TestMessage')
+DISTRIBUTIONS = ('uniform', 'zipf')
+METADATA_FORMATS = ('text', 'binary')
+
+
+class _ValueSampler:
+  """Samples values of a field from a fixed set of values."""
+
+  def __init__(self, rng: random.Random, prefix: str, cardinality: int,
+               distribution: str) -> None:
+    if distribution not in DISTRIBUTIONS:
+      raise ValueError(f'Unknown distribution {distribution}.')
+    self._rng = rng
+    self._values = [f'{prefix}_{i}' for i in range(max(cardinality, 1))]
+    if distribution == 'zipf':
+      self._weights = [1 / (rank + 1) for rank in range(len(self._values))]
+    else:
+      self._weights = None
+
+  def sample(self) -> str:
+    """Returns a single value."""
+    return self._rng.choices(self._values, weights=self._weights)[0]
+
+  def sample_many(self, max_values: int) -> List[str]:
+    """Returns between 1 and max_values distinct values."""
+    count = self._rng.randint(1, max(1, min(max_values, len(self._values))))
+    values = set()
+    while len(values) < count:
+      values.add(self.sample())
+    return sorted(values)
+
+
+def _make_message_factory(
+    metadata_type: str, rng: random.Random, cardinality: int, max_values: int,
+    distribution: str) -> Callable[[int], message.Message]:
+  """Returns a function that creates the metadata message of the nth item."""
+  sampler = lambda prefix: _ValueSampler(rng, prefix, cardinality, distribution)
+
+  if metadata_type == 'Media':
+    studios, casts, tags, genres = map(sampler,
+                                       ('studio', 'cast', 'tag', 'genre'))
+    return lambda n: ext_pb2.Media(
+        id=f'item_{n}',
+        title=f'Title {n}',
+        studio=studios.sample(),
+        casts=casts.sample_many(max_values),
+        tags=tags.sample_many(max_values),
+        genre=genres.sample_many(max_values))
+
+  if metadata_type == 'TestMessage':
+    s_values, rs_values, m_values, rv_values = map(sampler,
+                                                   ('s', 'rs', 'v', 'rv'))
+    return lambda n: ext_pb2.TestMessage(
+        s=s_values.sample(),
+        rs=rs_values.sample_many(max_values),
+        m=ext_pb2.TestMessage.InnerTestMessage(
+            value=m_values.sample(), rv=rv_values.sample_many(max_values)))
+
+  raise ValueError(f'Unknown metadata type {metadata_type}.')
+
+
+def item_path(root: pathlib.Path, n: int, depth: int,
+              fanout: int) -> pathlib.Path:
+  """Returns the path of the nth item in a corpus."""
+  # Consecutive items go to different leaf directories, so directories fill up
+  # evenly regardless of num_items.
+  parents = []
+  index = n
+  for level in reversed(range(depth)):
+    parents.append(f'd{level}_{index % fanout}')
+    index //= fanout
+  return root.joinpath(*reversed(parents), f'item_{n}')
+
+
+def generate_corpus(root: pathlib.Path,
+                    num_items: int,
+                    depth: int = 2,
+                    fanout: int = 10,
+                    metadata_type: str = 'Media',
+                    cardinality: int = 100,
+                    max_values: int = 3,
+                    distribution: str = 'uniform',
+                    files_per_item: int = 0,
+                    seed: int = 0,
+                    metadata_format: str = 'text') -> List[pathlib.Path]:
+  """Generates a synthetic corpus under root.
+
+  Args:
+    root: The directory to generate the corpus in; created if needed.
+    num_items: The number of items (directories with metadata) to create.
+    depth: The number of intermediate directory levels above each item.
+    fanout: The number of directories per intermediate level.
+    metadata_type: The message in `ext.proto` to use; see METADATA_TYPES.
+    cardinality: The number of distinct values of each field.
+    max_values: The maximum number of values in each repeated field.
+    distribution: How values are drawn; see DISTRIBUTIONS.
+    files_per_item: The number of plain files to create in each item.
+    seed: The seed for the random number generator.
+    metadata_format: How the metadata is written; see METADATA_FORMATS.
+
+  Returns:
+    The paths of the generated items.
+  """
+  if metadata_format not in METADATA_FORMATS:
+    raise ValueError(f'Unknown metadata format {metadata_format}.')
+  rng = random.Random(seed)
+  make_message = _make_message_factory(metadata_type, rng, cardinality,
+                                       max_values, distribution)
+
+  items = []
+  for n in range(num_items):
+    path = item_path(root, n, depth, fanout)
+    path.mkdir(parents=True, exist_ok=True)
+
+    metadata = symfs_pb2.Metadata()
+    metadata.data.Pack(make_message(n))
+    if metadata_format == 'binary':
+      (path / BINARY_METADATA_FILE_NAME).write_bytes(
+          metadata.SerializeToString())
+    else:
+      (path / METADATA_FILE_NAME).write_text(
+          text_format.MessageToString(metadata))
+    for i in range(files_per_item):
+      (path / f'file_{i}.dat').touch()
+    items.append(path)
+  return items
+
+
+def make_config(root: pathlib.Path, output_path: pathlib.Path,
+                metadata_type: str = 'Media',
+                max_repeated_group: int = 2) -> symfs_pb2.Config:
+  """Returns a Config that groups a corpus by each of its fields.
+
+  Args:
+    root: The root of the corpus.
+    output_path: The path of the SymFs.
+    metadata_type: The metadata type used to generate the corpus.
+    max_repeated_group: The `max_repeated_group` of repeated group_bys.
+
+  Returns:
+    A Config with one group_by per field of metadata_type.
+  """
+  fields_by_type = {
+      'Media': (('studio',), ('casts',), ('tags',), ('genre', 'studio')),
+      'TestMessage': (('s',), ('rs',), ('m.value',), ('m.rv', 's')),
+  }
+  config = symfs_pb2.Config(path=str(output_path), source_paths=[str(root)])
+  for file_name in (METADATA_FILE_NAME, BINARY_METADATA_FILE_NAME):
+    config.metadata_files.patterns.append(f'^{re.escape(file_name)}$')
+  for fields in fields_by_type[metadata_type]:
+    config.group_by.add(
+        name='by_' + '_'.join(fields).replace('.', '_'),
+        field=fields,
+        max_repeated_group=max_repeated_group)
+  return config
@@ -0,0 +1,96 @@
+import collections
+import pathlib
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from google.protobuf import text_format
+
+import corpus_lib
+import protos.ext_pb2 as ext_pb2
+import protos.symfs_pb2 as symfs_pb2
+import symfs
+
+
+def _read_media(path: pathlib.Path) -> ext_pb2.Media:
+  """Reads the Media metadata of an item."""
+  metadata = symfs_pb2.Metadata()
+  text_format.Parse((path / corpus_lib.METADATA_FILE_NAME).read_text(),
+                    metadata)
+  media = ext_pb2.Media()
+  metadata.data.Unpack(media)
+  return media
+
+
+class CorpusLibTest(parameterized.TestCase):
+  """Tests for corpus_lib."""
+
+  @parameterized.parameters((0, 5), (1, 3), (3, 2))
+  def test_generate_corpus_layout(self, depth, fanout):
+    """Ensures items are created at the given depth with metadata."""
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory)
+      items = corpus_lib.generate_corpus(
+          root, 20, depth=depth, fanout=fanout, files_per_item=2)
+
+      self.assertLen(set(items), 20)
+      for item in items:
+        self.assertLen(item.relative_to(root).parts, depth + 1)
+        self.assertEqual(
+            sorted(path.name for path in item.iterdir()),
+            ['file_0.dat', 'file_1.dat', corpus_lib.METADATA_FILE_NAME])
+      self.assertLessEqual(
+          len({item.parent for item in items}), fanout**depth)
+
+  def test_generate_corpus_deterministic(self):
+    """Ensures the same seed generates the same corpus."""
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory)
+      items_0 = corpus_lib.generate_corpus(root / '0', 10, seed=1)
+      items_1 = corpus_lib.generate_corpus(root / '1', 10, seed=1)
+
+      for item_0, item_1 in zip(items_0, items_1):
+        self.assertEqual(_read_media(item_0), _read_media(item_1))
+
+  def test_generate_corpus_values(self):
+    """Ensures values respect cardinality, max_values, and distribution."""
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory)
+      uniform = [
+          _read_media(item) for item in corpus_lib.generate_corpus(
+              root / 'uniform', 300, cardinality=10, max_values=2)
+      ]
+      zipf = [
+          _read_media(item) for item in corpus_lib.generate_corpus(
+              root / 'zipf', 300, cardinality=10, distribution='zipf')
+      ]
+
+    self.assertLessEqual(len({media.studio for media in uniform}), 10)
+    self.assertTrue(all(1 <= len(media.casts) <= 2 for media in uniform))
+    uniform_counts = collections.Counter(media.studio for media in uniform)
+    zipf_counts = collections.Counter(media.studio for media in zipf)
+    self.assertGreater(zipf_counts['studio_0'], uniform_counts['studio_0'])
+
+  @parameterized.product(
+      metadata_type=corpus_lib.METADATA_TYPES,
+      metadata_format=corpus_lib.METADATA_FORMATS)
+  def test_make_config(self, metadata_type, metadata_format):
+    """Ensures the config groups every item of the corpus."""
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory) / 'corpus'
+      items = corpus_lib.generate_corpus(
+          root, 10, metadata_type=metadata_type,
+          metadata_format=metadata_format)
+      config = corpus_lib.make_config(root,
+                                      pathlib.Path(directory) / 'views',
+                                      metadata_type)
+
+      mapping = symfs.SymFs(config).get_mapping()
+
+    self.assertLen(mapping, len(config.group_by))
+    for group in mapping.values():
+      self.assertEqual(set().union(*group.values()), set(items))
+
+
+if __name__ == '__main__':
+  absltest.main()
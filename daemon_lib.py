@@ -0,0 +1,270 @@
+"""Library to keep refreshing targets (e.g. SymFs) in a long-running process.
+
+A `Daemon` refreshes each of its targets periodically, on request through a
+Unix socket, and, given a `Watch`, as the targets change. Refreshes are
+serialized, so a target is never refreshed concurrently with another.
+
+The socket protocol is line based: a client sends a single command and receives
+a single line of JSON in response. The commands are:
+
+    refresh [<name> ...]  Refreshes the given (default: all) targets and
+                          returns the result of each.
+    status                Returns the status of each target.
+
+For example, with `socat`:
+
+    echo refresh | socat - UNIX-CONNECT:${socket}
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+import abc
+import json
+import pathlib
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from absl import logging
+
+# The maximum length of a command, in bytes.
+_MAX_COMMAND_LENGTH = 4096
+
+# The maximum number of seconds to wait for changes before checking whether the
+# daemon was stopped.
+_STOP_CHECK_INTERVAL = 1
+
+
+class Watch(abc.ABC):
+  """Reports changes to targets as they happen."""
+
+  @abc.abstractmethod
+  def start(self) -> None:
+    """Starts watching; raises OSError if unable to."""
+
+  @abc.abstractmethod
+  def changes(self, timeout: float) -> Mapping[str, Any]:
+    """Returns the changes of each target that changed, by name.
+
+    Waits up to timeout seconds for changes. The changes of a target are passed
+    to it when it is refreshed; None means that anything may have changed.
+
+    Raises:
+      OSError: If unable to keep watching.
+    """
+
+  def close(self) -> None:
+    """Stops watching."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+  """Handles a single command; see the module docstring."""
+
+  def handle(self) -> None:
+    command = self.rfile.readline(_MAX_COMMAND_LENGTH).decode().split()
+    response = self.server.target_daemon.handle_command(command)
+    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, path: pathlib.Path, target_daemon: 'Daemon') -> None:
+    self.target_daemon = target_daemon
+    super().__init__(str(path), _Handler)
+
+
+class Daemon:
+  """Refreshes targets periodically and on request.
+
+  Attributes:
+    targets: The function to refresh each target, by name. It is called with
+      no arguments, or with the changes of the target reported by `watch`. The
+      result of each call, which must be serializable as JSON, is reported in
+      the status.
+    interval: The number of seconds between periodic refreshes of all targets;
+      if None, targets are only refreshed on request or as they change.
+    socket_path: The path of the Unix socket to listen on; if None, no socket
+      is created.
+    watch: If set, refresh targets as it reports changes. If it fails, all
+      targets are refreshed and then periodically refreshed instead.
+    fallback_interval: The interval to use if watch fails and no interval is
+      set.
+    status: The status of each target, by name.
+  """
+
+  def __init__(self,
+               targets: Mapping[str, Callable[..., Any]],
+               interval: Optional[float] = None,
+               socket_path: Optional[pathlib.Path] = None,
+               watch: Optional[Watch] = None,
+               fallback_interval: float = 300) -> None:
+    self.targets = targets
+    self.interval = interval
+    self.socket_path = socket_path
+    self.watch = watch
+    self.fallback_interval = fallback_interval
+    self.status: Dict[str, Dict[str, Any]] = {
+        name: {'refreshes': 0} for name in targets
+    }
+
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._ready = threading.Event()
+
+  def refresh(self,
+              names: Optional[Iterable[str]] = None,
+              changes: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """Refreshes the given (default: all) targets.
+
+    Errors are logged and recorded in the status instead of raised, so a
+    failing target does not stop the others.
+
+    Args:
+      names: The names of the targets to refresh.
+      changes: If set, the changes to pass to each target.
+
+    Returns:
+      The status of each refreshed target.
+
+    Raises:
+      KeyError: If any of names is not a target.
+    """
+    names = list(self.targets if names is None else names)
+    for name in names:
+      if name not in self.targets:
+        raise KeyError(f'No such target: {name}.')
+
+    statuses = {}
+    with self._lock:
+      for name in names:
+        status = self.status[name]
+        start = time.time()
+        try:
+          if changes is None:
+            status['result'] = self.targets[name]()
+          else:
+            status['result'] = self.targets[name](changes[name])
+          status.pop('error', None)
+        except Exception as error:  # pylint: disable=broad-except
+          logging.exception('Failed to refresh %s.', name)
+          status['error'] = repr(error)
+        status['refreshes'] += 1
+        status['last_refresh'] = start
+        status['last_refresh_seconds'] = time.time() - start
+        statuses[name] = dict(status)
+    return statuses
+
+  def handle_command(self, command: List[str]) -> Dict[str, Any]:
+    """Returns the response to command; see the module docstring."""
+    if command and command[0] == 'refresh':
+      try:
+        return self.refresh(command[1:] or None)
+      except KeyError as error:
+        return {'error': str(error.args[0])}
+    if command == ['status']:
+      with self._lock:
+        return {name: dict(status) for name, status in self.status.items()}
+    return {'error': f'Unknown command: {" ".join(command)}.'}
+
+  def _remove_stale_socket(self) -> None:
+    try:
+      if stat.S_ISSOCK(self.socket_path.lstat().st_mode):
+        self.socket_path.unlink()
+    except FileNotFoundError:
+      pass
+
+  def serve_forever(self) -> None:
+    """Refreshes all targets, then serves until `stop` is called."""
+    server = None
+    if self.socket_path is not None:
+      self._remove_stale_socket()
+      server = _Server(self.socket_path, self)
+      threading.Thread(target=server.serve_forever, daemon=True).start()
+      logging.info('Listening on %s.', self.socket_path)
+
+    self._start_watch()
+    try:
+      self.refresh()
+      self._ready.set()
+      next_refresh = self._next_refresh()
+      while not self._stopped.is_set():
+        timeout = None
+        if next_refresh is not None:
+          timeout = max(0, next_refresh - time.monotonic())
+        if self.watch is None:
+          self._stopped.wait(timeout)
+        else:
+          self._refresh_changes(_STOP_CHECK_INTERVAL if timeout is None else
+                                min(timeout, _STOP_CHECK_INTERVAL))
+          if self.watch is None:
+            # Watching failed, so everything was refreshed.
+            next_refresh = self._next_refresh()
+        if (not self._stopped.is_set() and next_refresh is not None and
+            time.monotonic() >= next_refresh):
+          self.refresh()
+          next_refresh = self._next_refresh()
+    finally:
+      if self.watch is not None:
+        self.watch.close()
+      if server is not None:
+        server.shutdown()
+        server.server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+  def _next_refresh(self) -> Optional[float]:
+    """Returns the monotonic time of the next periodic refresh, if any."""
+    if self.interval is None:
+      return None
+    return time.monotonic() + self.interval
+
+  def _fall_back(self, error: OSError) -> None:
+    """Stops watching after error, refreshing periodically instead."""
+    self.watch.close()
+    self.watch = None
+    self.interval = self.interval or self.fallback_interval
+    logging.warning('Unable to watch for changes: %s; refreshing every %s '
+                    'seconds instead.', error, self.interval)
+
+  def _start_watch(self) -> None:
+    """Starts watch, if any, falling back to refreshing periodically."""
+    if self.watch is None:
+      return
+    try:
+      self.watch.start()
+    except OSError as error:
+      self._fall_back(error)
+
+  def _refresh_changes(self, timeout: float) -> None:
+    """Refreshes the targets that watch reports changed within timeout."""
+    try:
+      changes = self.watch.changes(timeout)
+    except OSError as error:
+      self._fall_back(error)
+      # Changes may have been missed.
+      self.refresh()
+      return
+    if changes:
+      self.refresh(changes, changes)
+
+  def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+    """Waits for the first refresh of all targets; returns if it finished."""
+    return self._ready.wait(timeout)
+
+  def stop(self) -> None:
+    """Makes `serve_forever` return after the current refresh, if any."""
+    self._stopped.set()
+
+
+def request(socket_path: pathlib.Path,
+            command: str,
+            timeout: Optional[float] = None) -> Dict[str, Any]:
+  """Sends command to the daemon listening on socket_path; returns the reply."""
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+    client.settimeout(timeout)
+    client.connect(str(socket_path))
+    client.sendall(command.encode() + b'\n')
+    with client.makefile('rb') as stream:
+      return json.loads(stream.readline())
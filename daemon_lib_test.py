@@ -0,0 +1,156 @@
+import pathlib
+import tempfile
+import threading
+import time
+
+from absl.testing import absltest
+
+import daemon_lib
+
+
+class DaemonTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.calls = []
+    self.targets = {
+        'a': lambda: self.calls.append('a') or len(self.calls),
+        'b': lambda: self.calls.append('b') or len(self.calls),
+    }
+
+  def test_refresh(self):
+    """Ensures refresh calls the targets and records their status."""
+    daemon = daemon_lib.Daemon(self.targets)
+
+    self.assertEqual(daemon.refresh(['b'])['b']['result'], 1)
+    statuses = daemon.refresh()
+
+    self.assertEqual(self.calls, ['b', 'a', 'b'])
+    self.assertEqual(statuses['a']['refreshes'], 1)
+    self.assertEqual(statuses['b']['refreshes'], 2)
+    self.assertEqual(statuses['b']['result'], 3)
+    with self.assertRaises(KeyError):
+      daemon.refresh(['c'])
+
+  def test_refresh_error(self):
+    """Ensures a failing target is recorded and does not stop the others."""
+
+    def fail():
+      raise ValueError('failed')
+
+    daemon = daemon_lib.Daemon({'fail': fail, **self.targets})
+
+    statuses = daemon.refresh()
+
+    self.assertIn('failed', statuses['fail']['error'])
+    self.assertNotIn('result', statuses['fail'])
+    self.assertEqual(self.calls, ['a', 'b'])
+
+  def test_handle_command(self):
+    """Ensures commands are handled and errors returned."""
+    daemon = daemon_lib.Daemon(self.targets)
+
+    self.assertEqual(daemon.handle_command(['status'])['a'], {'refreshes': 0})
+    self.assertEqual(list(daemon.handle_command(['refresh', 'a'])), ['a'])
+    self.assertIn('error', daemon.handle_command(['refresh', 'c']))
+    self.assertIn('error', daemon.handle_command(['unknown']))
+    self.assertIn('error', daemon.handle_command([]))
+
+  def test_serve_forever(self):
+    """Ensures the daemon refreshes on start and serves the socket."""
+    # Unix socket paths are limited in length, so avoid the test tempdir.
+    socket_path = pathlib.Path(
+        self.enter_context(tempfile.TemporaryDirectory(dir='/tmp'))) / 'socket'
+    daemon = daemon_lib.Daemon(self.targets, socket_path=socket_path)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+      self.assertTrue(daemon.wait_until_ready(timeout=10))
+      self.assertEqual(self.calls, ['a', 'b'])
+
+      response = daemon_lib.request(socket_path, 'refresh b', timeout=10)
+      self.assertEqual(response['b']['result'], 3)
+      response = daemon_lib.request(socket_path, 'status', timeout=10)
+      self.assertEqual(response['a']['refreshes'], 1)
+      self.assertEqual(response['b']['refreshes'], 2)
+    finally:
+      daemon.stop()
+      thread.join(timeout=10)
+
+    self.assertFalse(thread.is_alive())
+    self.assertFalse(socket_path.exists())
+
+  def test_serve_forever_interval(self):
+    """Ensures the daemon refreshes periodically."""
+    daemon = daemon_lib.Daemon(self.targets, interval=0.01)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+      self.assertTrue(daemon.wait_until_ready(timeout=10))
+      while len(self.calls) < 6:
+        time.sleep(0.01)
+    finally:
+      daemon.stop()
+      thread.join(timeout=10)
+
+    self.assertGreaterEqual(daemon.status['a']['refreshes'], 3)
+
+
+  def test_serve_forever_watch(self):
+    """Ensures the daemon refreshes targets as the watch reports changes."""
+    calls = []
+    daemon = None
+
+    class FakeWatch(daemon_lib.Watch):
+
+      def __init__(self):
+        self.reported = False
+
+      def start(self):
+        pass
+
+      def changes(self, timeout):
+        if self.reported:
+          daemon.stop()
+          return {}
+        self.reported = True
+        return {'a': {'changed'}}
+
+    daemon = daemon_lib.Daemon(
+        {'a': lambda changes=None: calls.append(('a', changes)),
+         'b': lambda changes=None: calls.append(('b', changes))},
+        watch=FakeWatch())
+    daemon.serve_forever()
+
+    self.assertEqual(calls, [('a', None), ('b', None), ('a', {'changed'})])
+
+  def test_serve_forever_watch_fallback(self):
+    """Ensures the daemon refreshes periodically if watching fails."""
+
+    class FailingWatch(daemon_lib.Watch):
+
+      def start(self):
+        raise OSError('watch limit reached')
+
+      def changes(self, timeout):
+        raise AssertionError('not started')
+
+    daemon = daemon_lib.Daemon(
+        self.targets, watch=FailingWatch(), fallback_interval=0.01)
+    thread = threading.Thread(target=daemon.serve_forever)
+    with self.assertLogs(level='WARNING'):
+      thread.start()
+      try:
+        self.assertTrue(daemon.wait_until_ready(timeout=10))
+        while len(self.calls) < 6:
+          time.sleep(0.01)
+      finally:
+        daemon.stop()
+        thread.join(timeout=10)
+
+    self.assertIsNone(daemon.watch)
+    self.assertEqual(daemon.interval, 0.01)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -1,15 +1,25 @@
-"""Load all submodules in this module.
+"""Lazily load submodules in this module.
 
-Taken from https://stackoverflow.com/a/3365846/4330447.
+All submodules are listed in `__all__`, but each is only imported on first
+attribute access (e.g. `derived_metadata.financials`), so a run only pays for
+importing the derivations it actually uses. See PEP 562.
 """
 
 import importlib
 import pkgutil
 
-__all__ = []
-for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
-  if module_name.endswith('_test'):
-    continue
-  __all__.append(module_name)
-  _module = importlib.import_module(f'.{module_name}', 'derived_metadata')
-  globals()[module_name] = _module
+__all__ = [
+    module_name for _, module_name, _ in pkgutil.iter_modules(__path__)
+    if not module_name.endswith('_test')
+]
+
+
+def __getattr__(name: str):
+  """Imports the submodule on first use."""
+  if name not in __all__:
+    raise AttributeError(f'module {__name__} has no attribute {name}')
+  return importlib.import_module(f'.{name}', __name__)
+
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
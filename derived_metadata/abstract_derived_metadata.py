@@ -1,4 +1,4 @@
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
 import abc
 import pathlib
@@ -11,7 +11,7 @@ try:
   from google.protobuf.pyext.cpp_message import GeneratedProtocolMessageType
 except ImportError:
   GeneratedProtocolMessageType = Any
-  logging.info(
+  logging.debug(
       'Not using the real GeneratedProtocolMessageType; using Any instead.')
 
 import protos.symfs_pb2 as symfs_pb2
@@ -40,6 +40,19 @@ class AbstractDerivedMetadata(abc.ABC):
     Returns: The derived Metadata proto.
     """
 
+  def prepare(self, paths: Sequence[pathlib.Path]) -> None:
+    """Prepares to derive the Metadata of paths.
+
+    Called with all the items of a full scan before any of them is derived,
+    for derivations that depend on the whole set of items; the items are only
+    listed up front if this is overridden. Scans of only some items (e.g. by
+    `SymFs.refresh` given the changed paths) do not call this, and the same
+    object derives the items of all scans of a SymFs. Does nothing by default.
+
+    Args:
+      paths: The paths for which metadata will be derived.
+    """
+
   def _pack(self, m: message.Message) -> symfs_pb2.Metadata:
     """Packs the given message into a Metadata proto."""
     metadata = symfs_pb2.Metadata()
@@ -1,7 +1,9 @@
 """Functions to derive metadata for everchanging.symfs.ext.GenericValues."""
 
-from typing import Iterator
+from typing import Dict, Iterator, List, Sequence
 
+import hashlib
+import math
 import pathlib
 import random
 
@@ -28,6 +30,18 @@ class FixedGrouping(AbstractDerivedMetadata):
   We choose to keep track of all groups in a list to enforce the fact that the
   size of each group will only differ by a maximal of 1.
 
+  If `consistent` is set, we instead rank all groups for each item by a hash of
+  the item path and the group (rendezvous hashing), and take the top
+  `per_group` groups. Since the ranking of an item does not depend on any other
+  item, adding or removing items does not move the existing items. To bound the
+  imbalance, we keep track of the number of items in each group, and skip
+  groups that are at capacity (bounded-load rendezvous hashing). So that the
+  assignment does not depend on the order of the scan, `prepare` assigns all
+  items of a full scan up front, in order of their hash, with a capacity based
+  on their total. Items derived after that (e.g. when only the changed items
+  are scanned) keep their prepared groups, and new items are assigned on top
+  of the prepared loads.
+
   Attributes:
     current: An iterator to the next group.
   """
@@ -36,11 +50,7 @@ class FixedGrouping(AbstractDerivedMetadata):
 
   def _generate_current_iter(self) -> Iterator[int]:
     """Generates the `current` iterator."""
-    num_groups = self.parameters.num_groups
-    if num_groups < 1:
-      num_groups = 10
-
-    groups = list(range(num_groups))
+    groups = list(range(self._num_groups))
 
     while True:
       if self.parameters.random:
@@ -50,20 +60,135 @@ class FixedGrouping(AbstractDerivedMetadata):
   def __init__(self, *args, **kwargs):
     """Initializes the `current` iterator."""
     super().__init__(*args, **kwargs)
-    self.current = self._generate_current_iter()
 
     # Store as class attribute so we can just perform logic once.
+    self._num_groups = self.parameters.num_groups
+    if self._num_groups < 1:
+      self._num_groups = 10
+
     self._per_group = self.parameters.per_group
     if self._per_group < 1:
       self._per_group = 1
 
+    if self.parameters.consistent and self.parameters.random:
+      raise ValueError('Cannot set both consistent and random.')
+    if 0 < self.parameters.max_load_factor < 1:
+      raise ValueError('max_load_factor must be 0 or at least 1.')
+
+    self.current = self._generate_current_iter()
+    self._loads = [0] * self._num_groups
+    self._prepared: Dict[pathlib.Path, List[int]] = {}
+
+  def _key(self, path: pathlib.Path) -> bytes:
+    """Returns the key path is hashed by."""
+    if self.parameters.relative_to:
+      path = path.relative_to(self.parameters.relative_to)
+    return str(path).encode()
+
+  def _rank_groups(self, key: bytes) -> List[int]:
+    """Returns all groups ordered by preference for the given key."""
+
+    def weight(group: int) -> bytes:
+      return hashlib.blake2b(
+          key, digest_size=8, salt=group.to_bytes(8, 'little')).digest()
+
+    return sorted(range(self._num_groups), key=weight, reverse=True)
+
+  def prepare(self, paths: Sequence[pathlib.Path]) -> None:
+    """Assigns the groups of all paths with `max_load_factor`.
+
+    Paths are assigned in order of their hash, with a capacity based on their
+    total, so the assignment only depends on the set of paths: adding a path
+    only moves the few paths that overflow because of it.
+    """
+    if not (self.parameters.consistent and self.parameters.max_load_factor):
+      return
+    keys = {}
+    for path in paths:
+      try:
+        keys[path] = self._key(path)
+      except ValueError:
+        pass  # Fails again, and is reported, when derived.
+
+    self._loads = [0] * self._num_groups
+    self._prepared = {}
+    capacity = math.ceil(self.parameters.max_load_factor * len(keys) *
+                         self._per_group / self._num_groups)
+    per_group = min(self._per_group, self._num_groups)
+    members = [[] for _ in range(self._num_groups)]
+    for path, key in sorted(
+        keys.items(),
+        key=lambda item: hashlib.blake2b(item[1], digest_size=8).digest()):
+      ranked_groups = self._rank_groups(key)
+      groups = [
+          group for group in ranked_groups if self._loads[group] < capacity
+      ][:per_group]
+      for group in groups:
+        self._loads[group] += 1
+      for group in ranked_groups:
+        if len(groups) == per_group:
+          break
+        if group in groups:
+          continue
+        # Every group with room is one of this path's (and, as the capacity
+        # is based on the total, one of them still has room): move a path
+        # without it there from group, which always exists, to make room.
+        spare = next(
+            spare for spare in groups if self._loads[spare] < capacity)
+        moved = next(moved for moved in reversed(members[group])
+                     if spare not in self._prepared[moved])
+        members[group].remove(moved)
+        members[spare].append(moved)
+        moved_groups = self._prepared[moved]
+        moved_groups[moved_groups.index(group)] = spare
+        self._loads[spare] += 1
+        groups.append(group)
+      for group in groups:
+        members[group].append(path)
+      self._prepared[path] = groups
+
+  def _consistent_groups(self, path: pathlib.Path) -> List[int]:
+    """Returns the `per_group` groups for path based on rendezvous hashing."""
+    if path in self._prepared:
+      return self._prepared[path]
+    ranked_groups = self._rank_groups(self._key(path))
+    if not self.parameters.max_load_factor:
+      return ranked_groups[:self._per_group]
+
+    # Not prepared; capacity is based on the load after this item is assigned,
+    # so there is always at least one group with room.
+    capacity = math.ceil(self.parameters.max_load_factor *
+                         (sum(self._loads) + self._per_group) /
+                         self._num_groups)
+    return self._assign_groups(ranked_groups, capacity)
+
+  def _assign_groups(self, ranked_groups: List[int],
+                     capacity: int) -> List[int]:
+    """Returns the `per_group` preferred groups with room, and loads them."""
+    groups = []
+    for group in ranked_groups:
+      if self._loads[group] < capacity:
+        groups.append(group)
+        if len(groups) == self._per_group:
+          break
+    else:
+      # Not enough groups with room when per_group > 1; ignore capacity for
+      # the remaining groups so every item still gets per_group groups.
+      groups.extend(
+          [group for group in ranked_groups if group not in groups
+          ][:self._per_group - len(groups)])
+    for group in groups:
+      self._loads[group] += 1
+    return groups
+
   def derive(self, path: pathlib.Path) -> symfs_pb2.Metadata:
     """Derives a GenericValues proto that groups items into fixed chunks."""
-    # The path itself does not influence the output.
-    del path
-
     generic_values = ext_pb2.GenericValues()
-    for _ in range(self._per_group):
-      generic_values.numbers.append(next(self.current))
+    if self.parameters.consistent:
+      generic_values.numbers.extend(self._consistent_groups(path))
+    else:
+      # The path itself does not influence the output.
+      for _ in range(self._per_group):
+        generic_values.numbers.append(next(self.current))
 
     return self._pack(generic_values)
@@ -1,7 +1,9 @@
 from typing import List
 from unittest import mock
 
+import collections
 import functools
+import pathlib
 import random
 
 from absl.testing import absltest
@@ -35,6 +37,21 @@ def _collect_numbers(
   return numbers
 
 
+def _consistent_groups(
+    fixed_grouping: derived_metadata.generic_values.FixedGrouping,
+    paths: List[pathlib.Path],
+    prepare: bool = False) -> List[List[int]]:
+  """Collects the numbers from a consistent FixedGrouping for each path."""
+  if prepare:
+    fixed_grouping.prepare(paths)
+  groups = []
+  for path in paths:
+    generic_values = ext_pb2.GenericValues()
+    fixed_grouping.derive(path).data.Unpack(generic_values)
+    groups.append(list(generic_values.numbers))
+  return groups
+
+
 def _make_fixed_grouping_parameters(**kwargs) -> any_pb2.Any:
   """Creates FixedGroupingParameters as Any proto from the kwargs."""
   fixed_grouping_parameters = ext_pb2.GenericValues.FixedGroupingParameters(
@@ -90,6 +107,154 @@ class GenericValuesTest(parameterized.TestCase):
     self.assertEqual(mock_shuffle.call_count, iterations // num_groups)
     self.assertEqual(numbers, iterations * [shuffle_value])
 
+  def test_fixed_grouping_consistent_is_deterministic(self):
+    """Ensures consistent grouping only depends on the path."""
+    paths = [pathlib.Path(f'/source/item_{i}') for i in range(100)]
+    parameters = _make_fixed_grouping_parameters(
+        num_groups=7, per_group=2, consistent=True)
+
+    groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters), paths)
+    reversed_groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters),
+        paths[::-1])
+
+    self.assertEqual(groups, reversed_groups[::-1])
+    for numbers in groups:
+      self.assertLen(set(numbers), 2)
+      self.assertTrue(all(0 <= number < 7 for number in numbers))
+
+  def test_fixed_grouping_consistent_stable(self):
+    """Ensures adding an item does not move existing items."""
+    paths = [pathlib.Path(f'/source/item_{i}') for i in range(200)]
+    parameters = _make_fixed_grouping_parameters(
+        num_groups=10, consistent=True)
+
+    groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters), paths)
+    more_groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters),
+        paths + [pathlib.Path('/source/new_item')])
+
+    self.assertEqual(groups, more_groups[:-1])
+
+  def test_fixed_grouping_consistent_relative_to(self):
+    """Ensures relative_to makes the grouping independent of the root."""
+    names = [f'item_{i}' for i in range(50)]
+    parameters = _make_fixed_grouping_parameters(
+        num_groups=10, consistent=True, relative_to='/a')
+    moved_parameters = _make_fixed_grouping_parameters(
+        num_groups=10, consistent=True, relative_to='/b/c')
+
+    self.assertEqual(
+        _consistent_groups(
+            derived_metadata.generic_values.FixedGrouping(parameters),
+            [pathlib.Path('/a', name) for name in names]),
+        _consistent_groups(
+            derived_metadata.generic_values.FixedGrouping(moved_parameters),
+            [pathlib.Path('/b/c', name) for name in names]))
+
+  @parameterized.parameters((1, 1.0), (1, 1.25), (3, 1.0), (3, 1.5))
+  def test_fixed_grouping_consistent_max_load_factor(self, per_group,
+                                                     max_load_factor):
+    """Ensures max_load_factor bounds the size of each group."""
+    num_groups = 8
+    num_items = 400
+    fixed_grouping = derived_metadata.generic_values.FixedGrouping(
+        _make_fixed_grouping_parameters(
+            num_groups=num_groups,
+            per_group=per_group,
+            consistent=True,
+            max_load_factor=max_load_factor))
+
+    groups = _consistent_groups(
+        fixed_grouping,
+        [pathlib.Path(f'/source/item_{i}') for i in range(num_items)],
+        prepare=True)
+    sizes = collections.Counter(
+        number for numbers in groups for number in numbers)
+
+    self.assertLessEqual(
+        max(sizes.values()),
+        -(-max_load_factor * num_items * per_group // num_groups))
+    for numbers in groups:
+      self.assertLen(set(numbers), per_group)
+
+  @parameterized.parameters((1, 1.25), (3, 1.5))
+  def test_fixed_grouping_consistent_max_load_factor_stable(
+      self, per_group, max_load_factor):
+    """Ensures adding an item moves few items, whatever the scan order."""
+    num_groups = 8
+    paths = [pathlib.Path(f'/source/item_{i}') for i in range(400)]
+    parameters = _make_fixed_grouping_parameters(
+        num_groups=num_groups,
+        per_group=per_group,
+        consistent=True,
+        max_load_factor=max_load_factor)
+
+    groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters),
+        paths,
+        prepare=True)
+    for i in range(10):
+      # The new item is scanned first, which must not matter.
+      more_groups = _consistent_groups(
+          derived_metadata.generic_values.FixedGrouping(parameters),
+          [pathlib.Path(f'/source/new_item_{i}')] + paths,
+          prepare=True)
+
+      moved = sum(
+          numbers != more_numbers
+          for numbers, more_numbers in zip(groups, more_groups[1:]))
+      self.assertLessEqual(moved, num_groups)
+
+  def test_fixed_grouping_consistent_max_load_factor_order(self):
+    """Ensures prepared groups do not depend on the order of the paths."""
+    paths = [pathlib.Path(f'/source/item_{i}') for i in range(100)]
+    parameters = _make_fixed_grouping_parameters(
+        num_groups=7, per_group=2, consistent=True, max_load_factor=1.0)
+
+    groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters),
+        paths,
+        prepare=True)
+    reversed_groups = _consistent_groups(
+        derived_metadata.generic_values.FixedGrouping(parameters),
+        paths[::-1],
+        prepare=True)
+
+    self.assertEqual(groups, reversed_groups[::-1])
+
+  def test_fixed_grouping_consistent_max_load_factor_unprepared(self):
+    """Ensures items derived after prepare keep to the prepared loads."""
+    num_groups = 4
+    paths = [pathlib.Path(f'/source/item_{i}') for i in range(40)]
+    fixed_grouping = derived_metadata.generic_values.FixedGrouping(
+        _make_fixed_grouping_parameters(
+            num_groups=num_groups, consistent=True, max_load_factor=1.0))
+    groups = _consistent_groups(fixed_grouping, paths, prepare=True)
+
+    # As when only the changed items are scanned again.
+    changed_groups = _consistent_groups(fixed_grouping, paths[:5])
+    new_groups = _consistent_groups(
+        fixed_grouping,
+        [pathlib.Path(f'/source/new_item_{i}') for i in range(4)])
+
+    self.assertEqual(changed_groups, groups[:5])
+    sizes = collections.Counter(
+        number for numbers in groups + new_groups for number in numbers)
+    self.assertEqual(max(sizes.values()), 11)
+
+  @parameterized.parameters(
+      (dict(consistent=True, random=True), 'Cannot set both'),
+      (dict(consistent=True, max_load_factor=0.5), 'max_load_factor'),
+  )
+  def test_fixed_grouping_consistent_invalid(self, kwargs, regex):
+    """Ensures invalid consistent parameters are rejected."""
+    with self.assertRaisesRegex(ValueError, regex):
+      derived_metadata.generic_values.FixedGrouping(
+          _make_fixed_grouping_parameters(**kwargs))
+
 
 if __name__ == '__main__':
   absltest.main()
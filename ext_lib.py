@@ -1,21 +1,30 @@
 # This library should import all extension protos used by symfs.
 
 from types import ModuleType
-from typing import Any, Callable, Iterable, Iterator, Optional, Union
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Union
 
+import functools
 import pathlib
 
 from absl import logging
 from google.protobuf import any_pb2
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
 from google.protobuf import message
+from google.protobuf import message_factory
 
 try:
   from google.protobuf.pyext.cpp_message import GeneratedProtocolMessageType
 except ImportError:
   GeneratedProtocolMessageType = Any
-  logging.info(
+  logging.debug(
       'Not using the real GeneratedProtocolMessageType; using Any instead.')
 
+try:
+  from google.protobuf.internal import api_implementation
+except ImportError:
+  api_implementation = None
+
 import derived_metadata
 import protos.ext_pb2 as ext_pb2
 import protos.symfs_pb2 as symfs_pb2
@@ -30,11 +39,56 @@ DerivedMetadataClass = derived_metadata.abstract_derived_metadata.AbstractDerive
 Derivation = Union[DerivedMetadataFunction, DerivedMetadataClass]
 
 
+def _find_prototype(type_name: str,
+                    include_modules: Iterable) -> GeneratedProtocolMessageType:
+  """Searches include_modules for the prototype; see get_prototype."""
+  for module in include_modules:
+    try:
+      return getattr(module, '_sym_db').GetSymbol(type_name)
+    except KeyError:
+      logging.debug('Did not find %s in %s.', type_name, module.__name__)
+
+  raise KeyError(f'Unable to find message {type_name}.')
+
+
+def get_protobuf_backend() -> str:
+  """Returns the protobuf backend in use: 'upb', 'cpp', or 'python'.
+
+  The pure Python backend is an order of magnitude slower to parse and
+  serialize; it is used if no compiled backend is installed, or if
+  `PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python` is set. Returns 'unknown' if
+  the (internal) API to tell is missing.
+  """
+  try:
+    return api_implementation.Type()
+  except AttributeError:
+    return 'unknown'
+
+
+@functools.cache
+def _get_default_prototype(type_name: str) -> GeneratedProtocolMessageType:
+  """Returns the prototype from _EXT_PROTO_MODULES or loaded descriptor sets."""
+  try:
+    return _find_prototype(type_name, _EXT_PROTO_MODULES)
+  except KeyError:
+    pass
+
+  try:
+    return message_factory.GetMessageClass(
+        descriptor_pool.Default().FindMessageTypeByName(type_name))
+  except KeyError:
+    raise KeyError(f'Unable to find message {type_name}.') from None
+
+
 def get_prototype(
     type_name: str,
     include_modules: Optional[Iterable] = None) -> GeneratedProtocolMessageType:
   """Get prototype given the name.
 
+  If include_modules is not given, we search `_EXT_PROTO_MODULES` and then any
+  types loaded with `load_descriptor_set`. The result is memoized per
+  type_name in that case, as this is called for every item.
+
   Args:
     type_name: The fully qualified message name (not type_url).
     include_modules: An iterable of modules to search for type.
@@ -46,19 +100,52 @@ def get_prototype(
     The prototype that can be used to construct proto messages.
   """
   if include_modules is None:
-    include_modules = _EXT_PROTO_MODULES
-  for module in include_modules:
+    return _get_default_prototype(type_name)
+  return _find_prototype(type_name, include_modules)
+
+
+def load_descriptor_set(path: pathlib.Path) -> List[str]:
+  """Loads the message types in a serialized FileDescriptorSet.
+
+  This allows new metadata types to be used without rebuilding SymFs. The
+  FileDescriptorSet can be generated with, e.g.:
+
+      protoc --include_imports --descriptor_set_out=<path> <proto>
+
+  Files must be in dependency order (as generated by protoc); files that are
+  already loaded (e.g. google/protobuf/any.proto) are skipped.
+
+  Args:
+    path: The path to the serialized FileDescriptorSet.
+
+  Returns:
+    The names of the files that were loaded.
+  """
+  file_descriptor_set = descriptor_pb2.FileDescriptorSet.FromString(
+      path.read_bytes())
+  pool = descriptor_pool.Default()
+
+  loaded = []
+  for file_descriptor in file_descriptor_set.file:
     try:
-      return getattr(module, '_sym_db').GetSymbol(type_name)
+      pool.FindFileByName(file_descriptor.name)
     except KeyError:
-      logging.warning('Did not find %s in %s.', type_name, module.__name__)
+      pool.AddSerializedFile(file_descriptor.SerializeToString())
+      loaded.append(file_descriptor.name)
+    else:
+      logging.debug('%s is already loaded; skipping.', file_descriptor.name)
 
-  raise KeyError(f'Unable to find message {type_name}.')
+  logging.info('Loaded %s from %s.', loaded, path)
+  return loaded
 
 
+@functools.cache
 def get_derived_metadata_derivation(name: str) -> Derivation:
   """Get function or class given the name.
 
+  Modules under `derived_metadata` are imported lazily, so only the module that
+  contains the derivation is imported, on first use. The result is memoized.
+
   Args:
     name: The fully-qualified name of the function/class (including module(s)).
 
@@ -1,3 +1,11 @@
+from unittest import mock
+
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+
 from absl.testing import absltest
 from absl.testing import parameterized
 from google.protobuf import descriptor_pb2
@@ -7,6 +15,29 @@ import ext_lib
 import protos.ext_pb2 as ext_pb2
 
 
+def make_descriptor_set(file_name: str,
+                        package: str) -> descriptor_pb2.FileDescriptorSet:
+  """Returns a FileDescriptorSet with a RuntimeMessage in the package."""
+  FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+  return descriptor_pb2.FileDescriptorSet(file=[
+      descriptor_pb2.FileDescriptorProto(
+          name=file_name,
+          package=package,
+          syntax='proto3',
+          message_type=[
+              descriptor_pb2.DescriptorProto(
+                  name='RuntimeMessage',
+                  field=[
+                      FieldDescriptorProto(
+                          name='values',
+                          number=1,
+                          type=FieldDescriptorProto.TYPE_STRING,
+                          label=FieldDescriptorProto.LABEL_REPEATED),
+                  ]),
+          ]),
+  ])
+
+
 class ExtLibTest(parameterized.TestCase):
   """Tests for ext_lib."""
 
@@ -25,6 +56,39 @@ class ExtLibTest(parameterized.TestCase):
                                 f'Unable to find message {type_name}'):
       ext_lib.get_prototype(type_name)
 
+  def test_get_prototype_cached(self):
+    """Ensures the prototype is only searched for once, without warnings."""
+    type_name = 'everchanging.symfs.ext.FinancialStatement'
+    with mock.patch.object(
+        ext_lib, '_find_prototype',
+        wraps=ext_lib._find_prototype) as mock_find_prototype:
+      with self.assertNoLogs(level='WARNING'):
+        for _ in range(3):
+          self.assertEqual(
+              ext_lib.get_prototype(type_name), ext_pb2.FinancialStatement)
+
+    mock_find_prototype.assert_called_once()
+
+  def test_load_descriptor_set(self):
+    """Ensures types in a FileDescriptorSet can be found after loading."""
+    descriptor_set = make_descriptor_set('ext_lib_test/runtime.proto',
+                                         'everchanging.symfs.ext_lib_test')
+    type_name = 'everchanging.symfs.ext_lib_test.RuntimeMessage'
+    with self.assertRaises(KeyError):
+      ext_lib.get_prototype(type_name)
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = pathlib.Path(directory) / 'runtime.pb'
+      path.write_bytes(descriptor_set.SerializeToString())
+      self.assertEqual(
+          ext_lib.load_descriptor_set(path), ['ext_lib_test/runtime.proto'])
+      # Loading again is a no-op.
+      self.assertEmpty(ext_lib.load_descriptor_set(path))
+
+    message = ext_lib.get_prototype(type_name)(values=['a', 'b'])
+    self.assertEqual(message.DESCRIPTOR.full_name, type_name)
+    self.assertEqual(list(message.values), ['a', 'b'])
+
   @parameterized.parameters(
       ('derived_metadata.financials.from_statement_path',
        derived_metadata.financials.from_statement_path),
@@ -36,6 +100,38 @@ class ExtLibTest(parameterized.TestCase):
     self.assertEqual(
         ext_lib.get_derived_metadata_derivation(name), expected_derivation)
 
+  def test_derivations_imported_lazily(self):
+    """Ensures only the requested derivation module is imported."""
+    program = '\n'.join((
+        'import sys',
+        'import ext_lib',
+        'assert "derived_metadata.financials" not in sys.modules',
+        'assert "derived_metadata.generic_values" not in sys.modules',
+        'ext_lib.get_derived_metadata_derivation(',
+        '    "derived_metadata.financials.from_statement_path")',
+        'assert "derived_metadata.financials" in sys.modules',
+        'assert "derived_metadata.generic_values" not in sys.modules',
+    ))
+    subprocess.run((sys.executable, '-c', program),
+                   check=True,
+                   env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+  def test_get_protobuf_backend(self):
+    """Ensures the backend selected by the environment is reported."""
+    program = 'import ext_lib; print(ext_lib.get_protobuf_backend())'
+    output = subprocess.run(
+        (sys.executable, '-c', program),
+        check=True,
+        capture_output=True,
+        text=True,
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(sys.path),
+            PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION='python')).stdout
+
+    self.assertEqual(output.strip(), 'python')
+    self.assertIn(ext_lib.get_protobuf_backend(), ('upb', 'cpp', 'python'))
+
 
 if __name__ == '__main__':
   absltest.main()
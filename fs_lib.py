@@ -0,0 +1,558 @@
+"""Filesystem interface used by SymFs for all of its I/O.
+
+`LocalFileSystem` performs the operations on the real filesystem, while
+`InMemoryFileSystem` keeps the whole tree in memory and counts each operation
+as a syscall, which allows benchmarking SymFs without disk I/O and asserting
+syscall budgets in tests.
+
+Walking is done with `walk`, which yields entries similar to `os.DirEntry`, so
+that the type of each entry is known without an extra `stat` (on most
+filesystems, `os.scandir` gets the type for free).
+"""
+
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Union
+
+import abc
+import collections
+import errno
+import os
+import pathlib
+import shutil
+import stat as stat_lib
+
+from absl import logging
+
+# The maximum number of symlinks to follow before giving up (as Linux).
+_MAX_SYMLINKS = 40
+
+# Errors that mean a path does not exist (as pathlib.Path.exists).
+_NOT_FOUND_ERRNOS = frozenset((errno.ENOENT, errno.ENOTDIR, errno.EBADF,
+                               errno.ELOOP))
+
+
+def _get_temporary_path(path: pathlib.Path) -> pathlib.Path:
+  """Returns the path to write the content of path to before renaming it."""
+  return path.with_name(f'.{path.name}.tmp')
+
+
+class StatResult(NamedTuple):
+  """The subset of os.stat_result that SymFs uses."""
+  st_mode: int
+  st_ino: int
+  st_dev: int
+  st_size: int
+  st_mtime_ns: int
+
+
+class Entry(abc.ABC):
+  """An entry yielded by `FileSystem.walk`; see `os.DirEntry`."""
+
+  path: pathlib.Path
+
+  @property
+  def name(self) -> str:
+    return self.path.name
+
+  @abc.abstractmethod
+  def is_dir(self, follow_symlinks: bool = True) -> bool:
+    """Returns whether the entry is a directory."""
+
+  @abc.abstractmethod
+  def is_file(self, follow_symlinks: bool = True) -> bool:
+    """Returns whether the entry is a file."""
+
+  @abc.abstractmethod
+  def is_symlink(self) -> bool:
+    """Returns whether the entry is a symlink."""
+
+
+class FileSystem(abc.ABC):
+  """Interface for the filesystem operations used by SymFs.
+
+  Child classes implement the primitive operations; the predicates (e.g.
+  `exists`) and `rmtree` are implemented in terms of those, but may be
+  overridden for efficiency.
+  """
+
+  @abc.abstractmethod
+  def walk(
+      self,
+      path: pathlib.Path,
+      recursive: bool = True,
+      descend: Optional[Callable[[Entry], bool]] = None) -> Iterator[Entry]:
+    """Yields all entries under path recursively, similar to rglob('*').
+
+    Symlinks to directories are yielded but not followed. Directories that
+    cannot be read (including path itself not existing) are skipped. If not
+    recursive, only the entries directly in path are yielded. If descend is
+    given, it is called with each directory after the directory is yielded,
+    and the directory is only walked if it returns True.
+    """
+
+  @abc.abstractmethod
+  def stat(self,
+           path: pathlib.Path,
+           follow_symlinks: bool = True) -> StatResult:
+    """Returns the stat of path; raises FileNotFoundError if missing."""
+
+  @abc.abstractmethod
+  def read_bytes(self, path: pathlib.Path) -> bytes:
+    """Returns the content of the file at path."""
+
+  @abc.abstractmethod
+  def write_bytes(self, path: pathlib.Path, content: bytes) -> None:
+    """Writes content to the file at path."""
+
+  @abc.abstractmethod
+  def mkdir(self,
+            path: pathlib.Path,
+            parents: bool = False,
+            exist_ok: bool = False) -> None:
+    """Creates a directory; see pathlib.Path.mkdir."""
+
+  @abc.abstractmethod
+  def symlink(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    """Creates a symlink at path to target; raises FileExistsError if taken."""
+
+  @abc.abstractmethod
+  def readlink(self, path: pathlib.Path) -> pathlib.Path:
+    """Returns the target of the symlink at path."""
+
+  @abc.abstractmethod
+  def unlink(self, path: pathlib.Path) -> None:
+    """Removes the file or symlink at path."""
+
+  @abc.abstractmethod
+  def rmdir(self, path: pathlib.Path) -> None:
+    """Removes the empty directory at path."""
+
+  @abc.abstractmethod
+  def replace(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    """Renames path to target, replacing it if it exists; see os.replace."""
+
+  def write_bytes_atomically(self, path: pathlib.Path, content: bytes) -> None:
+    """Writes content to path such that readers never see a partial file.
+
+    The content is written to a temporary file next to path, which is then
+    renamed to path. The parent directories of path are created if needed.
+    """
+    self.mkdir(path.parent, parents=True, exist_ok=True)
+    temporary_path = _get_temporary_path(path)
+    self.write_bytes(temporary_path, content)
+    self.replace(temporary_path, path)
+
+  def read_text(self, path: pathlib.Path) -> str:
+    """Returns the content of the file at path as text."""
+    return self.read_bytes(path).decode()
+
+  def _mode(self,
+            path: pathlib.Path,
+            follow_symlinks: bool = True) -> Optional[int]:
+    """Returns the st_mode of path, or None if it does not exist."""
+    try:
+      return self.stat(path, follow_symlinks=follow_symlinks).st_mode
+    except OSError as error:
+      if error.errno not in _NOT_FOUND_ERRNOS:
+        raise
+      return None
+
+  def entry(self, path: pathlib.Path) -> Optional[Entry]:
+    """Returns the entry of path, as walk would; None if it does not exist."""
+    mode = self._mode(path, follow_symlinks=False)
+    if mode is None:
+      return None
+    return _StatEntry(self, path, mode)
+
+  def exists(self, path: pathlib.Path) -> bool:
+    return self._mode(path) is not None
+
+  def lexists(self, path: pathlib.Path) -> bool:
+    """Returns whether path exists, including as a dangling symlink."""
+    return self._mode(path, follow_symlinks=False) is not None
+
+  def is_dir(self, path: pathlib.Path) -> bool:
+    mode = self._mode(path)
+    return mode is not None and stat_lib.S_ISDIR(mode)
+
+  def is_file(self, path: pathlib.Path) -> bool:
+    mode = self._mode(path)
+    return mode is not None and stat_lib.S_ISREG(mode)
+
+  def is_symlink(self, path: pathlib.Path) -> bool:
+    mode = self._mode(path, follow_symlinks=False)
+    return mode is not None and stat_lib.S_ISLNK(mode)
+
+  def rmtree(self, path: pathlib.Path) -> None:
+    """Removes path and everything under it."""
+    # Children are walked before their own children, so delete in reverse.
+    for entry in reversed(list(self.walk(path))):
+      if entry.is_dir(follow_symlinks=False):
+        self.rmdir(entry.path)
+      else:
+        self.unlink(entry.path)
+    self.rmdir(path)
+
+
+class _StatEntry(Entry):
+  """An entry of FileSystem.entry, typed by the lstat of its path."""
+
+  def __init__(self, filesystem: FileSystem, path: pathlib.Path,
+               mode: int) -> None:
+    self._filesystem = filesystem
+    self._mode = mode
+    self.path = path
+
+  def _get_mode(self, follow_symlinks: bool) -> Optional[int]:
+    if follow_symlinks and stat_lib.S_ISLNK(self._mode):
+      return self._filesystem._mode(self.path)
+    return self._mode
+
+  def is_dir(self, follow_symlinks: bool = True) -> bool:
+    mode = self._get_mode(follow_symlinks)
+    return mode is not None and stat_lib.S_ISDIR(mode)
+
+  def is_file(self, follow_symlinks: bool = True) -> bool:
+    mode = self._get_mode(follow_symlinks)
+    return mode is not None and stat_lib.S_ISREG(mode)
+
+  def is_symlink(self) -> bool:
+    return stat_lib.S_ISLNK(self._mode)
+
+
+class _LocalEntry(Entry):
+  """Wraps os.DirEntry with a pathlib.Path."""
+
+  def __init__(self, dir_entry: os.DirEntry) -> None:
+    self._dir_entry = dir_entry
+    self.path = pathlib.Path(dir_entry.path)
+
+  @property
+  def name(self) -> str:
+    return self._dir_entry.name
+
+  def is_dir(self, follow_symlinks: bool = True) -> bool:
+    return self._dir_entry.is_dir(follow_symlinks=follow_symlinks)
+
+  def is_file(self, follow_symlinks: bool = True) -> bool:
+    return self._dir_entry.is_file(follow_symlinks=follow_symlinks)
+
+  def is_symlink(self) -> bool:
+    return self._dir_entry.is_symlink()
+
+
+class LocalFileSystem(FileSystem):
+  """Performs the operations on the real filesystem."""
+
+  def walk(
+      self,
+      path: pathlib.Path,
+      recursive: bool = True,
+      descend: Optional[Callable[[Entry], bool]] = None) -> Iterator[Entry]:
+    directories = [path]
+    while directories:
+      directory = directories.pop()
+      try:
+        with os.scandir(directory) as dir_entries:
+          entries = [_LocalEntry(dir_entry) for dir_entry in dir_entries]
+      except (FileNotFoundError, NotADirectoryError):
+        continue
+      except OSError as error:
+        logging.warning('Unable to read %s: %s; skipping.', directory, error)
+        continue
+      for entry in entries:
+        yield entry
+        if (recursive and entry.is_dir(follow_symlinks=False) and
+            (descend is None or descend(entry))):
+          directories.append(entry.path)
+
+  def stat(self,
+           path: pathlib.Path,
+           follow_symlinks: bool = True) -> os.stat_result:
+    return os.stat(path, follow_symlinks=follow_symlinks)
+
+  def read_bytes(self, path: pathlib.Path) -> bytes:
+    return path.read_bytes()
+
+  def read_text(self, path: pathlib.Path) -> str:
+    return path.read_text()
+
+  def write_bytes(self, path: pathlib.Path, content: bytes) -> None:
+    path.write_bytes(content)
+
+  def mkdir(self,
+            path: pathlib.Path,
+            parents: bool = False,
+            exist_ok: bool = False) -> None:
+    path.mkdir(parents=parents, exist_ok=exist_ok)
+
+  def symlink(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    os.symlink(target, path)
+
+  def readlink(self, path: pathlib.Path) -> pathlib.Path:
+    return pathlib.Path(os.readlink(path))
+
+  def unlink(self, path: pathlib.Path) -> None:
+    os.unlink(path)
+
+  def rmdir(self, path: pathlib.Path) -> None:
+    os.rmdir(path)
+
+  def replace(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    os.replace(path, target)
+
+  def write_bytes_atomically(self, path: pathlib.Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = _get_temporary_path(path)
+    with open(temporary_path, 'wb') as stream:
+      stream.write(content)
+      # Otherwise, a crash may leave path renamed but with no content.
+      stream.flush()
+      os.fsync(stream.fileno())
+    os.replace(temporary_path, path)
+
+  def rmtree(self, path: pathlib.Path) -> None:
+    shutil.rmtree(path)
+
+
+class _Node:
+  """A file, directory, or symlink in InMemoryFileSystem."""
+
+  def __init__(self, mode: int, inode: int) -> None:
+    self.mode = mode
+    self.inode = inode
+    self.mtime_ns = 0
+    self.content = b''
+    self.target: Optional[pathlib.Path] = None
+    self.children: Dict[str, '_Node'] = {}
+
+
+class _InMemoryEntry(Entry):
+  """An entry of InMemoryFileSystem.walk."""
+
+  def __init__(self, filesystem: 'InMemoryFileSystem', path: pathlib.Path,
+               node: _Node) -> None:
+    self._filesystem = filesystem
+    self._node = node
+    self.path = path
+
+  def _mode(self, follow_symlinks: bool) -> Optional[int]:
+    if follow_symlinks and stat_lib.S_ISLNK(self._node.mode):
+      # Following a symlink requires a stat, as with os.DirEntry.
+      return self._filesystem._mode(self.path)
+    return self._node.mode
+
+  def is_dir(self, follow_symlinks: bool = True) -> bool:
+    mode = self._mode(follow_symlinks)
+    return mode is not None and stat_lib.S_ISDIR(mode)
+
+  def is_file(self, follow_symlinks: bool = True) -> bool:
+    mode = self._mode(follow_symlinks)
+    return mode is not None and stat_lib.S_ISREG(mode)
+
+  def is_symlink(self) -> bool:
+    return stat_lib.S_ISLNK(self._node.mode)
+
+
+class InMemoryFileSystem(FileSystem):
+  """Keeps the whole tree in memory and counts syscalls.
+
+  Paths must be absolute. Each operation is counted in `syscalls` by the name
+  of the syscall it would make on Linux (e.g. `walk` counts one `getdents` per
+  directory read), so tests can assert syscall budgets.
+
+  Attributes:
+    syscalls: The number of each syscall made.
+    device: The st_dev reported for all nodes.
+  """
+
+  def __init__(self, device: int = 1) -> None:
+    self.syscalls: Dict[str, int] = collections.Counter()
+    self.device = device
+    # Used for both inode numbers and modification times, as both only need
+    # to be unique and increasing.
+    self._clock = 0
+    self._root = self._new_node(stat_lib.S_IFDIR | 0o755)
+
+  def _tick(self) -> int:
+    self._clock += 1
+    return self._clock
+
+  def _new_node(self, mode: int) -> _Node:
+    node = _Node(mode, self._tick())
+    node.mtime_ns = node.inode
+    return node
+
+  def _lookup(self,
+              path: Union[str, pathlib.Path],
+              follow_symlinks: bool = True,
+              depth: int = 0) -> _Node:
+    """Returns the node at path, following symlinks as the kernel would."""
+    path = pathlib.PurePosixPath(path)
+    if not path.is_absolute():
+      raise ValueError(f'{path} is not an absolute path.')
+    if depth > _MAX_SYMLINKS:
+      raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), str(path))
+
+    node = self._root
+    current = pathlib.PurePosixPath('/')
+    parts = path.parts[1:]
+    for index, part in enumerate(parts):
+      if not stat_lib.S_ISDIR(node.mode):
+        raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR),
+                                 str(path))
+      if part == '..':
+        current = current.parent
+        node = self._lookup(current, depth=depth + 1)
+        continue
+      if part not in node.children:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                str(path))
+      node = node.children[part]
+      current = current / part
+      is_last = index == len(parts) - 1
+      if stat_lib.S_ISLNK(node.mode) and (follow_symlinks or not is_last):
+        node = self._lookup(current.parent / node.target, depth=depth + 1)
+    return node
+
+  def _parent(self, path: pathlib.Path) -> _Node:
+    parent = self._lookup(path.parent)
+    if not stat_lib.S_ISDIR(parent.mode):
+      raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR),
+                               str(path))
+    return parent
+
+  def _add(self, path: pathlib.Path, node: _Node) -> None:
+    parent = self._parent(path)
+    if path.name in parent.children:
+      raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(path))
+    parent.children[path.name] = node
+    parent.mtime_ns = self._tick()
+
+  def walk(
+      self,
+      path: pathlib.Path,
+      recursive: bool = True,
+      descend: Optional[Callable[[Entry], bool]] = None) -> Iterator[Entry]:
+    directories = [path]
+    while directories:
+      directory = directories.pop()
+      self.syscalls['getdents'] += 1
+      try:
+        node = self._lookup(directory)
+      except (FileNotFoundError, NotADirectoryError):
+        continue
+      if not stat_lib.S_ISDIR(node.mode):
+        continue
+      entries = [
+          _InMemoryEntry(self, directory / name, child)
+          for name, child in node.children.items()
+      ]
+      for entry in entries:
+        yield entry
+        if (recursive and entry.is_dir(follow_symlinks=False) and
+            (descend is None or descend(entry))):
+          directories.append(entry.path)
+
+  def stat(self,
+           path: pathlib.Path,
+           follow_symlinks: bool = True) -> StatResult:
+    self.syscalls['stat' if follow_symlinks else 'lstat'] += 1
+    node = self._lookup(path, follow_symlinks=follow_symlinks)
+    return StatResult(
+        st_mode=node.mode,
+        st_ino=node.inode,
+        st_dev=self.device,
+        st_size=len(node.content),
+        st_mtime_ns=node.mtime_ns)
+
+  def read_bytes(self, path: pathlib.Path) -> bytes:
+    self.syscalls['read'] += 1
+    node = self._lookup(path)
+    if stat_lib.S_ISDIR(node.mode):
+      raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR),
+                              str(path))
+    return node.content
+
+  def write_bytes(self, path: pathlib.Path, content: bytes) -> None:
+    self.syscalls['write'] += 1
+    try:
+      node = self._lookup(path)
+    except FileNotFoundError:
+      node = self._new_node(stat_lib.S_IFREG | 0o644)
+      self._add(path, node)
+    node.content = bytes(content)
+    node.mtime_ns = self._tick()
+
+  def write_text(self, path: pathlib.Path, content: str) -> None:
+    """Writes content to the file at path; for setting up trees."""
+    self.write_bytes(path, content.encode())
+
+  def mkdir(self,
+            path: pathlib.Path,
+            parents: bool = False,
+            exist_ok: bool = False) -> None:
+    self.syscalls['mkdir'] += 1
+    try:
+      self._add(path, self._new_node(stat_lib.S_IFDIR | 0o755))
+    except FileNotFoundError:
+      if not parents or path.parent == path:
+        raise
+      self.mkdir(path.parent, parents=True, exist_ok=True)
+      self.mkdir(path, parents=False, exist_ok=exist_ok)
+    except FileExistsError:
+      if not exist_ok or not self.is_dir(path):
+        raise
+
+  def symlink(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    self.syscalls['symlink'] += 1
+    node = self._new_node(stat_lib.S_IFLNK | 0o777)
+    node.target = pathlib.Path(target)
+    self._add(path, node)
+
+  def readlink(self, path: pathlib.Path) -> pathlib.Path:
+    self.syscalls['readlink'] += 1
+    node = self._lookup(path, follow_symlinks=False)
+    if not stat_lib.S_ISLNK(node.mode):
+      raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), str(path))
+    return node.target
+
+  def _remove(self, path: pathlib.Path, directory: bool) -> None:
+    parent = self._parent(path)
+    node = parent.children.get(path.name)
+    if node is None:
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                              str(path))
+    if directory and not stat_lib.S_ISDIR(node.mode):
+      raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR),
+                               str(path))
+    if directory and node.children:
+      raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), str(path))
+    if not directory and stat_lib.S_ISDIR(node.mode):
+      raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR),
+                              str(path))
+    del parent.children[path.name]
+    parent.mtime_ns = self._tick()
+
+  def unlink(self, path: pathlib.Path) -> None:
+    self.syscalls['unlink'] += 1
+    self._remove(path, directory=False)
+
+  def rmdir(self, path: pathlib.Path) -> None:
+    self.syscalls['rmdir'] += 1
+    self._remove(path, directory=True)
+
+  def replace(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    self.syscalls['rename'] += 1
+    parent = self._parent(path)
+    node = parent.children.get(path.name)
+    if node is None:
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                              str(path))
+    target_parent = self._parent(target)
+    existing = target_parent.children.get(target.name)
+    if existing is not None and stat_lib.S_ISDIR(existing.mode):
+      raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR),
+                              str(target))
+    del parent.children[path.name]
+    target_parent.children[target.name] = node
+    parent.mtime_ns = target_parent.mtime_ns = self._tick()
@@ -0,0 +1,199 @@
+import pathlib
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+import fs_lib
+
+
+class FileSystemTest(parameterized.TestCase):
+  """Tests that LocalFileSystem and InMemoryFileSystem behave the same."""
+
+  def setUp(self):
+    super().setUp()
+    self.root = pathlib.Path(self.create_tempdir().full_path)
+
+  def _make_filesystem(self, name: str) -> fs_lib.FileSystem:
+    if name == 'local':
+      return fs_lib.LocalFileSystem()
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.mkdir(self.root, parents=True)
+    return filesystem
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_files_and_symlinks(self, name):
+    """Ensures files, directories, and symlinks can be created and read."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a' / 'b', parents=True)
+    filesystem.mkdir(self.root / 'a' / 'b', parents=True, exist_ok=True)
+    filesystem.write_bytes(self.root / 'a' / 'b' / 'file', b'content')
+    filesystem.symlink(self.root / 'link', self.root / 'a' / 'b')
+    filesystem.symlink(self.root / 'relative', pathlib.Path('a/b/file'))
+    filesystem.symlink(self.root / 'dangling', self.root / 'missing')
+
+    self.assertEqual(filesystem.read_text(self.root / 'link' / 'file'),
+                     'content')
+    self.assertEqual(filesystem.read_bytes(self.root / 'relative'), b'content')
+    self.assertEqual(
+        filesystem.readlink(self.root / 'link'), self.root / 'a' / 'b')
+    self.assertTrue(filesystem.is_dir(self.root / 'link'))
+    self.assertTrue(filesystem.is_symlink(self.root / 'link'))
+    self.assertTrue(filesystem.is_file(self.root / 'relative'))
+    self.assertFalse(filesystem.exists(self.root / 'dangling'))
+    self.assertTrue(filesystem.lexists(self.root / 'dangling'))
+    self.assertEqual(
+        filesystem.stat(self.root / 'a' / 'b' / 'file').st_size, 7)
+    self.assertEqual(
+        filesystem.stat(self.root / 'link').st_ino,
+        filesystem.stat(self.root / 'a' / 'b').st_ino)
+
+    with self.assertRaises(FileExistsError):
+      filesystem.symlink(self.root / 'link', self.root)
+    with self.assertRaises(FileExistsError):
+      filesystem.mkdir(self.root / 'a')
+    with self.assertRaises(FileNotFoundError):
+      filesystem.mkdir(self.root / 'x' / 'y')
+    with self.assertRaises(FileNotFoundError):
+      filesystem.read_bytes(self.root / 'missing')
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_walk(self, name):
+    """Ensures walk yields everything without following symlinks."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a' / 'b', parents=True)
+    filesystem.write_bytes(self.root / 'a' / 'file', b'')
+    filesystem.symlink(self.root / 'link', self.root / 'a')
+
+    entries = {
+        entry.path.relative_to(self.root): entry
+        for entry in filesystem.walk(self.root)
+    }
+
+    self.assertEqual(
+        set(entries), {
+            pathlib.Path('a'),
+            pathlib.Path('a/b'),
+            pathlib.Path('a/file'),
+            pathlib.Path('link'),
+        })
+    self.assertTrue(entries[pathlib.Path('a/b')].is_dir())
+    self.assertTrue(entries[pathlib.Path('a/file')].is_file())
+    self.assertTrue(entries[pathlib.Path('link')].is_symlink())
+    self.assertTrue(entries[pathlib.Path('link')].is_dir())
+    self.assertFalse(entries[pathlib.Path('link')].is_dir(
+        follow_symlinks=False))
+    self.assertEqual(entries[pathlib.Path('a/file')].name, 'file')
+    self.assertEmpty(list(filesystem.walk(self.root / 'missing')))
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_walk_not_recursive(self, name):
+    """Ensures walk only yields direct entries if not recursive."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a' / 'b', parents=True)
+    filesystem.write_bytes(self.root / 'file', b'')
+
+    self.assertEqual({
+        entry.name for entry in filesystem.walk(self.root, recursive=False)
+    }, {'a', 'file'})
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_walk_descend(self, name):
+    """Ensures walk yields but does not descend into rejected directories."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a' / 'b', parents=True)
+    filesystem.mkdir(self.root / 'c' / 'd', parents=True)
+
+    self.assertEqual({
+        entry.path.relative_to(self.root)
+        for entry in filesystem.walk(
+            self.root, descend=lambda entry: entry.name != 'a')
+    }, {pathlib.Path('a'),
+        pathlib.Path('c'),
+        pathlib.Path('c/d')})
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_entry(self, name):
+    """Ensures entry returns the same types as walk."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a')
+    filesystem.write_bytes(self.root / 'file', b'')
+    filesystem.symlink(self.root / 'link', self.root / 'a')
+
+    self.assertTrue(filesystem.entry(self.root / 'a').is_dir())
+    self.assertTrue(filesystem.entry(self.root / 'file').is_file())
+    self.assertTrue(filesystem.entry(self.root / 'link').is_symlink())
+    self.assertTrue(filesystem.entry(self.root / 'link').is_dir())
+    self.assertFalse(
+        filesystem.entry(self.root / 'link').is_dir(follow_symlinks=False))
+    self.assertEqual(filesystem.entry(self.root / 'file').name, 'file')
+    self.assertIsNone(filesystem.entry(self.root / 'missing'))
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_remove(self, name):
+    """Ensures unlink, rmdir, and rmtree remove items."""
+    filesystem = self._make_filesystem(name)
+    filesystem.mkdir(self.root / 'a' / 'b' / 'c', parents=True)
+    filesystem.write_bytes(self.root / 'a' / 'b' / 'file', b'')
+    filesystem.symlink(self.root / 'a' / 'link', self.root / 'a' / 'b')
+    filesystem.write_bytes(self.root / 'file', b'')
+
+    filesystem.unlink(self.root / 'file')
+    with self.assertRaises(OSError):
+      filesystem.rmdir(self.root / 'a')
+    filesystem.rmtree(self.root / 'a')
+
+    self.assertEmpty(list(filesystem.walk(self.root)))
+    self.assertTrue(filesystem.exists(self.root))
+
+  @parameterized.parameters('local', 'in_memory')
+  def test_write_bytes_atomically(self, name):
+    """Ensures files are replaced whole, creating their directories."""
+    filesystem = self._make_filesystem(name)
+    path = self.root / 'a' / 'b' / 'file'
+
+    filesystem.write_bytes_atomically(path, b'old')
+    filesystem.write_bytes_atomically(path, b'new')
+
+    self.assertEqual(filesystem.read_bytes(path), b'new')
+    self.assertEqual([entry.name for entry in filesystem.walk(path.parent)],
+                     ['file'])
+    with self.assertRaises(FileNotFoundError):
+      filesystem.replace(self.root / 'missing', path)
+
+  def test_in_memory_syscalls(self):
+    """Ensures InMemoryFileSystem counts syscalls."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.mkdir(pathlib.Path('/a/b'), parents=True)
+    filesystem.symlink(pathlib.Path('/a/link'), pathlib.Path('/a/b'))
+    list(filesystem.walk(pathlib.Path('/a')))
+    filesystem.lexists(pathlib.Path('/a/link'))
+
+    self.assertEqual(filesystem.syscalls, {
+        'mkdir': 3,
+        'symlink': 1,
+        'getdents': 2,
+        'lstat': 1,
+    })
+
+  def test_in_memory_mtime(self):
+    """Ensures directory mtimes change when their entries change."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.mkdir(pathlib.Path('/a'))
+    mtime = filesystem.stat(pathlib.Path('/a')).st_mtime_ns
+
+    filesystem.write_bytes(pathlib.Path('/a/file'), b'')
+    self.assertGreater(filesystem.stat(pathlib.Path('/a')).st_mtime_ns, mtime)
+
+  def test_in_memory_symlink_loop(self):
+    """Ensures symlink loops do not exist, as with the real filesystem."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.symlink(pathlib.Path('/a'), pathlib.Path('/b'))
+    filesystem.symlink(pathlib.Path('/b'), pathlib.Path('/a'))
+
+    self.assertFalse(filesystem.exists(pathlib.Path('/a')))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/a')))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,284 @@
+"""Library to watch directory trees for changes with Linux inotify.
+
+inotify only watches single directories, so a `Watcher` adds a watch for each
+directory under the given paths, including directories created later. Events
+are coalesced into the set of paths that changed: a burst of events (e.g. when
+copying many files) is returned as one set once no event arrived for
+`debounce` seconds, or after at most `max_delay` seconds.
+
+Each watch uses kernel memory and is limited per user by
+`/proc/sys/fs/inotify/max_user_watches`; adding a watch beyond the limit raises
+an OSError with errno ENOSPC. If the kernel event queue overflows, events are
+lost, which `read` reports by returning None.
+
+A `TreesWatch` reports the changes of named sets of directory trees to a
+`daemon_lib.Daemon`.
+"""
+
+from typing import Dict, Iterable, List, Mapping, Optional, Set
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import time
+
+from absl import logging
+
+import daemon_lib
+
+# From <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+# Changes to the content of a file are reported once it is closed, rather than
+# on each write.
+_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW |
+    IN_EXCL_UNLINK)
+
+# struct inotify_event, followed by a null-padded name of `len` bytes.
+_EVENT = struct.Struct('iIII')
+
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc() -> ctypes.CDLL:
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  if not hasattr(libc, 'inotify_init1'):
+    raise OSError(errno.ENOSYS, 'inotify is not available.')
+  return libc
+
+
+class Watcher:
+  """Watches directory trees for changes.
+
+  Attributes:
+    paths: The roots of the directory trees to watch.
+    debounce: The number of seconds without events that ends a burst.
+    max_delay: The maximum number of seconds to coalesce events for.
+  """
+
+  def __init__(self,
+               paths: Iterable[pathlib.Path],
+               debounce: float = 0.5,
+               max_delay: float = 5) -> None:
+    self.paths = list(paths)
+    self.debounce = debounce
+    self.max_delay = max_delay
+
+    self._libc: Optional[ctypes.CDLL] = None
+    self._fd: Optional[int] = None
+    self._paths_by_descriptor: Dict[int, pathlib.Path] = {}
+
+  def start(self) -> None:
+    """Adds watches for all directories under paths.
+
+    Raises:
+      OSError: If inotify is not available, or any watch could not be added;
+        e.g. with ENOSPC if the watch limit is reached.
+    """
+    self._libc = _load_libc()
+    self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self._fd < 0:
+      number = ctypes.get_errno()
+      raise OSError(number, os.strerror(number))
+    try:
+      for path in self.paths:
+        self._add_tree(path)
+    except OSError:
+      self.close()
+      raise
+    logging.info('Watching %d directories.', len(self._paths_by_descriptor))
+
+  def close(self) -> None:
+    """Removes all watches."""
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+    self._paths_by_descriptor.clear()
+
+  def __enter__(self) -> 'Watcher':
+    self.start()
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+  def _add_watch(self, path: pathlib.Path) -> bool:
+    """Adds a watch for the directory path; returns whether it exists."""
+    descriptor = self._libc.inotify_add_watch(self._fd, bytes(path), _MASK)
+    if descriptor < 0:
+      number = ctypes.get_errno()
+      if number in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+        # Removed (or replaced) before we got to it, or unreadable.
+        return False
+      if number == errno.ENOSPC:
+        raise OSError(
+            number, 'inotify watch limit reached; see '
+            '/proc/sys/fs/inotify/max_user_watches', str(path))
+      raise OSError(number, os.strerror(number), str(path))
+    self._paths_by_descriptor[descriptor] = path
+    return True
+
+  def _add_tree(self, path: pathlib.Path) -> None:
+    """Adds watches for path and all directories under it."""
+    directories = [path]
+    while directories:
+      directory = directories.pop()
+      if not self._add_watch(directory):
+        continue
+      try:
+        with os.scandir(directory) as entries:
+          directories.extend(
+              pathlib.Path(entry.path)
+              for entry in entries
+              if entry.is_dir(follow_symlinks=False))
+      except OSError:
+        continue
+
+  def _remove_tree(self, path: pathlib.Path) -> None:
+    """Removes the watches of path and all directories under it."""
+    for descriptor, directory in list(self._paths_by_descriptor.items()):
+      if directory == path or path in directory.parents:
+        self._libc.inotify_rm_watch(self._fd, descriptor)
+        del self._paths_by_descriptor[descriptor]
+
+  def _poll(self, timeout: Optional[float]) -> bool:
+    """Returns whether events are available within timeout seconds."""
+    poll = select.poll()
+    poll.register(self._fd, select.POLLIN)
+    return bool(poll.poll(None if timeout is None else timeout * 1000))
+
+  def _read_events(self, changes: Set[pathlib.Path]) -> bool:
+    """Adds the paths of available events to changes; returns if overflowed."""
+    overflowed = False
+    while True:
+      try:
+        buffer = os.read(self._fd, _READ_SIZE)
+      except BlockingIOError:
+        return overflowed
+
+      offset = 0
+      while offset < len(buffer):
+        descriptor, mask, _, length = _EVENT.unpack_from(buffer, offset)
+        name = buffer[offset + _EVENT.size:offset + _EVENT.size +
+                      length].rstrip(b'\0')
+        offset += _EVENT.size + length
+
+        if mask & IN_Q_OVERFLOW:
+          overflowed = True
+          continue
+        if mask & IN_IGNORED:
+          self._paths_by_descriptor.pop(descriptor, None)
+          continue
+        directory = self._paths_by_descriptor.get(descriptor)
+        if directory is None:
+          continue
+
+        path = directory / os.fsdecode(name) if name else directory
+        changes.add(path)
+        if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+          # The watches would otherwise keep reporting the old paths.
+          self._remove_tree(path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+          # Anything created in it before the watch was added is covered by
+          # path having changed.
+          self._add_tree(path)
+
+  def read(self,
+           timeout: Optional[float] = None) -> Optional[Set[pathlib.Path]]:
+    """Returns the paths that changed, coalescing bursts of events.
+
+    Waits up to timeout seconds (forever if None) for the first event, and
+    then until no events arrive for `debounce` seconds or `max_delay` seconds
+    passed. A path is reported if it was created, removed, moved, or written
+    to; if a directory is reported, anything under it may have changed.
+
+    Args:
+      timeout: The maximum number of seconds to wait for the first event.
+
+    Returns:
+      The paths that changed, which is empty if the timeout passed without
+      events; or None if events were lost, in which case anything may have
+      changed.
+
+    Raises:
+      OSError: If watching a new directory failed; e.g. with ENOSPC if the
+        watch limit is reached.
+    """
+    changes: Set[pathlib.Path] = set()
+    if not self._poll(timeout):
+      return changes
+
+    deadline = time.monotonic() + self.max_delay
+    overflowed = False
+    while True:
+      overflowed |= self._read_events(changes)
+      remaining = min(self.debounce, deadline - time.monotonic())
+      if remaining <= 0 or not self._poll(remaining):
+        break
+
+    if overflowed:
+      logging.warning('inotify queue overflowed; events were lost.')
+      return None
+    return changes
+
+  @property
+  def watched(self) -> List[pathlib.Path]:
+    """The directories being watched."""
+    return list(self._paths_by_descriptor.values())
+
+
+class TreesWatch(daemon_lib.Watch):
+  """Reports the changed paths under the directory trees of each target."""
+
+  def __init__(self, paths: Mapping[str, Iterable[pathlib.Path]]) -> None:
+    """Initializes the watch.
+
+    Args:
+      paths: The roots of the directory trees of each target, by name.
+    """
+    self._paths = {name: list(roots) for name, roots in paths.items()}
+    self._watcher = Watcher(
+        {root for roots in self._paths.values() for root in roots})
+
+  def start(self) -> None:
+    self._watcher.start()
+
+  def changes(
+      self, timeout: float) -> Mapping[str, Optional[Set[pathlib.Path]]]:
+    changed_paths = self._watcher.read(timeout)
+    if changed_paths is None:
+      return {name: None for name in self._paths}
+
+    changes = {}
+    for name, roots in self._paths.items():
+      paths = {
+          path for path in changed_paths
+          if any(root == path or root in path.parents for root in roots)
+      }
+      if paths:
+        changes[name] = paths
+    return changes
+
+  def close(self) -> None:
+    self._watcher.close()
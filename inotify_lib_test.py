@@ -0,0 +1,86 @@
+from unittest import mock
+
+import errno
+import pathlib
+
+from absl.testing import absltest
+
+import inotify_lib
+
+
+class WatcherTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.root = pathlib.Path(self.create_tempdir().full_path)
+    (self.root / 'a' / 'b').mkdir(parents=True)
+    self.watcher = inotify_lib.Watcher([self.root], debounce=0.05, max_delay=1)
+    try:
+      self.watcher.start()
+    except OSError as error:
+      self.skipTest(f'inotify is not available: {error}')
+    self.addCleanup(self.watcher.close)
+
+  def test_start(self):
+    """Ensures all directories are watched."""
+    self.assertCountEqual(self.watcher.watched,
+                          [self.root, self.root / 'a', self.root / 'a' / 'b'])
+
+  def test_read(self):
+    """Ensures changes in nested directories are coalesced."""
+    (self.root / 'a' / 'b' / 'file').write_text('content')
+    (self.root / 'a' / 'b' / 'file').write_text('changed')
+    (self.root / 'file').touch()
+    (self.root / 'file').unlink()
+
+    self.assertEqual(
+        self.watcher.read(timeout=1),
+        {self.root / 'a' / 'b' / 'file', self.root / 'file'})
+    self.assertEqual(self.watcher.read(timeout=0), set())
+
+  def test_read_new_directory(self):
+    """Ensures new directories are watched."""
+    (self.root / 'c').mkdir()
+    self.assertEqual(self.watcher.read(timeout=1), {self.root / 'c'})
+
+    (self.root / 'c' / 'file').touch()
+    self.assertEqual(self.watcher.read(timeout=1), {self.root / 'c' / 'file'})
+    self.assertIn(self.root / 'c', self.watcher.watched)
+
+  def test_read_moved_directory(self):
+    """Ensures moving a directory reports both paths."""
+    (self.root / 'a').rename(self.root / 'c')
+
+    self.assertEqual(self.watcher.read(timeout=1),
+                     {self.root / 'a', self.root / 'c'})
+    self.assertCountEqual(self.watcher.watched,
+                          [self.root, self.root / 'c', self.root / 'c' / 'b'])
+
+    (self.root / 'c' / 'b' / 'file').touch()
+    self.assertEqual(self.watcher.read(timeout=1),
+                     {self.root / 'c' / 'b' / 'file'})
+
+  def test_watch_limit(self):
+    """Ensures reaching the watch limit raises ENOSPC."""
+    original = self.watcher._libc
+
+    class LimitedLibc:
+
+      def __getattr__(self, name):
+        return getattr(original, name)
+
+      def inotify_add_watch(self, *args):
+        del args
+        return -1
+
+    self.watcher._libc = LimitedLibc()
+    (self.root / 'c').mkdir()
+    with mock.patch.object(
+        inotify_lib.ctypes, 'get_errno', return_value=errno.ENOSPC):
+      with self.assertRaises(OSError) as context:
+        self.watcher.read(timeout=1)
+    self.assertEqual(context.exception.errno, errno.ENOSPC)
+
+
+if __name__ == '__main__':
+  absltest.main()
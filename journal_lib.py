@@ -0,0 +1,38 @@
+"""Library to journal the mapping a SymFs was generated from.
+
+Reconciling a SymFs with a new mapping otherwise requires either clearing it
+(see `Config.clear`) or walking all of it. With the mapping it was last
+generated from at hand, `SymFs.reconcile` instead only touches the links of
+items that changed. The journal is a `Mapping` proto, in which each item path
+is stored once, and is replaced atomically after each run.
+
+The journal is only as accurate as the SymFs is left alone: links changed by
+anything else are not noticed until `SymFs.verify` walks the SymFs.
+"""
+
+from typing import Dict, Optional, Set
+
+import pathlib
+
+import mapping_lib
+
+
+class Journal:
+  """The mapping a single SymFs was last generated from.
+
+  Attributes:
+    path: The path of the journal file.
+  """
+
+  def __init__(self, path: pathlib.Path) -> None:
+    self.path = path
+
+  def read(self) -> Optional[Dict[str, Dict[str, Set[pathlib.Path]]]]:
+    """Returns the mapping last applied, or None if unknown."""
+    proto = mapping_lib.read_proto_or_none(self.path, 'journal',
+                                           'starting from scratch')
+    return None if proto is None else mapping_lib.from_proto(proto)
+
+  def write(self, mapping: mapping_lib.GroupToKeyToPathMapping) -> None:
+    """Records that the SymFs now reflects mapping."""
+    mapping_lib.write_mapping(self.path, mapping_lib.to_proto(mapping))
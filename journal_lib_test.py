@@ -0,0 +1,37 @@
+import pathlib
+
+from absl.testing import absltest
+
+import journal_lib
+
+_MAPPING = {
+    'by_studio': {
+        's': {pathlib.Path('/a/1'), pathlib.Path('/a/2')},
+    },
+}
+
+
+class JournalTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.path = pathlib.Path(self.create_tempdir().full_path) / 'journal.pb'
+
+  def test_write(self):
+    journal = journal_lib.Journal(self.path)
+    self.assertIsNone(journal.read())
+
+    journal.write(_MAPPING)
+
+    self.assertEqual(journal_lib.Journal(self.path).read(), _MAPPING)
+
+  def test_read_corrupted(self):
+    """Ensures a corrupted journal generates from scratch."""
+    self.path.write_bytes(b'not a mapping')
+
+    with self.assertLogs(level='WARNING'):
+      self.assertIsNone(journal_lib.Journal(self.path).read())
+
+
+if __name__ == '__main__':
+  absltest.main()
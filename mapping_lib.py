@@ -0,0 +1,133 @@
+"""Library to serialize, remap, and merge SymFs mappings.
+
+This allows a library spread over multiple machines to be scanned locally on
+each machine (a shard), and the resulting mappings to be merged into a single
+SymFs elsewhere. Since each machine may see the items under different paths
+than the machine generating the SymFs (e.g. over NFS), item paths can be
+remapped by prefix while merging.
+"""
+
+from typing import (Dict, Iterable, Mapping, Optional, Sequence, Set, Tuple,
+                    Type, TypeVar)
+
+import pathlib
+
+from absl import logging
+from google.protobuf import message
+
+import fs_lib
+import protos.symfs_pb2 as symfs_pb2
+
+GroupToKeyToPathMapping = Mapping[str, Mapping[str, Set[pathlib.Path]]]
+Remap = Tuple[pathlib.PurePath, pathlib.PurePath]
+MessageT = TypeVar('MessageT', bound=message.Message)
+
+
+def to_proto(mapping: GroupToKeyToPathMapping,
+             source_paths: Iterable[str] = ()) -> symfs_pb2.Mapping:
+  """Returns mapping as a Mapping proto.
+
+  Args:
+    mapping: The mapping, as returned by `SymFs.get_mapping`.
+    source_paths: The source paths that were scanned for mapping.
+
+  Returns:
+    The Mapping proto, in which each item path is only stored once.
+  """
+  proto = symfs_pb2.Mapping(source_paths=source_paths)
+  indices: Dict[pathlib.Path, int] = {}
+  for group_name, group in sorted(mapping.items()):
+    group_proto = proto.groups.add(name=group_name)
+    for group_key, items in sorted(group.items()):
+      key_proto = group_proto.keys.add(key=group_key)
+      for item in sorted(items):
+        if item not in indices:
+          indices[item] = len(proto.items)
+          proto.items.append(str(item))
+        key_proto.items.append(indices[item])
+  return proto
+
+
+def parse_remap(value: str) -> Remap:
+  """Returns the remap in value, in the form of <old>:<new>."""
+  old, separator, new = value.partition(':')
+  if not separator or not old or not new:
+    raise ValueError(f'Remap must be in the form of <old>:<new>; got {value}.')
+  return pathlib.PurePath(old), pathlib.PurePath(new)
+
+
+def remap_path(path: pathlib.Path, remaps: Sequence[Remap]) -> pathlib.Path:
+  """Returns path with the longest matching old prefix replaced by new."""
+  matches = [(old, new)
+             for old, new in remaps
+             if path == old or old in path.parents]
+  if not matches:
+    return path
+  old, new = max(matches, key=lambda remap: len(remap[0].parts))
+  return pathlib.Path(new, path.relative_to(old))
+
+
+def from_proto(
+    proto: symfs_pb2.Mapping,
+    remaps: Sequence[Remap] = ()) -> Dict[str, Dict[str, Set[pathlib.Path]]]:
+  """Returns the mapping in proto, with item paths remapped by remaps."""
+  items = [remap_path(pathlib.Path(item), remaps) for item in proto.items]
+  return {
+      group.name: {
+          key.key: {items[index] for index in key.items}
+          for key in group.keys
+      } for group in proto.groups
+  }
+
+
+def merge(
+    mappings: Iterable[GroupToKeyToPathMapping]
+) -> Dict[str, Dict[str, Set[pathlib.Path]]]:
+  """Returns the union of mappings."""
+  merged: Dict[str, Dict[str, Set[pathlib.Path]]] = {}
+  for mapping in mappings:
+    for group_name, group in mapping.items():
+      merged_group = merged.setdefault(group_name, {})
+      for group_key, items in group.items():
+        merged_group.setdefault(group_key, set()).update(items)
+  return merged
+
+
+def read_mapping(path: pathlib.Path) -> symfs_pb2.Mapping:
+  """Returns the Mapping proto in the file at path."""
+  return symfs_pb2.Mapping.FromString(path.read_bytes())
+
+
+def read_proto_or_none(
+    path: pathlib.Path,
+    what: str,
+    fallback: str,
+    message_type: Type[MessageT] = symfs_pb2.Mapping) -> Optional[MessageT]:
+  """Returns the proto in the state file at path, or None if unreadable.
+
+  A missing file is expected (e.g. on the first run); any other error (e.g. a
+  corrupted file) is logged as a warning, as it must not prevent the run.
+
+  Args:
+    path: The path of the file.
+    what: What the file is, for the logs; e.g. "journal".
+    fallback: What the run does without it, for the logs.
+    message_type: The type of the proto in the file.
+
+  Returns:
+    The proto, or None if the file is missing or unreadable.
+  """
+  try:
+    return message_type.FromString(path.read_bytes())
+  except FileNotFoundError:
+    logging.info('No %s at %s; %s.', what, path, fallback)
+  except Exception as error:  # pylint: disable=broad-except
+    logging.warning('Unable to read %s %s: %s; %s.', what, path, error,
+                    fallback)
+  return None
+
+
+def write_mapping(path: pathlib.Path, proto: symfs_pb2.Mapping) -> None:
+  """Writes proto to path such that readers never see a partial file."""
+  fs_lib.LocalFileSystem().write_bytes_atomically(path,
+                                                  proto.SerializeToString())
@@ -0,0 +1,118 @@
+import pathlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+import mapping_lib
+
+_MAPPING = {
+    'by_studio': {
+        's': {pathlib.Path('/a/1'), pathlib.Path('/a/2')},
+    },
+    'by_cast': {
+        'x': {pathlib.Path('/a/1')},
+        'y': {pathlib.Path('/b/3')},
+    },
+}
+
+
+class MappingLibTest(parameterized.TestCase):
+
+  def test_to_proto(self):
+    """Ensures each item is only stored once."""
+    proto = mapping_lib.to_proto(_MAPPING, ['/a', '/b'])
+
+    self.assertCountEqual(proto.items, ['/a/1', '/a/2', '/b/3'])
+    self.assertEqual(proto.source_paths, ['/a', '/b'])
+    self.assertEqual(mapping_lib.from_proto(proto), _MAPPING)
+
+  def test_from_proto_remap(self):
+    """Ensures item paths are remapped."""
+    proto = mapping_lib.to_proto(_MAPPING)
+    remaps = [mapping_lib.parse_remap('/a:/mnt/a')]
+
+    mapping = mapping_lib.from_proto(proto, remaps)
+
+    self.assertEqual(mapping['by_studio']['s'],
+                     {pathlib.Path('/mnt/a/1'),
+                      pathlib.Path('/mnt/a/2')})
+    self.assertEqual(mapping['by_cast']['y'], {pathlib.Path('/b/3')})
+
+  @parameterized.parameters(
+      ('/a/b/c', '/x/c'),
+      ('/a/b', '/x'),
+      ('/a/c', '/y/c'),
+      ('/ab/c', '/ab/c'),
+      ('/d', '/d'),
+  )
+  def test_remap_path(self, path, expected):
+    """Ensures the longest matching prefix is remapped."""
+    remaps = [
+        mapping_lib.parse_remap('/a:/y'),
+        mapping_lib.parse_remap('/a/b:/x'),
+    ]
+    self.assertEqual(
+        mapping_lib.remap_path(pathlib.Path(path), remaps),
+        pathlib.Path(expected))
+
+  @parameterized.parameters('/a', ':/a', '/a:', '')
+  def test_parse_remap_invalid(self, value):
+    with self.assertRaises(ValueError):
+      mapping_lib.parse_remap(value)
+
+  def test_merge(self):
+    """Ensures the mappings are combined."""
+    merged = mapping_lib.merge([
+        _MAPPING,
+        {
+            'by_studio': {
+                's': {pathlib.Path('/c/4')},
+                't': {pathlib.Path('/c/5')},
+            },
+        },
+    ])
+
+    self.assertEqual(
+        merged['by_studio'], {
+            's': {
+                pathlib.Path('/a/1'),
+                pathlib.Path('/a/2'),
+                pathlib.Path('/c/4')
+            },
+            't': {pathlib.Path('/c/5')},
+        })
+    self.assertEqual(merged['by_cast'], _MAPPING['by_cast'])
+    self.assertEqual(_MAPPING['by_studio']['s'],
+                     {pathlib.Path('/a/1'),
+                      pathlib.Path('/a/2')})
+
+  def test_write_mapping(self):
+    """Ensures written mappings are read back, without temporary files."""
+    path = pathlib.Path(self.create_tempdir().full_path) / 'shard' / 'a.pb'
+    proto = mapping_lib.to_proto(_MAPPING, ['/a'])
+
+    mapping_lib.write_mapping(path, proto)
+
+    self.assertEqual(mapping_lib.read_mapping(path), proto)
+    self.assertEqual(list(path.parent.iterdir()), [path])
+
+  def test_read_proto_or_none(self):
+    """Ensures missing or corrupted state files are read as None."""
+    directory = pathlib.Path(self.create_tempdir().full_path)
+    proto = mapping_lib.to_proto(_MAPPING, ['/a'])
+    mapping_lib.write_mapping(directory / 'mapping.pb', proto)
+    (directory / 'corrupted.pb').write_bytes(b'corrupted')
+
+    self.assertEqual(
+        mapping_lib.read_proto_or_none(directory / 'mapping.pb', 'mapping',
+                                       'ignoring it'), proto)
+    self.assertIsNone(
+        mapping_lib.read_proto_or_none(directory / 'missing.pb', 'mapping',
+                                       'ignoring it'))
+    self.assertIsNone(
+        mapping_lib.read_proto_or_none(directory / 'corrupted.pb', 'mapping',
+                                       'ignoring it'))
+
+
+if __name__ == '__main__':
+  absltest.main()
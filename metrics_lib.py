@@ -0,0 +1,179 @@
+"""Library to record per-phase timings and counters of a SymFs run.
+
+A run is broken up into phases (e.g. walking the source paths, parsing
+metadata, linking), which may be interleaved with each other. Each phase
+accumulates wall and CPU time across all of the times it is entered. Counters
+can be associated with a phase, in which case a rate (count per second of wall
+time in that phase) is also reported.
+
+The metrics can be written as JSON or in the Prometheus text format, which is
+suitable for the node exporter's textfile collector.
+
+Facts about the run that are not numbers (e.g. the protobuf backend in use) are
+recorded as info, which is exported as the labels of `symfs_info`.
+
+Metrics may be recorded from multiple threads. Note that the times of phases
+running concurrently overlap, and that CPU time is that of the whole process.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional, TypeVar
+
+import collections
+import contextlib
+import json
+import pathlib
+import threading
+import time
+
+import fs_lib
+
+T = TypeVar('T')
+
+
+def _escape_label_value(value: str) -> str:
+  """Escapes a Prometheus label value."""
+  return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels: Mapping[str, str]) -> str:
+  """Formats labels as a Prometheus label set."""
+  if not labels:
+    return ''
+  return '{' + ','.join(f'{name}="{_escape_label_value(value)}"'
+                        for name, value in sorted(labels.items())) + '}'
+
+
+class Metrics:
+  """Accumulates per-phase wall/CPU time and counters.
+
+  Attributes:
+    wall_seconds: Wall time spent in each phase.
+    cpu_seconds: CPU time (of this process) spent in each phase.
+    counters: The value of each counter.
+    counter_phases: The phase each counter is associated with, if any.
+    info: Facts about the run that are not numbers.
+  """
+
+  def __init__(self) -> None:
+    self.wall_seconds: Dict[str, float] = collections.defaultdict(float)
+    self.cpu_seconds: Dict[str, float] = collections.defaultdict(float)
+    self.counters: Dict[str, int] = collections.defaultdict(int)
+    self.counter_phases: Dict[str, str] = {}
+    self.info: Dict[str, str] = {}
+
+    self._lock = threading.Lock()
+
+  @contextlib.contextmanager
+  def phase(self, name: str) -> Iterator[None]:
+    """Context manager that adds the time spent in the block to phase name."""
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+      yield
+    finally:
+      wall_seconds = time.perf_counter() - wall_start
+      cpu_seconds = time.process_time() - cpu_start
+      with self._lock:
+        self.wall_seconds[name] += wall_seconds
+        self.cpu_seconds[name] += cpu_seconds
+
+  def timed(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+    """Yields from iterable, adding the time spent in each `next` to name."""
+    iterator = iter(iterable)
+    while True:
+      with self.phase(name):
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+      yield item
+
+  def increment(self,
+                name: str,
+                value: int = 1,
+                phase: Optional[str] = None) -> None:
+    """Increments counter name by value, optionally associating a phase."""
+    with self._lock:
+      self.counters[name] += value
+      if phase is not None:
+        self.counter_phases[name] = phase
+
+  def set_info(self, name: str, value: str) -> None:
+    """Records a fact about the run, e.g. the protobuf backend in use."""
+    with self._lock:
+      self.info[name] = value
+
+  def rates(self) -> Dict[str, float]:
+    """Returns the per-second rate of each counter associated with a phase."""
+    rates = {}
+    for name, phase in self.counter_phases.items():
+      if self.wall_seconds.get(phase):
+        rates[name] = self.counters[name] / self.wall_seconds[phase]
+    return rates
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Returns the metrics as a JSON-serializable dictionary."""
+    result = {
+        'phases': {
+            name: {
+                'wall_seconds': self.wall_seconds[name],
+                'cpu_seconds': self.cpu_seconds[name],
+            } for name in sorted(self.wall_seconds)
+        },
+        'counters': dict(sorted(self.counters.items())),
+        'rates': dict(sorted(self.rates().items())),
+    }
+    if self.info:
+      result['info'] = dict(sorted(self.info.items()))
+    return result
+
+  def to_prometheus(self, labels: Optional[Mapping[str, str]] = None) -> str:
+    """Returns the metrics in the Prometheus text exposition format.
+
+    Args:
+      labels: Additional labels to add to every sample (e.g. to tell apart
+        multiple configs exporting to the same collector).
+
+    Returns:
+      The metrics in the Prometheus text exposition format.
+    """
+    labels = dict(labels or {})
+    lines = []
+
+    def add_metric(name: str, description: str, label_name: str,
+                   values: Mapping[str, float]) -> None:
+      lines.append(f'# HELP symfs_{name} {description}')
+      lines.append(f'# TYPE symfs_{name} gauge')
+      for key, value in sorted(values.items()):
+        sample_labels = _format_labels({**labels, label_name: key})
+        lines.append(f'symfs_{name}{sample_labels} {value!r}')
+
+    add_metric('phase_wall_seconds', 'Wall time spent in each phase.', 'phase',
+               self.wall_seconds)
+    add_metric('phase_cpu_seconds', 'CPU time spent in each phase.', 'phase',
+               self.cpu_seconds)
+    add_metric('count', 'Number of items processed.', 'counter', self.counters)
+    add_metric('rate_per_second', 'Items processed per second of its phase.',
+               'counter', self.rates())
+    if self.info:
+      lines.append('# HELP symfs_info Facts about the run, as labels.')
+      lines.append('# TYPE symfs_info gauge')
+      lines.append(f'symfs_info{_format_labels({**labels, **self.info})} 1')
+    lines.append('# HELP symfs_last_run_timestamp_seconds When metrics were '
+                 'exported.')
+    lines.append('# TYPE symfs_last_run_timestamp_seconds gauge')
+    lines.append(f'symfs_last_run_timestamp_seconds{_format_labels(labels)} '
+                 f'{time.time()!r}')
+    return '\n'.join(lines) + '\n'
+
+  def write_json(self, path: pathlib.Path) -> None:
+    """Writes the metrics as JSON to path."""
+    fs_lib.LocalFileSystem().write_bytes_atomically(
+        path, (json.dumps(self.to_dict(), indent=2) + '\n').encode())
+
+  def write_prometheus(self,
+                       path: pathlib.Path,
+                       labels: Optional[Mapping[str, str]] = None) -> None:
+    """Writes the metrics in the Prometheus text format to path."""
+    fs_lib.LocalFileSystem().write_bytes_atomically(
+        path, self.to_prometheus(labels).encode())
@@ -0,0 +1,149 @@
+from unittest import mock
+
+import json
+import pathlib
+import tempfile
+import threading
+
+from absl.testing import absltest
+
+import metrics_lib
+
+
+class MetricsTest(absltest.TestCase):
+  """Tests for metrics_lib."""
+
+  def test_phase_accumulates(self):
+    """Ensures time is accumulated across multiple entries of a phase."""
+    metrics = metrics_lib.Metrics()
+    with mock.patch.object(
+        metrics_lib.time, 'perf_counter', side_effect=[0, 1, 10, 12]):
+      with mock.patch.object(
+          metrics_lib.time, 'process_time', side_effect=[0, 0.5, 1, 1.25]):
+        with metrics.phase('walk'):
+          pass
+        with metrics.phase('walk'):
+          pass
+
+    self.assertEqual(metrics.wall_seconds, {'walk': 3})
+    self.assertEqual(metrics.cpu_seconds, {'walk': 0.75})
+
+  def test_phase_records_on_error(self):
+    """Ensures the time is recorded even if the block raises."""
+    metrics = metrics_lib.Metrics()
+    with self.assertRaises(ValueError):
+      with metrics.phase('parse'):
+        raise ValueError('failed')
+
+    self.assertIn('parse', metrics.wall_seconds)
+
+  def test_threads(self):
+    """Ensures no updates are lost when recorded from multiple threads."""
+    metrics = metrics_lib.Metrics()
+
+    def record():
+      for _ in range(1000):
+        with metrics.phase('link'):
+          metrics.increment('links_created', phase='link')
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(metrics.counters['links_created'], 8000)
+
+  def test_timed(self):
+    """Ensures timed yields every item and only times the iteration."""
+    metrics = metrics_lib.Metrics()
+    items = []
+    for item in metrics.timed(range(3), 'walk'):
+      items.append(item)
+      self.assertNotIn('link', metrics.wall_seconds)
+
+    self.assertEqual(items, [0, 1, 2])
+    self.assertEqual(list(metrics.wall_seconds), ['walk'])
+
+  def test_rates(self):
+    """Ensures rates are only computed for counters with a phase."""
+    metrics = metrics_lib.Metrics()
+    metrics.wall_seconds['link'] = 2
+    metrics.increment('links_created', 10, phase='link')
+    metrics.increment('links_skipped', 4)
+
+    self.assertEqual(metrics.rates(), {'links_created': 5})
+    self.assertEqual(metrics.counters, {
+        'links_created': 10,
+        'links_skipped': 4
+    })
+
+  def test_to_prometheus(self):
+    """Ensures the Prometheus output has escaped labels and all samples."""
+    metrics = metrics_lib.Metrics()
+    metrics.wall_seconds['walk'] = 2.0
+    metrics.cpu_seconds['walk'] = 1.5
+    metrics.increment('items_scanned', 4, phase='walk')
+
+    output = metrics.to_prometheus(labels={'path': '/a "b"'})
+
+    self.assertIn('symfs_phase_wall_seconds{path="/a \\"b\\"",phase="walk"} '
+                  '2.0\n', output)
+    self.assertIn(
+        'symfs_phase_cpu_seconds{path="/a \\"b\\"",phase="walk"} 1.5\n',
+        output)
+    self.assertIn(
+        'symfs_count{counter="items_scanned",path="/a \\"b\\""} 4\n', output)
+    self.assertIn(
+        'symfs_rate_per_second{counter="items_scanned",path="/a \\"b\\""} '
+        '2.0\n', output)
+    self.assertIn('# TYPE symfs_last_run_timestamp_seconds gauge\n', output)
+
+  def test_info(self):
+    """Ensures info is exported as labels, and only if set."""
+    metrics = metrics_lib.Metrics()
+    self.assertNotIn('info', metrics.to_dict())
+    self.assertNotIn('symfs_info', metrics.to_prometheus())
+
+    metrics.set_info('protobuf_backend', 'upb')
+
+    self.assertEqual(metrics.to_dict()['info'], {'protobuf_backend': 'upb'})
+    self.assertIn('symfs_info{path="/a",protobuf_backend="upb"} 1\n',
+                  metrics.to_prometheus({'path': '/a'}))
+
+  def test_write(self):
+    """Ensures JSON and Prometheus files are written."""
+    metrics = metrics_lib.Metrics()
+    metrics.wall_seconds['walk'] = 2.0
+    metrics.increment('items_scanned', 4, phase='walk')
+
+    with tempfile.TemporaryDirectory() as directory:
+      json_path = pathlib.Path(directory) / 'nested' / 'metrics.json'
+      prometheus_path = pathlib.Path(directory) / 'symfs.prom'
+      metrics.write_json(json_path)
+      metrics.write_prometheus(prometheus_path)
+
+      self.assertEqual(
+          json.loads(json_path.read_text()), {
+              'phases': {
+                  'walk': {
+                      'wall_seconds': 2.0,
+                      'cpu_seconds': 0.0
+                  }
+              },
+              'counters': {
+                  'items_scanned': 4
+              },
+              'rates': {
+                  'items_scanned': 2.0
+              },
+          })
+      self.assertIn('symfs_count{counter="items_scanned"} 4',
+                    prometheus_path.read_text())
+      self.assertEqual(
+          sorted(path.name for path in pathlib.Path(directory).iterdir()),
+          ['nested', 'symfs.prom'])
+
+
+if __name__ == '__main__':
+  absltest.main()
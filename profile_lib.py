@@ -0,0 +1,69 @@
+"""Library to profile the phases of a SymFs run.
+
+For each phase, a cProfile dump (`<phase>.pstats`, loadable with `pstats`) and
+a human-readable report (`<phase>.txt`) are written to the output directory.
+If memory profiling is enabled, a tracemalloc snapshot (`<phase>.tracemalloc`,
+loadable with `tracemalloc.Snapshot.load`) is also written, and the peak
+traced memory of each phase is recorded in `summary.json`.
+"""
+
+from typing import Dict, Iterator
+
+import contextlib
+import cProfile
+import io
+import json
+import pathlib
+import pstats
+import tracemalloc
+
+# Number of functions to include in the human-readable report.
+_REPORT_LIMIT = 50
+
+
+class Profiler:
+  """Profiles phases and writes the results to a directory.
+
+  Attributes:
+    directory: The directory to write the profiles to.
+    memory: Whether or not to also trace memory allocations.
+    peak_memory: The peak traced memory, in bytes, of each phase.
+  """
+
+  def __init__(self, directory: pathlib.Path, memory: bool = False) -> None:
+    self.directory = directory
+    self.memory = memory
+    self.peak_memory: Dict[str, int] = {}
+
+    self.directory.mkdir(parents=True, exist_ok=True)
+
+  def _write_report(self, name: str, profile: cProfile.Profile) -> None:
+    """Writes the human-readable report of profile."""
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(
+        pstats.SortKey.CUMULATIVE).print_stats(_REPORT_LIMIT)
+    (self.directory / f'{name}.txt').write_text(stream.getvalue())
+
+  @contextlib.contextmanager
+  def phase(self, name: str) -> Iterator[None]:
+    """Context manager that profiles the block as phase name."""
+    if self.memory:
+      tracemalloc.start()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+      yield
+    finally:
+      profile.disable()
+      profile.dump_stats(self.directory / f'{name}.pstats')
+      self._write_report(name, profile)
+      if self.memory:
+        _, self.peak_memory[name] = tracemalloc.get_traced_memory()
+        tracemalloc.take_snapshot().dump(
+            str(self.directory / f'{name}.tracemalloc'))
+        tracemalloc.stop()
+
+  def write_summary(self) -> None:
+    """Writes the peak memory of each phase to summary.json."""
+    (self.directory / 'summary.json').write_text(
+        json.dumps({'peak_memory_bytes': self.peak_memory}, indent=2) + '\n')
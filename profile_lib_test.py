@@ -0,0 +1,54 @@
+import json
+import pathlib
+import pstats
+import tempfile
+import tracemalloc
+
+from absl.testing import absltest
+
+import profile_lib
+
+
+class ProfilerTest(absltest.TestCase):
+  """Tests for profile_lib."""
+
+  def test_phase(self):
+    """Ensures a profile and report are written for each phase."""
+    with tempfile.TemporaryDirectory() as directory:
+      path = pathlib.Path(directory) / 'profiles'
+      profiler = profile_lib.Profiler(path)
+      with profiler.phase('scan'):
+        sorted(range(1000), reverse=True)
+      profiler.write_summary()
+
+      self.assertEqual(
+          sorted(item.name for item in path.iterdir()),
+          ['scan.pstats', 'scan.txt', 'summary.json'])
+      self.assertIn('sorted', (path / 'scan.txt').read_text())
+      pstats.Stats(str(path / 'scan.pstats'))
+      self.assertEqual(
+          json.loads((path / 'summary.json').read_text()),
+          {'peak_memory_bytes': {}})
+
+  def test_phase_memory(self):
+    """Ensures memory snapshots and peaks are recorded for each phase."""
+    with tempfile.TemporaryDirectory() as directory:
+      path = pathlib.Path(directory)
+      profiler = profile_lib.Profiler(path, memory=True)
+      with profiler.phase('scan'):
+        data = [bytes(1024) for _ in range(1024)]
+      del data
+      with profiler.phase('generate'):
+        pass
+      profiler.write_summary()
+
+      self.assertFalse(tracemalloc.is_tracing())
+      tracemalloc.Snapshot.load(str(path / 'scan.tracemalloc'))
+      peak_memory = json.loads(
+          (path / 'summary.json').read_text())['peak_memory_bytes']
+      self.assertGreater(peak_memory['scan'], 1024 * 1024)
+      self.assertLess(peak_memory['generate'], peak_memory['scan'])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,145 @@
+"""Benchmarks the startup cost of SymFs.
+
+Every SymFs run is a fresh process (e.g. one per config per timer tick), so the
+time spent importing modules is paid on every run. Each statement below is
+timed in a fresh Python process, and the results are summarized over `--runs`
+runs; `first scan` is the time from the start of the process to the first item
+scanned from the example media. With `--importtime`, the slowest imports (as
+reported by `python -X importtime`) of `import symfs` are also printed.
+
+With `--binary`, whole runs of a built binary (e.g. `bazel-bin/symfs.zip`, or
+`bazel-bin/symfs` to run its runfiles tree in place) on the example media are
+timed as well, which includes what the binary does before importing SymFs
+(e.g. extracting the zip and compiling modules without bytecode).
+
+Usage:
+    bazel run :startup_benchmark -- [--runs=<runs>] [--importtime] \
+        [--binary=<binary>]
+"""
+
+from typing import List, Mapping, Tuple
+
+import functools
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+
+_BINARY = flags.DEFINE_string(
+    'binary', None, 'If set, also time whole runs of this binary on the '
+    'example media.')
+
+_IMPORTTIME = flags.DEFINE_bool(
+    'importtime', False, 'If set, also print the slowest imports of symfs.')
+
+_RUNS = flags.DEFINE_integer('runs', 10,
+                             'Number of fresh processes per statement.')
+
+_TOP = flags.DEFINE_integer('top', 15,
+                            'Number of imports to print with --importtime.')
+
+_EXAMPLE_DIR = pathlib.Path(__file__).resolve().parent / 'example'
+_EXAMPLE_MEDIA = str(_EXAMPLE_DIR / 'media')
+
+# The statements to time; each statement runs in a fresh process.
+STATEMENTS: Mapping[str, str] = {
+    'import ext_lib': 'import ext_lib',
+    'import symfs': 'import symfs',
+    'resolve financials': (
+        'import ext_lib\n'
+        'ext_lib.get_derived_metadata_derivation('
+        '"derived_metadata.financials.from_statement_path")'),
+    'resolve generic_values': (
+        'import ext_lib\n'
+        'ext_lib.get_derived_metadata_derivation('
+        '"derived_metadata.generic_values.FixedGrouping")'),
+    'first scan': (
+        'import symfs\n'
+        'config = symfs.symfs_pb2.Config(\n'
+        f'    path="/nonexistent", source_paths=[{_EXAMPLE_MEDIA!r}])\n'
+        'next(symfs.SymFs(config).scan_metadata())'),
+}
+
+_TIMER_PROGRAM = '''
+import time
+_start = time.perf_counter()
+exec({statement!r})
+print(time.perf_counter() - _start)
+'''
+
+
+def _environment() -> Mapping[str, str]:
+  """Returns the environment for child processes to import SymFs modules."""
+  return dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+
+def time_statement(statement: str) -> float:
+  """Returns the seconds taken to execute statement in a fresh process."""
+  output = subprocess.run(
+      (sys.executable, '-c', _TIMER_PROGRAM.format(statement=statement)),
+      check=True,
+      capture_output=True,
+      env=_environment(),
+      text=True).stdout
+  return float(output.strip().splitlines()[-1])
+
+
+def time_binary(binary: str) -> float:
+  """Returns the seconds taken by a dry run of binary on the example media."""
+  with tempfile.TemporaryDirectory() as path:
+    start = time.perf_counter()
+    subprocess.run(
+        (sys.executable, binary, '--config_file',
+         str(_EXAMPLE_DIR / 'config.textproto'), '--source_paths',
+         _EXAMPLE_MEDIA, '--path', path, '--dry_run'),
+        check=True,
+        capture_output=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(statement: str, top: int) -> List[Tuple[int, str]]:
+  """Returns the `top` slowest (cumulative microseconds, module) imports."""
+  stderr = subprocess.run((sys.executable, '-X', 'importtime', '-c', statement),
+                          check=True,
+                          capture_output=True,
+                          env=_environment(),
+                          text=True).stderr
+  imports = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, module = line[len('import time:'):].split('|')
+    imports.append((int(cumulative), module.rstrip()))
+  return sorted(imports, reverse=True)[:top]
+
+
+def main(argv):
+  del argv
+
+  print(f'{"statement":<24} {"median ms":>10} {"min ms":>10} {"max ms":>10}')
+  timers = {
+      name: functools.partial(time_statement, statement)
+      for name, statement in STATEMENTS.items()
+  }
+  if _BINARY.value:
+    timers[os.path.basename(_BINARY.value)] = functools.partial(
+        time_binary, _BINARY.value)
+  for name, timer in timers.items():
+    timings = [timer() * 1000 for _ in range(_RUNS.value)]
+    print(f'{name:<24} {statistics.median(timings):>10.1f} '
+          f'{min(timings):>10.1f} {max(timings):>10.1f}')
+
+  if _IMPORTTIME.value:
+    print(f'\n{"cumulative ms":>13} module')
+    for cumulative, module in slowest_imports('import symfs', _TOP.value):
+      print(f'{cumulative / 1000:>13.1f} {module}')
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,151 @@
+"""Library to summarize the shape of the groups of a SymFs.
+
+The number of links a SymFs generates grows quickly with the number of values
+of repeated fields: an item with `n` values in a field yields up to
+`sum(C(n, k) for k in 1..max_repeated_group)` keys in that group, and nested
+fields multiply. The statistics here show which groups, keys, and items
+contribute the most, so a config can be tuned before it is generated.
+
+Statistics are computed from the number of values of each field of each item
+(cheap to get from the metadata), and optionally from the computed mapping.
+Without the mapping, the number of keys of each item is projected from the
+number of values, which is an upper bound, as duplicate values yield the same
+keys.
+"""
+
+from typing import (Any, Dict, Hashable, Iterable, List, Mapping, Optional,
+                    Sequence, Set, Tuple, TypeVar)
+
+import collections
+import heapq
+import math
+import pathlib
+
+import protos.symfs_pb2 as symfs_pb2
+
+GroupToKeyToPathMapping = Mapping[str, Mapping[str, Set[pathlib.Path]]]
+# The number of values of each field of a GroupBy, by item, by group name.
+GroupToValueCounts = Mapping[str, Mapping[pathlib.Path, Sequence[int]]]
+
+T = TypeVar('T', bound=Hashable)
+
+
+def histogram(values: Iterable[int]) -> Dict[str, int]:
+  """Returns the number of values in each power-of-two bucket.
+
+  Buckets are named by their inclusive bounds, e.g. "0", "1", "2-3", "4-7".
+  """
+  counts = collections.Counter(
+      0 if value <= 0 else 1 << (value.bit_length() - 1) for value in values)
+  return {
+      (str(low) if low <= 1 else f'{low}-{2 * low - 1}'): counts[low]
+      for low in sorted(counts)
+  }
+
+
+def count_group_keys(value_counts: Sequence[int],
+                     max_repeated_group: int) -> int:
+  """Returns the number of keys generated for the given numbers of values.
+
+  Args:
+    value_counts: The number of values of each (nested) field of a GroupBy.
+    max_repeated_group: As in `Config.GroupBy`.
+
+  Returns:
+    The number of keys, counting duplicates.
+  """
+  keys = 1
+  for value_count in value_counts:
+    keys *= sum(
+        math.comb(value_count, size)
+        for size in range(1, 1 + min(max_repeated_group or 1, value_count)))
+  return keys
+
+
+def top(counts: Mapping[T, int], n: int) -> List[Tuple[T, int]]:
+  """Returns the n largest counts, breaking ties by their keys."""
+  return heapq.nsmallest(
+      n, counts.items(), key=lambda item: (-item[1], str(item[0])))
+
+
+def _group_stats(group_by: symfs_pb2.Config.GroupBy,
+                 value_counts: Mapping[pathlib.Path, Sequence[int]],
+                 paths_by_keys: Optional[Mapping[str, Set[pathlib.Path]]],
+                 top_n: int) -> Dict[str, Any]:
+  """Returns the statistics of a single group; see `compute`."""
+  projected_keys = {
+      item: count_group_keys(counts, group_by.max_repeated_group)
+      for item, counts in value_counts.items()
+  }
+  stats = {
+      'fields': list(group_by.field),
+      'max_repeated_group': group_by.max_repeated_group,
+      'projected_links': sum(projected_keys.values()),
+      'values_per_item': {
+          field: histogram(counts[index] for counts in value_counts.values())
+          for index, field in enumerate(group_by.field)
+      },
+  }
+
+  if paths_by_keys is None:
+    keys_by_item = projected_keys
+  else:
+    keys_by_item = collections.Counter()
+    for items in paths_by_keys.values():
+      keys_by_item.update(items)
+    items_by_key = {key: len(items) for key, items in paths_by_keys.items()}
+    stats.update({
+        'keys': len(items_by_key),
+        'links': sum(items_by_key.values()),
+        'items_per_key': histogram(items_by_key.values()),
+        'top_keys': [{
+            'key': key,
+            'items': count
+        } for key, count in top(items_by_key, top_n)],
+    })
+
+  stats.update({
+      'items': len(keys_by_item),
+      'keys_per_item': histogram(keys_by_item.values()),
+      'top_items': [{
+          'item': str(item),
+          'keys': count
+      } for item, count in top(keys_by_item, top_n)],
+  })
+  return stats
+
+
+def compute(group_bys: Iterable[symfs_pb2.Config.GroupBy],
+            value_counts: GroupToValueCounts,
+            mapping: Optional[GroupToKeyToPathMapping] = None,
+            top_n: int = 10) -> Dict[str, Any]:
+  """Returns the statistics of each group, suitable for JSON.
+
+  Args:
+    group_bys: The GroupBy of each group.
+    value_counts: The number of values of each field, by item, by group name.
+      Items without values in a group should be omitted from it.
+    mapping: If set, the mapping computed from the same items, which adds the
+      actual keys and links (e.g. `keys`, `links`, `items_per_key`, and
+      `top_keys`) to the projected ones. Otherwise, `keys_per_item` and
+      `top_items` are projected.
+    top_n: The number of heaviest keys and items to report.
+
+  Returns:
+    The statistics of each group, under `groups`, and the (projected) total
+    number of links.
+  """
+  groups = {
+      group_by.name: _group_stats(
+          group_by, value_counts.get(group_by.name, {}),
+          None if mapping is None else mapping.get(group_by.name, {}), top_n)
+      for group_by in group_bys
+  }
+  stats = {
+      'groups': groups,
+      'projected_links': sum(
+          group['projected_links'] for group in groups.values()),
+  }
+  if mapping is not None:
+    stats['links'] = sum(group['links'] for group in groups.values())
+  return stats
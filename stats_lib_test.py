@@ -0,0 +1,98 @@
+import pathlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+import protos.symfs_pb2 as symfs_pb2
+import stats_lib
+
+_A = pathlib.Path('/a')
+_B = pathlib.Path('/b')
+
+
+class StatsLibTest(parameterized.TestCase):
+
+  @parameterized.parameters(
+      ([], {}),
+      ([0, 1, 1], {
+          '0': 1,
+          '1': 2
+      }),
+      ([2, 3, 4, 7, 8], {
+          '2-3': 2,
+          '4-7': 2,
+          '8-15': 1
+      }),
+  )
+  def test_histogram(self, values, expected):
+    self.assertEqual(stats_lib.histogram(values), expected)
+
+  @parameterized.parameters(
+      ([1], 3, 1),
+      ([3], 0, 3),
+      ([3], 1, 3),
+      ([3], 2, 6),
+      ([3], 3, 7),
+      ([4], 3, 14),
+      ([3, 2], 2, 18),
+      ([3, 0], 2, 0),
+  )
+  def test_count_group_keys(self, value_counts, max_repeated_group, expected):
+    """Ensures the count matches the combinations generate_groups yields."""
+    self.assertEqual(
+        stats_lib.count_group_keys(value_counts, max_repeated_group), expected)
+
+  def test_top(self):
+    self.assertEqual(
+        stats_lib.top({
+            'b': 1,
+            'a': 1,
+            'c': 2
+        }, 2), [('c', 2), ('a', 1)])
+
+  def test_compute_preflight(self):
+    """Ensures keys and links are projected without a mapping."""
+    group_by = symfs_pb2.Config.GroupBy(
+        name='by_cast', field=['casts'], max_repeated_group=2)
+
+    stats = stats_lib.compute([group_by], {'by_cast': {_A: [3], _B: [1]}},
+                              top_n=1)
+
+    self.assertEqual(stats['projected_links'], 7)
+    self.assertNotIn('links', stats)
+    group = stats['groups']['by_cast']
+    self.assertEqual(group['items'], 2)
+    self.assertEqual(group['values_per_item'], {'casts': {'1': 1, '2-3': 1}})
+    self.assertEqual(group['keys_per_item'], {'1': 1, '4-7': 1})
+    self.assertEqual(group['top_items'], [{'item': '/a', 'keys': 6}])
+    self.assertNotIn('top_keys', group)
+
+  def test_compute_mapping(self):
+    """Ensures the actual keys and links are reported with a mapping."""
+    group_by = symfs_pb2.Config.GroupBy(
+        name='by_cast', field=['casts'], max_repeated_group=1)
+    mapping = {'by_cast': {'x': {_A, _B}, 'y': {_A}}}
+
+    stats = stats_lib.compute([group_by], {'by_cast': {
+        _A: [2],
+        _B: [1]
+    }}, mapping)
+
+    self.assertEqual(stats['links'], 3)
+    self.assertEqual(stats['projected_links'], 3)
+    group = stats['groups']['by_cast']
+    self.assertEqual(group['keys'], 2)
+    self.assertEqual(group['items_per_key'], {'1': 1, '2-3': 1})
+    self.assertEqual(group['keys_per_item'], {'1': 1, '2-3': 1})
+    self.assertEqual(group['top_keys'], [{
+        'key': 'x',
+        'items': 2
+    }, {
+        'key': 'y',
+        'items': 1
+    }])
+    self.assertEqual(group['top_items'][0], {'item': '/a', 'keys': 2})
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -1,12 +1,16 @@
-from typing import Any, Iterable, Iterator, Mapping, Optional, Set, Tuple
+from typing import (Any, Callable, Collection, Dict, FrozenSet, Iterable,
+                    Iterator, List, Mapping, Optional, Set, Tuple)
 
+import collections
 import functools
+import hashlib
 import itertools
+import json
 import os
 import pathlib
-import pprint
 import re
-import shutil
+import signal
+import time
 
 from absl import app
 from absl import flags
@@ -16,15 +20,46 @@ from google.protobuf import message
 from google.protobuf import text_format
 from google.protobuf.internal.containers import RepeatedScalarFieldContainer
 
+import changes_lib
+import checkpoint_lib
+import columnar_lib
 import ext_lib
+import fs_lib
+import journal_lib
+import mapping_lib
+import metrics_lib
 import protos.symfs_pb2 as symfs_pb2
+import stats_lib
+import throttle_lib
 
 _APPEND = flags.DEFINE_bool(
     'append', False, 'If set, items specified on the commandline will be '
     'appended to repeatable fields in the config instead of replaced.')
 
-_CONFIG_FILE = flags.DEFINE_string('config_file', None,
-                                   'Textproto containing SymFs.Config proto.')
+_CHANGE_LOG = flags.DEFINE_string(
+    'change_log', None, 'If set, append the items added to and removed from '
+    'each group key by this run to this file, so that consumers can follow the '
+    'SymFs without walking it. The mapping logged is kept next to it, in '
+    '.<name>.mapping. Items are only logged as removed by runs that remove '
+    'links: with clear, --journal, --gc_journal, --verify, or --serve.')
+
+_CHANGE_LOG_FORMAT = flags.DEFINE_enum(
+    'change_log_format', 'json', list(changes_lib.FORMATS), 'With '
+    '--change_log, write one JSON object per line, or Change protos each '
+    'preceded by its size as a varint.')
+
+_CHECKPOINT_INTERVAL = flags.DEFINE_float(
+    'checkpoint_interval', 30, 'With --state_file, the minimum number of '
+    'seconds between checkpoints.')
+
+_CONFIG_FILE = flags.DEFINE_multi_string(
+    'config_file', None, 'Textproto containing SymFs.Config proto. May be '
+    'repeated to generate multiple SymFs in one run.')
+
+_DEADLINE = flags.DEFINE_float(
+    'deadline', None, 'If set, the number of seconds since the start of the '
+    'run to stop generating by. Groups that could not be generated in time are '
+    'left untouched and logged; see Config.GroupBy.priority.')
 
 _DRY_RUN = flags.DEFINE_bool('dry_run', False,
                              'If set, only log during generate.')
@@ -32,14 +67,184 @@ _DRY_RUN = flags.DEFINE_bool('dry_run', False,
 _GROUP_BY = flags.DEFINE_multi_string(
     'group_by', None, 'Specify a GroupBy in the form of <name>:<field>.')
 
+_GC_JOURNAL = flags.DEFINE_string(
+    'gc_journal', None, 'If set, record the links of the SymFs in this file, '
+    'and on the next run, remove those left dangling by items that were moved '
+    'or deleted since, without clearing or walking the SymFs.')
+
+_IO_PRIORITY = flags.DEFINE_enum(
+    'io_priority', None, list(throttle_lib.IO_PRIORITY_CLASSES),
+    'If set, the I/O priority class of this process; e.g. idle to only use '
+    'the disk when nothing else does.')
+
+_IO_PRIORITY_LEVEL = flags.DEFINE_integer(
+    'io_priority_level', 4, 'With --io_priority, the priority within the '
+    'class, from 0 (highest) to 7 (lowest).')
+
+_JOBS = flags.DEFINE_integer(
+    'jobs', None, 'With multiple --config_file, the number of SymFs to '
+    'generate in parallel; defaults to the number of CPUs.')
+
+_JOURNAL = flags.DEFINE_string(
+    'journal', None, 'If set, record the mapping the SymFs was generated from '
+    'in this file, and on the next run, only add and remove the links of items '
+    'that changed since, instead of clearing or walking the SymFs.')
+
+_MAX_LINKS_PER_SECOND = flags.DEFINE_float(
+    'max_links_per_second', None, 'If set, limit the rate of symlinks and '
+    'directories created or removed.')
+
+_MAX_READ_BYTES_PER_SECOND = flags.DEFINE_float(
+    'max_read_bytes_per_second', None,
+    'If set, limit the rate of bytes of metadata files read.')
+
+_MAX_READS_PER_SECOND = flags.DEFINE_float(
+    'max_reads_per_second', None,
+    'If set, limit the rate of metadata files read.')
+
+_MAX_SCAN_ENTRIES_PER_SECOND = flags.DEFINE_float(
+    'max_scan_entries_per_second', None, 'If set, limit the rate of entries '
+    'walked in the source paths (and the output path when clearing).')
+
+_MERGE = flags.DEFINE_multi_string(
+    'merge', None, 'If set, generate the SymFs from the mappings in these '
+    'files (see --shard_output) instead of scanning the source paths.')
+
+_METRICS_FILE = flags.DEFINE_string(
+    'metrics_file', None,
+    'If set, write per-phase timings and counters as JSON to this file.')
+
 _PATH = flags.DEFINE_string('path', None,
                             'If set, overrides the SymFs.Config.path field.')
 
+_PROFILE = flags.DEFINE_string(
+    'profile', None,
+    'If set, write a cProfile dump for each phase (scan, compute_mapping, '
+    'generate) to this directory.')
+
+_PROFILE_MEMORY = flags.DEFINE_bool(
+    'profile_memory', False,
+    'If set with --profile, also write a tracemalloc snapshot and the peak '
+    'memory for each phase.')
+
+_REFRESH_INTERVAL = flags.DEFINE_float(
+    'refresh_interval', 0,
+    'With --serve, the number of seconds between refreshes; if 0, only refresh '
+    'on request through --socket.')
+
+_REMAP = flags.DEFINE_multi_string(
+    'remap', None, 'With --merge, replace the <old> prefix of item paths with '
+    '<new>, in the form of <old>:<new>; e.g. if a shard scanned paths that are '
+    'mounted elsewhere on this machine.')
+
+_PROMETHEUS_FILE = flags.DEFINE_string(
+    'prometheus_file', None,
+    'If set, write per-phase timings and counters to this file in the '
+    'Prometheus text format (e.g. for the node exporter textfile collector).')
+
+_RESUME = flags.DEFINE_bool(
+    'resume', False, 'With --state_file, continue the run that wrote it (e.g. '
+    'if it was killed), skipping its scan and the group keys it completed; '
+    'without clearing again.')
+
+_SERVE = flags.DEFINE_bool(
+    'serve', False, 'If set, keep running and refresh the SymFs periodically '
+    '(see --refresh_interval) and on request (see --socket), only updating the '
+    'links that changed.')
+
+_SOCKET = flags.DEFINE_string(
+    'socket', None, 'With --serve, the path of a Unix socket to listen on for '
+    'commands; see daemon_lib.')
+
+_SHARD_OUTPUT = flags.DEFINE_string(
+    'shard_output', None, 'If set, write the mapping of the source paths to '
+    'this file instead of generating the SymFs; see --merge.')
+
 _SOURCE_PATHS = flags.DEFINE_multi_string(
     'source_paths', None,
     'If set, overrides the SymFs.Config.source_paths field.')
 
+_STATE_FILE = flags.DEFINE_string(
+    'state_file', None, 'If set, periodically write the progress of the run '
+    'to this file, so that it can be continued with --resume if killed. The '
+    'file is removed once the run finishes.')
+
+_STATS_FILE = flags.DEFINE_string(
+    'stats_file', None, 'If set, write statistics of the groups (e.g. the '
+    'number of keys and links, and the heaviest keys and items) to this file '
+    'as JSON instead of generating the SymFs.')
+
+_STATS_PREFLIGHT = flags.DEFINE_bool(
+    'stats_preflight', False, 'With --stats_file, only project the number of '
+    'keys and links from the number of values of each item, without computing '
+    'the mapping.')
+
+_STATS_TOP = flags.DEFINE_integer(
+    'stats_top', 10, 'With --stats_file, the number of heaviest keys and items '
+    'to report for each group.')
+
+_VERIFY = flags.DEFINE_bool(
+    'verify', False, 'If set, walk the SymFs after generating it, and repair '
+    'links that differ from the mapping (e.g. changed by hand). Skipped if '
+    'groups were deferred by --deadline.')
+
+_WATCH = flags.DEFINE_bool(
+    'watch', False, 'With --serve, watch the source paths with inotify and '
+    'only refresh the items affected by each change. If watching fails (e.g. '
+    'inotify is not available or its watch limit is reached), refresh every '
+    '--refresh_interval seconds, or every 5 minutes if not set.')
+
 GroupToKeyToPathMapping = Mapping[str, Mapping[str, Set[pathlib.Path]]]
+ItemsMetadata = Iterable[Tuple[pathlib.Path, symfs_pb2.Metadata]]
+GroupKey = Tuple[str, str]
+# A path to scan, and whether to scan everything under it.
+Scope = Tuple[pathlib.Path, bool]
+# The device and inode numbers of an item.
+InodeKey = Tuple[int, int]
+# The index of a group_by of scalar fields, and the values of the fields.
+Row = Tuple[int, Tuple[str, ...]]
+# The group keys generated from a Metadata.data, the errors doing so, and the
+# rows of the group_bys grouped with columnar_lib instead.
+InternedKeys = Tuple[Tuple[GroupKey, ...], Tuple[str, ...], Tuple[Row, ...]]
+
+# The digest of the serialized Metadata.data the group keys of items are
+# interned by, and whether they were computed for columnar_lib; see
+# SymFs._get_keys.
+InternKey = Tuple[bytes, bool]
+
+# Metadata files with this suffix are in the binary wire format.
+BINARY_METADATA_SUFFIX = '.binpb'
+
+
+def merge_metadata(parent: symfs_pb2.Metadata,
+                   child: symfs_pb2.Metadata) -> symfs_pb2.Metadata:
+  """Returns child merged over parent; see `Config.MetadataFiles.inherit`.
+
+  Concatenating serialized messages merges them as `MergeFrom` does, so the
+  data is merged without parsing it.
+  """
+  if not child.data.type_url:
+    return parent
+  if parent.data.type_url != child.data.type_url:
+    return child
+  merged = symfs_pb2.Metadata()
+  merged.data.type_url = child.data.type_url
+  merged.data.value = parent.data.value + child.data.value
+  return merged
+
+
+def _get_intern_key(metadata: symfs_pb2.Metadata,
+                    columnar: bool = False) -> InternKey:
+  """Returns the key the group keys of metadata are interned by.
+
+  The data itself may be large, so only a fixed-size digest of it is kept.
+  """
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(metadata.data.type_url.encode())
+  # Separated, so that the type URL cannot run into the value.
+  digest.update(b'\0')
+  digest.update(metadata.data.value)
+  return (digest.digest(), columnar)
 
 
 def extract_field_as_iterable(message: message.Message,
@@ -139,17 +344,37 @@ def generate_groups(message: message.Message, fields: Iterable[str],
           combinations_cache=combinations_cache)
 
 
-def clear_symlinks(path: pathlib.Path) -> None:
-  """Deletes everything in path; raises if non-symlinks found."""
-  if not path.exists():
+def clear_symlinks(path: pathlib.Path,
+                   filesystem: Optional[fs_lib.FileSystem] = None,
+                   keep: Collection[str] = ()) -> None:
+  """Deletes everything in path; raises if non-symlinks found.
+
+  Args:
+    path: The path to clear.
+    filesystem: The filesystem to use; defaults to the local filesystem.
+    keep: The names of the entries directly in path to leave as they are;
+      they are still checked for non-symlinks. If empty, path itself is
+      deleted as well.
+  """
+  filesystem = filesystem or fs_lib.LocalFileSystem()
+  if not filesystem.exists(path):
     return
 
-  for item in path.rglob('*'):
-    if not item.is_symlink() and not item.is_dir():
-      raise TypeError(
-          f'Refusing to clear a non-directory or non-symlink item: {item}.')
+  for entry in filesystem.walk(path):
+    if not entry.is_symlink() and not entry.is_dir(follow_symlinks=False):
+      raise TypeError('Refusing to clear a non-directory or non-symlink item: '
+                      f'{entry.path}.')
 
-  shutil.rmtree(path)
+  if not keep:
+    filesystem.rmtree(path)
+    return
+  for entry in list(filesystem.walk(path, recursive=False)):
+    if entry.name in keep:
+      continue
+    if entry.is_dir(follow_symlinks=False):
+      filesystem.rmtree(entry.path)
+    else:
+      filesystem.unlink(entry.path)
 
 
 class SymFs:
@@ -160,11 +385,37 @@ class SymFs:
   as defined in `Config.group_by.name`, to group keys, as obtained from
   `Metadata.data` and selected by `Config.group_by.field`, to a set of paths to
   contain in said group key.
+
+  Timings and counters of each phase of the run are recorded in `metrics`. All
+  filesystem operations go through `filesystem`.
+
+  For long-running processes, `refresh` can be called repeatedly instead of
+  `generate`; it only parses files and updates links that changed since the
+  previous refresh.
+
+  Given the mapping a SymFs was last generated from, `reconcile` only updates
+  the links that changed since, and `verify` repairs links changed by anything
+  else.
   """
 
-  def __init__(self, config: symfs_pb2.Config) -> None:
-    """Initializes the SymFs object and set defaults."""
+  def __init__(self,
+               config: symfs_pb2.Config,
+               metrics: Optional[metrics_lib.Metrics] = None,
+               filesystem: Optional[fs_lib.FileSystem] = None,
+               cache_metadata: bool = False) -> None:
+    """Initializes the SymFs object and set defaults.
+
+    Args:
+      config: The config of the SymFs.
+      metrics: Where to record metrics; a new one is created if not provided.
+      filesystem: The filesystem to use; defaults to the local filesystem.
+      cache_metadata: If set, keep the metadata of each file between scans, and
+        only parse or derive it again if the file changed.
+    """
     self.config = config
+    self.metrics = metrics or metrics_lib.Metrics()
+    self.filesystem = filesystem or fs_lib.LocalFileSystem()
+    self.metrics.set_info('protobuf_backend', ext_lib.get_protobuf_backend())
 
     if not self.config.path:
       raise ValueError('The path field must be set.')
@@ -179,18 +430,260 @@ class SymFs:
     if self.config.WhichOneof('metadata') is None:
       self.config.metadata_files.patterns.append(r'^metadata\.textproto$')
 
+    if self.config.columnar and not columnar_lib.AVAILABLE:
+      raise ValueError('Config.columnar requires NumPy, which is not '
+                       'installed.')
+
+    group_names = {group_by.name for group_by in self.config.group_by}
+    for combination in self.config.combinations:
+      if not combination.group or not combination.key:
+        raise ValueError('The group and key of each combination must be set.')
+      if combination.group in group_names:
+        raise ValueError(f'Combination group {combination.group} is also the '
+                         'name of a group_by.')
+      for operand in combination.operands:
+        if operand.group not in group_names:
+          raise ValueError(f'Combination operand group {operand.group} is not '
+                           'the name of a group_by.')
+
     for path in itertools.chain((self.config.path,), self.config.source_paths):
       if not pathlib.Path(path).is_absolute():
         logging.warning('%s is not an absolute path; may cause broken links!',
                         path)
 
+    for descriptor_set_file in self.config.descriptor_set_files:
+      ext_lib.load_descriptor_set(pathlib.Path(descriptor_set_file))
+
     self.paths_by_keys_by_group: GroupToKeyToPathMapping = {}
 
-    if self.config.clear:
-      clear_symlinks(pathlib.Path(self.config.path))
+    # Metadata of the current and previous scan, by file; see _cached.
+    self._metadata_cache: Optional[Dict[pathlib.Path, Tuple[
+        Tuple[int, ...], symfs_pb2.Metadata]]] = {} if cache_metadata else None
+    self._previous_metadata_cache = {}
+    # The metadata merged from parent and child metadata of the current and
+    # previous scan, by the ids of both; see _merge.
+    self._merge_cache: Optional[Dict[Tuple[int, int], Tuple[
+        symfs_pb2.Metadata, symfs_pb2.Metadata,
+        symfs_pb2.Metadata]]] = {} if cache_metadata else None
+    self._previous_merge_cache = {}
+
+    # The metadata and group keys of each item as of the last refresh.
+    self._refreshed_items: Optional[Dict[pathlib.Path, List[Tuple[
+        symfs_pb2.Metadata, FrozenSet[GroupKey]]]]] = None
+
+    # The derive and prepare functions of `Config.derived_metadata`; see
+    # _get_derivation.
+    self._derivation: Optional[Tuple[Callable[[pathlib.Path],
+                                              symfs_pb2.Metadata],
+                                     Optional[Callable[[List[pathlib.Path]],
+                                                       None]]]] = None
+
+    # The path each item was scanned through, and the paths whose items are
+    # linked through another path instead; see _is_scanned_elsewhere.
+    self._scanned_inodes: Dict[InodeKey, pathlib.Path] = {}
+    self._aliases: Dict[pathlib.Path, pathlib.Path] = {}
+
+    # The group keys of each distinct Metadata.data; see _get_keys.
+    self._interned_keys: Dict[InternKey, InternedKeys] = {}
+    # The number of refreshed items with each interned data, so that refresh
+    # drops the keys of data no item has anymore.
+    self._intern_references: Dict[InternKey, int] = {}
+    # The extractor of each group_by of scalar fields of each message type,
+    # by the index of the group_by.
+    self._extractors: Dict[str, Dict[int, columnar_lib.Extractor]] = {}
+
+    # Whether `Config.clear` is still to be applied; it is applied by the
+    # first generate or refresh, so that deferred groups are left untouched.
+    self._clear_pending = self.config.clear
+
+  def _walk(self,
+            path: pathlib.Path,
+            recursive: bool = True) -> Iterator[fs_lib.Entry]:
+    """Yields all entries under path, timed as the walk phase.
+
+    With `Config.deduplication`, entries already scanned through another path
+    are skipped, and so is everything under them (or path itself).
+    """
+    deduplicate = bool(self.config.deduplication)
+    if deduplicate and self._is_duplicate(path):
+      return
+    skipped: Set[pathlib.Path] = set()
+    walk = self.filesystem.walk(
+        path,
+        recursive=recursive,
+        descend=(lambda entry: entry.path not in skipped)
+        if deduplicate else None)
+    for entry in self.metrics.timed(walk, 'walk'):
+      self.metrics.increment('items_scanned', phase='walk')
+      if deduplicate and self._is_duplicate_entry(entry):
+        skipped.add(entry.path)
+        continue
+      yield entry
+
+  def _get_inode_key(self, path: pathlib.Path) -> Optional[InodeKey]:
+    """Returns the device and inode numbers of path, or None if missing."""
+    try:
+      stat = self.filesystem.stat(path)
+    except OSError:
+      return None
+    return stat.st_dev, stat.st_ino
+
+  def _is_duplicate(self, path: pathlib.Path) -> bool:
+    """Returns whether path was already scanned through another path."""
+    key = self._get_inode_key(path)
+    return key is not None and self._is_scanned_elsewhere(path, key)
+
+  def _is_duplicate_entry(self, entry: fs_lib.Entry) -> bool:
+    """Returns whether entry was already scanned through another path.
+
+    Only directories, and files if metadata is derived for them, are checked;
+    other files are not items, so are not worth a stat each.
+    """
+    ItemMode = symfs_pb2.Config.DerivedMetadata.ItemMode
+    if entry.is_dir(follow_symlinks=False):
+      return self._is_duplicate(entry.path)
+    if (self.config.WhichOneof('metadata') == 'derived_metadata' and
+        self.config.derived_metadata.item_mode
+        in (ItemMode.ALL, ItemMode.FILES) and entry.is_file()):
+      return self._is_duplicate(entry.path)
+    return False
+
+  def _is_scanned_elsewhere(self, path: pathlib.Path, key: InodeKey) -> bool:
+    """Records that path was scanned, unless it was through another path.
+
+    If it was, and `Config.deduplication` prefers path to the other path, the
+    items found through the other path are linked through path instead (see
+    `scan_metadata`).
+
+    Args:
+      path: The path of the item being scanned.
+      key: The device and inode numbers of path.
+
+    Returns:
+      Whether the item was already scanned through another path, in which case
+      it should be skipped.
+    """
+    scanned = self._scanned_inodes.setdefault(key, path)
+    if scanned == path:
+      return False
+    if self._get_inode_key(scanned) != key:
+      # The other path was removed since, and its inode number reused.
+      self._scanned_inodes[key] = path
+      return False
+
+    if (self.config.deduplication
+        == symfs_pb2.Config.Deduplication.SHORTEST_PATH and
+        (len(path.parts), str(path)) < (len(scanned.parts), str(scanned))):
+      for alias, target in self._aliases.items():
+        if target == scanned:
+          self._aliases[alias] = path
+      self._aliases[scanned] = path
+      self._scanned_inodes[key] = path
+    logging.debug('%s was already scanned as %s; skipping.', path, scanned)
+    self.metrics.increment('items_deduplicated', phase='walk')
+    return True
+
+  def _cached(self, entry: fs_lib.Entry,
+              compute: Callable[[], symfs_pb2.Metadata]) -> symfs_pb2.Metadata:
+    """Returns compute(), or its result from the previous scan if unchanged.
+
+    A file is considered unchanged if its mtime, size, and inode are. Only
+    files are cached, since a directory's mtime does not reflect changes to
+    nested items.
+    """
+    if self._metadata_cache is None or not entry.is_file():
+      return compute()
+
+    stat = self.filesystem.stat(entry.path)
+    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino, stat.st_dev)
+    cached = self._previous_metadata_cache.get(entry.path)
+    if cached is not None and cached[0] == signature:
+      metadata = cached[1]
+      self.metrics.increment('metadata_cached')
+    else:
+      metadata = compute()
+    self._metadata_cache[entry.path] = (signature, metadata)
+    return metadata
+
+  def _merge(self, parent: symfs_pb2.Metadata,
+             child: symfs_pb2.Metadata) -> symfs_pb2.Metadata:
+    """Returns merge_metadata(parent, child), as merged in the previous scan.
+
+    With cache_metadata, unchanged metadata files are the same objects in each
+    scan, so merging them again returns the same object as well; refresh then
+    recognizes inherited metadata as unchanged.
+    """
+    if self._merge_cache is None:
+      return merge_metadata(parent, child)
+    key = (id(parent), id(child))
+    cached = self._merge_cache.get(key) or self._previous_merge_cache.get(key)
+    # The ids of objects no longer referenced may have been reused.
+    if cached is not None and cached[0] is parent and cached[1] is child:
+      merged = cached[2]
+    else:
+      merged = merge_metadata(parent, child)
+    self._merge_cache[key] = (parent, child, merged)
+    return merged
+
+  def _parse_metadata_file(self, path: pathlib.Path) -> symfs_pb2.Metadata:
+    """Returns the Metadata parsed from the file at path.
+
+    Files ending in `BINARY_METADATA_SUFFIX` are parsed from the binary wire
+    format, which is several times faster than the text format; if such a file
+    is not valid binary, it is parsed as text instead.
+    """
+    logging.debug('Processing %s.', path)
+    with self.metrics.phase('parse'):
+      if path.suffix == BINARY_METADATA_SUFFIX:
+        content = self.filesystem.read_bytes(path)
+        try:
+          metadata = symfs_pb2.Metadata.FromString(content)
+          self.metrics.increment('metadata_parsed_binary', phase='parse')
+        except message.DecodeError:
+          logging.warning('%s is not a binary Metadata; parsing as text.',
+                          path)
+          metadata = text_format.Parse(content.decode(), symfs_pb2.Metadata())
+      else:
+        metadata = text_format.Parse(
+            self.filesystem.read_text(path), symfs_pb2.Metadata())
+    self.metrics.increment('metadata_parsed', phase='parse')
+    return metadata
+
+  def _is_metadata_file_name(self, name: str) -> bool:
+    """Returns whether name matches Config.metadata_files.patterns."""
+    return any(
+        re.match(pattern, name)
+        for pattern in self.config.metadata_files.patterns)
+
+  def _get_inherited_metadata(
+      self, path: pathlib.Path) -> Optional[symfs_pb2.Metadata]:
+    """Returns the metadata path inherits from the directories above it.
+
+    Only directories up to the source path of path are considered, so this is
+    None when scanning a whole source path.
+    """
+    source_path = next(
+        (pathlib.Path(source_path)
+         for source_path in self.config.source_paths
+         if pathlib.Path(source_path) in path.parents), None)
+    if source_path is None:
+      return None
+    inherited = None
+    for relative in reversed(path.relative_to(source_path).parents):
+      for entry in self.filesystem.walk(source_path / relative,
+                                        recursive=False):
+        if entry.is_file() and self._is_metadata_file_name(entry.name):
+          metadata = self._cached(
+              entry, functools.partial(self._parse_metadata_file, entry.path))
+          inherited = (
+              metadata
+              if inherited is None else self._merge(inherited, metadata))
+    return inherited
 
   def _scan_metadata_files(
-      self) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
+      self,
+      scopes: Optional[Iterable[Scope]] = None
+  ) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
     """Yields tuples of directory and associated metadata based on the config.
 
     Scans the `source_paths` given in the `Config.source_paths` for directories
@@ -198,25 +691,83 @@ class SymFs:
     `Config.metadata_files.patterns`. Assumes `Config.metadata` is set to
     `metadata_files`.
 
+    With `Config.metadata_files.inherit`, the merged metadata of each directory
+    is kept for its subdirectories, which the walk reaches after all files of
+    the directory, so each metadata file is parsed once.
+
+    Args:
+      scopes: If set, only scan these instead of `source_paths`.
+
     Yields:
       Tuples of directory and associated metadata for that directory.
     """
-    for source_path in self.config.source_paths:
+    full_scan = scopes is None
+    if full_scan:
+      scopes = self._get_source_scopes()
+    inherit = self.config.metadata_files.inherit
+    for path, recursive in scopes:
       yielded = False
-      for item in pathlib.Path(source_path).rglob('*'):
-        if item.is_file() and any(
-            re.match(pattern, item.name)
-            for pattern in self.config.metadata_files.patterns):
-          logging.debug('Processing %s.', item)
-          metadata = symfs_pb2.Metadata()
-          text_format.Parse(item.read_text(), metadata)
+      # The merged metadata of each directory with metadata files.
+      inherited: Dict[pathlib.Path, symfs_pb2.Metadata] = {}
+      if inherit:
+        metadata = self._get_inherited_metadata(path)
+        if metadata is not None:
+          inherited[path.parent] = metadata
+      for entry in self._walk(path, recursive):
+        if entry.is_file() and self._is_metadata_file_name(entry.name):
+          metadata = self._cached(
+              entry, functools.partial(self._parse_metadata_file, entry.path))
+          if inherit:
+            metadata = self._inherit(entry.path.parent, metadata, inherited)
           yielded = True
-          yield item.parent, metadata
-      if not yielded:
-        logging.warning('No metadata files found in %s.', source_path)
+          yield entry.path.parent, metadata
+      if full_scan and not yielded:
+        logging.warning('No metadata files found in %s.', path)
+
+  def _inherit(
+      self, directory: pathlib.Path, metadata: symfs_pb2.Metadata,
+      inherited: Dict[pathlib.Path, symfs_pb2.Metadata]) -> symfs_pb2.Metadata:
+    """Returns metadata merged over that of the ancestors of directory.
+
+    Args:
+      directory: The directory of the metadata file.
+      metadata: The metadata parsed from the file.
+      inherited: The merged metadata of each directory with metadata files
+        scanned so far; updated with that of directory.
+
+    Returns:
+      The metadata of directory.
+    """
+    parent = next((inherited[ancestor]
+                   for ancestor in directory.parents
+                   if ancestor in inherited), None)
+    if directory in inherited:
+      inherited[directory] = self._merge(inherited[directory], metadata)
+    else:
+      inherited[directory] = (
+          metadata if parent is None else self._merge(parent, metadata))
+    if parent is None:
+      return metadata
+    self.metrics.increment('metadata_inherited', phase='parse')
+    return self._merge(parent, metadata)
+
+  def _inherit_items(
+      self, items: Iterable[Tuple[pathlib.Path, symfs_pb2.Metadata]]
+  ) -> List[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
+    """Returns items with the metadata of each merged over its ancestors'.
+
+    Items must be those of a single source path, scanned without
+    `Config.metadata_files.inherit`, in the order of the scan; the result is
+    as if they were scanned with it.
+    """
+    inherited: Dict[pathlib.Path, symfs_pb2.Metadata] = {}
+    return [(item, self._inherit(item, metadata, inherited))
+            for item, metadata in items]
 
   def _derive_items_metadata(
-      self) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
+      self,
+      scopes: Optional[Iterable[Scope]] = None
+  ) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
     """Yields tuples of items and derived metadata based on config.
 
     As documented in `symfs.proto` for `Config.derived_metadata`, a custom
@@ -227,87 +778,443 @@ class SymFs:
     The expected return value will be the derived metadata, which this method
     will yield in addition to the item path itself.
 
+    Args:
+      scopes: If set, only scan these instead of `source_paths`; the path of
+        each scope is itself an item, unless it is a source path.
+
     Yields:
       Tuples of items and associated metadata for that item.
     """
-    derivation = ext_lib.get_derived_metadata_derivation(
-        self.config.derived_metadata.derivation_name)
-    if isinstance(derivation, type) and issubclass(
-        derivation, ext_lib.DerivedMetadataClass):
-      derive = derivation(self.config.derived_metadata.parameters).derive
-    else:
-      derive = functools.partial(
-          derivation, parameters=self.config.derived_metadata.parameters)
+    derive, prepare = self._get_derivation()
+
+    def _derive(item: pathlib.Path) -> symfs_pb2.Metadata:
+      with self.metrics.phase('derive'):
+        metadata = derive(item)
+      self.metrics.increment('metadata_derived', phase='derive')
+      return metadata
 
     ItemMode = symfs_pb2.Config.DerivedMetadata.ItemMode
 
-    for source_path in self.config.source_paths:
-      yielded = False
-      for item in pathlib.Path(source_path).rglob('*'):
+    full_scan = scopes is None
+    source_paths = [pathlib.Path(path) for path in self.config.source_paths]
+    if full_scan:
+      scopes = self._get_source_scopes()
+
+    def get_entries(path: pathlib.Path,
+                    recursive: bool) -> Iterator[fs_lib.Entry]:
+      entries = self._walk(path) if recursive else ()
+      if path not in source_paths:
+        entry = self.filesystem.entry(path)
+        if entry is not None:
+          entries = itertools.chain((entry,), entries)
+      for entry in entries:
         if ((self.config.derived_metadata.item_mode
-             in (ItemMode.ALL, ItemMode.FILES) and item.is_file()) or
+             in (ItemMode.ALL, ItemMode.FILES) and entry.is_file()) or
             (self.config.derived_metadata.item_mode
-             in (ItemMode.ALL, ItemMode.DIRECTORIES) and item.is_dir())):
-          try:
-            yield item, derive(item)
-          except (AttributeError, ValueError) as error:
-            logging.error('Failed to derive Metadata: %s; skipping %s.', error,
-                          item)
-          else:
-            yielded = True
-      if not yielded:
-        logging.warning('No items found in %s.', source_path)
-
-  def scan_metadata(self) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
+             in (ItemMode.ALL, ItemMode.DIRECTORIES) and entry.is_dir())):
+          yield entry
+
+    entries_by_scope = ((path, get_entries(path, recursive))
+                        for path, recursive in scopes)
+    if full_scan and prepare is not None:
+      # Only then are the items listed before any is derived, so that the
+      # derivation can prepare for all of them.
+      entries_by_scope = [
+          (path, list(entries)) for path, entries in entries_by_scope
+      ]
+      prepare([
+          entry.path for _, entries in entries_by_scope for entry in entries
+      ])
+
+    for path, entries in entries_by_scope:
+      yielded = False
+      for entry in entries:
+        item = entry.path
+        try:
+          metadata = self._cached(entry, functools.partial(_derive, item))
+        except (AttributeError, ValueError) as error:
+          logging.error('Failed to derive Metadata: %s; skipping %s.', error,
+                        item)
+          self.metrics.increment('derive_failures')
+        else:
+          yielded = True
+          yield item, metadata
+      if full_scan and not yielded:
+        logging.warning('No items found in %s.', path)
+
+  def _get_derivation(
+      self
+  ) -> Tuple[Callable[[pathlib.Path], symfs_pb2.Metadata],
+             Optional[Callable[[List[pathlib.Path]], None]]]:
+    """Returns the derive function of the config, and prepare if it has one.
+
+    Derivation classes are instantiated once, so that they keep their state
+    (e.g. what they prepared on the last full scan) across scans. prepare is
+    only returned if the class overrides it.
+    """
+    if self._derivation is None:
+      derivation = ext_lib.get_derived_metadata_derivation(
+          self.config.derived_metadata.derivation_name)
+      prepare = None
+      if isinstance(derivation, type) and issubclass(
+          derivation, ext_lib.DerivedMetadataClass):
+        derivation_object = derivation(self.config.derived_metadata.parameters)
+        derive = derivation_object.derive
+        if derivation.prepare is not ext_lib.DerivedMetadataClass.prepare:
+          prepare = derivation_object.prepare
+      else:
+        derive = functools.partial(
+            derivation, parameters=self.config.derived_metadata.parameters)
+      self._derivation = (derive, prepare)
+    return self._derivation
+
+  def _get_source_scopes(self) -> List[Scope]:
+    """Returns the scopes of a full scan of `Config.source_paths`.
+
+    With `Config.deduplication`, source paths nested in another are dropped,
+    as walking the other one scans them already.
+    """
+    source_paths = [pathlib.Path(path) for path in self.config.source_paths]
+    return [(path, True)
+            for path in source_paths
+            if not (self.config.deduplication and
+                    set(source_paths).intersection(path.parents))]
+
+  def scan_metadata(
+      self,
+      scopes: Optional[Iterable[Scope]] = None
+  ) -> Iterator[Tuple[pathlib.Path, symfs_pb2.Metadata]]:
     """Yields tuples of items and associated metadata based on Config.metadata.
 
     The item can be a directory or a file, depending on how Config.metadata is
     written.
 
+    Args:
+      scopes: If set, only scan these instead of `Config.source_paths`; see
+        `_get_scopes`.
+
     Yields:
       Tuples of items and associated metadata proto for that item.
     """
+    if self._metadata_cache is not None:
+      if scopes is None:
+        # Only keep the files seen in this scan.
+        self._previous_metadata_cache = self._metadata_cache
+        self._metadata_cache = {}
+        self._previous_merge_cache = self._merge_cache
+        self._merge_cache = {}
+      else:
+        self._previous_metadata_cache = self._metadata_cache
+        self._previous_merge_cache = self._merge_cache
+
+    if scopes is None:
+      self._scanned_inodes = {}
+      self._aliases = {}
+
     which_metadata = self.config.WhichOneof('metadata')
     if which_metadata == 'metadata_files':
-      yield from self._scan_metadata_files()
+      items = self._scan_metadata_files(scopes)
     elif which_metadata == 'derived_metadata':
-      yield from self._derive_items_metadata()
+      items = self._derive_items_metadata(scopes)
     else:
       raise ValueError('None of Config.metadata is set.')
 
-  def _compute_mapping(self) -> None:
-    """Computes the mappings from group to group keys to paths."""
+    if (self.config.deduplication !=
+        symfs_pb2.Config.Deduplication.SHORTEST_PATH):
+      yield from items
+      return
+    # A shorter path to an item may only be found after the item was yielded,
+    # so the paths are only final once the whole scan is done.
+    items = list(items)
+    aliases = list(self._aliases.items())
+    for item, metadata in items:
+      yield mapping_lib.remap_path(item, aliases), metadata
+
+  def _get_scopes(self, changed_paths: Iterable[pathlib.Path]) -> List[Scope]:
+    """Returns the scopes to scan for the items affected by changed_paths.
+
+    Everything under a changed path may have changed. Further, a metadata file
+    changing affects its directory (and everything under it, if metadata is
+    inherited), and, when deriving metadata of directories, any path changing
+    affects the directories it is in. Paths outside of `Config.source_paths`
+    are ignored.
+    """
+    source_paths = [pathlib.Path(path) for path in self.config.source_paths]
+    ItemMode = symfs_pb2.Config.DerivedMetadata.ItemMode
+    which_metadata = self.config.WhichOneof('metadata')
+    derives_directories = (
+        which_metadata == 'derived_metadata' and
+        self.config.derived_metadata.item_mode
+        in (ItemMode.ALL, ItemMode.DIRECTORIES))
+
+    scopes = set()
+    for path in changed_paths:
+      source_path = next((source_path for source_path in source_paths
+                          if source_path == path or
+                          source_path in path.parents), None)
+      if source_path is None:
+        continue
+      scopes.add((path, True))
+      if (which_metadata == 'metadata_files' and
+          self._is_metadata_file_name(path.name)):
+        scopes.add((path.parent, self.config.metadata_files.inherit))
+      if derives_directories:
+        for parent in path.parents:
+          if parent == source_path:
+            break
+          scopes.add((parent, False))
+
+    # Drop scopes already covered by another.
+    recursive_paths = {path for path, recursive in scopes if recursive}
+    return sorted(
+        (path, recursive)
+        for path, recursive in scopes
+        if not (recursive_paths.intersection(path.parents) or
+                (not recursive and path in recursive_paths)))
+
+  @staticmethod
+  def _in_scopes(items: Iterable[pathlib.Path],
+                 scopes: Iterable[Scope]) -> List[pathlib.Path]:
+    """Returns the items that scanning scopes would yield if they exist."""
+    paths = {str(path) for path, _ in scopes}
+    prefixes = tuple(f'{path}{os.sep}' for path, recursive in scopes
+                     if recursive)
+    return [
+        item for item in items
+        if str(item) in paths or str(item).startswith(prefixes)
+    ]
+
+  def _compute_mapping(self, items: Optional[ItemsMetadata] = None) -> None:
+    """Computes the mappings from group to group keys to paths.
+
+    With `Config.columnar`, group_bys of scalar fields are grouped with
+    vectorized operations once all items are scanned; see `columnar_lib`.
+
+    Args:
+      items: The items and associated metadata to compute the mappings from.
+        If not provided, `scan_metadata` is used.
+    """
     self.paths_by_keys_by_group = {}
-
+    self._interned_keys = {}
+    tables = (collections.defaultdict(columnar_lib.Table)
+              if self.config.columnar else None)
+
+    if items is None:
+      items = self.scan_metadata()
+    for path, metadata in items:
+      with self.metrics.phase('group'):
+        self._add_to_mapping(path, metadata, tables)
+      self.metrics.increment('items_grouped', phase='group')
+
+    for index, table in (tables or {}).items():
+      with self.metrics.phase('group'):
+        self._add_table_to_mapping(self.config.group_by[index].name, table)
+      self.metrics.increment(
+          'items_grouped_columnar', len(table), phase='group')
+
+    self.paths_by_keys_by_group.update(
+        self._compute_combinations(self.paths_by_keys_by_group))
+
+  def _add_to_mapping(
+      self,
+      path: pathlib.Path,
+      metadata: symfs_pb2.Metadata,
+      tables: Optional[Dict[int, columnar_lib.Table]] = None) -> None:
+    """Adds path to each group key generated from metadata.
+
+    Args:
+      path: The path of the item.
+      metadata: The metadata of the item.
+      tables: If set, the rows of path are added to the table of each group_by
+        of scalar fields instead, by index.
+    """
+    for group_by in self.config.group_by:
+      if group_by.name not in self.paths_by_keys_by_group:
+        self.paths_by_keys_by_group[group_by.name] = {}
+
+    keys, rows = self._get_keys(path, metadata, columnar=tables is not None)
+    for index, values in rows:
+      tables[index].append(path, values)
+    for group_name, group_key in keys:
+      try:
+        self.paths_by_keys_by_group[group_name][group_key].add(path)
+      except KeyError:
+        self.paths_by_keys_by_group[group_name][group_key] = {path}
+        self.metrics.increment('keys')
+
+  def _compute_combinations(
+      self, mapping: GroupToKeyToPathMapping
+  ) -> Dict[str, Dict[str, Set[pathlib.Path]]]:
+    """Returns the groups of `Config.combinations`, computed from mapping.
+
+    The items of the operands are combined with set operations directly;
+    intersections start from the smallest operand.
+    """
+    combinations: Dict[str, Dict[str, Set[pathlib.Path]]] = {}
+    for combination in self.config.combinations:
+      with self.metrics.phase('combine'):
+        operands = [
+            mapping.get(operand.group, {}).get(operand.key, set())
+            for operand in combination.operands
+        ]
+        if combination.operation == symfs_pb2.Config.Combination.UNION:
+          items = set().union(*operands)
+        elif operands:
+          operands.sort(key=len)
+          items = set(operands[0]).intersection(*operands[1:])
+        else:
+          items = set()
+
+        group = combinations.setdefault(combination.group, {})
+        if items:
+          group.setdefault(combination.key, set()).update(items)
+      self.metrics.increment('combinations', phase='combine')
+    return combinations
+
+  def _add_table_to_mapping(self, group_name: str,
+                            table: columnar_lib.Table) -> None:
+    """Adds the paths of each group key of table to group_name."""
+    group = self.paths_by_keys_by_group[group_name]
+    for group_key, paths in table.group():
+      if group_key in group:
+        group[group_key].update(paths)
+      else:
+        group[group_key] = set(paths)
+        self.metrics.increment('keys')
+
+  def _generate_keys(self, path: pathlib.Path,
+                     metadata: symfs_pb2.Metadata) -> Iterator[GroupKey]:
+    """Yields the group name and group key of each group path belongs to."""
+    keys, _ = self._get_keys(path, metadata)
+    yield from keys
+
+  def _get_keys(self,
+                path: pathlib.Path,
+                metadata: symfs_pb2.Metadata,
+                columnar: bool = False) -> Tuple[Tuple[GroupKey, ...],
+                                                 Tuple[Row, ...]]:
+    """Returns the group keys of path, and its rows if columnar.
+
+    Many items may have byte-for-byte identical metadata (e.g. when derived),
+    so the keys are interned by the serialized data: each distinct data is
+    only unpacked and grouped once per scan (or, with `refresh`, while any
+    item has it).
+
+    Args:
+      path: The path of the item.
+      metadata: The metadata of the item.
+      columnar: If set, the group_bys of scalar fields are returned as rows
+        (see `columnar_lib`) instead of keys.
+
+    Returns:
+      The group name and group key of each group path belongs to, and the
+      index of each group_by of scalar fields with the values of the fields.
+    """
+    data = _get_intern_key(metadata, columnar)
+    interned = self._interned_keys.get(data)
+    if interned is None:
+      interned = self._interned_keys[data] = self._compute_keys(
+          metadata, columnar)
+    else:
+      self.metrics.increment('metadata_interned', phase='group')
+
+    keys, errors, rows = interned
+    for error in errors:
+      logging.error('%s; skipping %s.', error, path)
+    return keys, rows
+
+  def _get_extractors(self,
+                      type_name: str) -> Dict[int, columnar_lib.Extractor]:
+    """Returns the extractor of each group_by of scalar fields of type_name."""
+    if type_name not in self._extractors:
+      descriptor = ext_lib.get_prototype(type_name).DESCRIPTOR
+      self._extractors[type_name] = {
+          index: columnar_lib.make_extractor(group_by.field)
+          for index, group_by in enumerate(self.config.group_by)
+          if all(
+              columnar_lib.is_scalar(descriptor, field)
+              for field in group_by.field)
+      }
+    return self._extractors[type_name]
+
+  def _compute_keys(self,
+                    metadata: symfs_pb2.Metadata,
+                    columnar: bool = False) -> InternedKeys:
+    """Returns the group keys of metadata; see `_get_keys`."""
+    type_name = metadata.data.TypeName()
+    message = ext_lib.get_prototype(type_name)()
+    metadata.data.Unpack(message)
+    extractors = self._get_extractors(type_name) if columnar else {}
+
+    keys = []
+    errors = []
+    rows = [(index, extract(message)) for index, extract in extractors.items()]
+    for index, group_by in enumerate(self.config.group_by):
+      if index in extractors:
+        continue
+
+      # Manually iterate generator to allow for better exception handling.
+      group_keys = generate_groups(message, group_by.field,
+                                   group_by.max_repeated_group)
+      while True:
+        try:
+          group_key = next(group_keys)
+        except StopIteration:
+          break
+        except AttributeError as error:
+          errors.append(f'{error}: no such field in message type {type_name}')
+          continue
+        except TypeError as error:
+          errors.append(f'{error}: the sub-field in {type_name} is not scalar')
+          continue
+
+        keys.append((group_by.name, group_key))
+    return tuple(keys), tuple(errors), tuple(rows)
+
+  def _count_values(
+      self, path: pathlib.Path,
+      metadata: symfs_pb2.Metadata) -> Iterator[Tuple[str, List[int]]]:
+    """Yields the group name and number of values of each field of groups."""
+    message = ext_lib.get_prototype(metadata.data.TypeName())()
+    metadata.data.Unpack(message)
+    for group_by in self.config.group_by:
+      try:
+        value_counts = [
+            len(extract_field_as_iterable(message, field))
+            for field in group_by.field
+        ]
+      except AttributeError as error:
+        logging.error('%s: no such field in message type %s; skipping %s.',
+                      error, metadata.data.TypeName(), path)
+        continue
+      yield group_by.name, value_counts
+
+  def get_stats(self,
+                preflight: bool = False,
+                top_n: int = 10) -> Dict[str, Any]:
+    """Returns statistics of the groups; see `stats_lib.compute`.
+
+    Args:
+      preflight: If set, only count the values of each item instead of
+        computing the mapping, and project the keys and links from them.
+      top_n: The number of heaviest keys and items to report.
+    """
+    value_counts = {group_by.name: {} for group_by in self.config.group_by}
+    items = []
     for path, metadata in self.scan_metadata():
-      for group_by in self.config.group_by:
-        if group_by.name not in self.paths_by_keys_by_group:
-          self.paths_by_keys_by_group[group_by.name] = {}
-
-        message = ext_lib.get_prototype(metadata.data.TypeName())()
-        metadata.data.Unpack(message)
-
-        # Manually iterate generator to allow for better exception handling.
-        group_keys = generate_groups(message, group_by.field,
-                                     group_by.max_repeated_group)
-        while True:
-          try:
-            group_key = next(group_keys)
-          except StopIteration:
-            break
-          except AttributeError as error:
-            logging.error('%s: no such field in message type %s; skipping %s.',
-                          error, metadata.data.TypeName(), path)
-            continue
-          except TypeError as error:
-            logging.error('%s: the sub-field in %s is not scalar; skipping %s.',
-                          error, metadata.data.TypeName(), path)
-            continue
-
-          try:
-            self.paths_by_keys_by_group[group_by.name][group_key].add(path)
-          except KeyError:
-            self.paths_by_keys_by_group[group_by.name][group_key] = {path}
+      with self.metrics.phase('stats'):
+        for group_name, counts in self._count_values(path, metadata):
+          value_counts[group_name][path] = counts
+      if not preflight:
+        items.append((path, metadata))
+
+    mapping = None
+    if not preflight:
+      self._compute_mapping(items)
+      mapping = self.paths_by_keys_by_group
+    with self.metrics.phase('stats'):
+      return stats_lib.compute(self.config.group_by, value_counts, mapping,
+                               top_n)
 
   def get_mapping(self) -> GroupToKeyToPathMapping:
     """Returns the mappings from group to group keys to paths."""
@@ -316,63 +1223,1132 @@ class SymFs:
 
     return self.paths_by_keys_by_group
 
-  def generate(self, dry_run: bool = False):
-    """Generates the SymFs."""
+  def generate(
+      self,
+      dry_run: bool = False,
+      mapping: Optional[GroupToKeyToPathMapping] = None,
+      checkpointer: Optional[checkpoint_lib.Checkpointer] = None,
+      deadline: Optional[float] = None) -> List[str]:
+    """Generates the SymFs.
+
+    Groups are generated in order of `Config.GroupBy.priority`, and each group
+    is generated as a whole: if deadline is set, a group is only started if it
+    is expected to finish in time (as per the time per link so far), and if
+    the deadline passes while generating a group, the links created for it
+    are removed again. The remaining groups are deferred.
+
+    With `Config.clear`, everything in `Config.path` but the directories of
+    the groups in mapping is removed first, and the directory of each group
+    just before the group is generated, so that deferred groups keep the links
+    of the previous run. Groups with keys completed by checkpointer are not
+    cleared, as the run that completed them already did.
+
+    Args:
+      dry_run: If set, only log.
+      mapping: If set, generate this mapping instead of the one computed from
+        `Config.source_paths` (e.g. one merged from shards).
+      checkpointer: If set, skip the group keys it completed, and record the
+        group keys completed by this run (unless dry_run).
+      deadline: If set, the time (as per time.monotonic) to stop by.
+
+    Returns:
+      The names of the groups that were deferred because of the deadline.
+    """
+    if mapping is None:
+      mapping = self.get_mapping()
+    with self.metrics.phase('link'):
+      deferred = self._generate(mapping, dry_run, checkpointer, deadline)
+    if deferred:
+      logging.warning('Deadline reached; deferred %d groups to the next run: '
+                      '%s.', len(deferred), ', '.join(deferred))
+      self.metrics.increment('groups_deferred', len(deferred))
+    return deferred
+
+  def _generate(self,
+                mapping: GroupToKeyToPathMapping,
+                dry_run: bool,
+                checkpointer: Optional[checkpoint_lib.Checkpointer] = None,
+                deadline: Optional[float] = None) -> List[str]:
+    """Creates the directories and symlinks for mapping; see `generate`.
+
+    Creating each symlink takes a single syscall when not in dry_run; whether
+    the link already exists is determined from the result of the syscall.
+    """
     output_path = pathlib.Path(self.config.path)
-    if not output_path.exists():
+    if not self.filesystem.exists(output_path):
       if not dry_run:
-        output_path.mkdir(parents=True)
+        self.filesystem.mkdir(output_path, parents=True)
       logging.info('Created path %s.', output_path)
-    for group_name, group in self.get_mapping().items():
+
+    # Ties are broken by the order of the group_by in the config, so that the
+    # order does not depend on how mapping was built (e.g. merged from shards).
+    # Combinations have no priority, and come after the group_by.
+    order = {
+        group_by.name: (-group_by.priority, index)
+        for index, group_by in enumerate(self.config.group_by)
+    }
+    for index, combination in enumerate(self.config.combinations):
+      order.setdefault(combination.group,
+                       (0, len(self.config.group_by) + index))
+    last = (0, len(self.config.group_by) + len(self.config.combinations))
+    group_names = sorted(mapping, key=lambda name: order.get(name, last))
+    clear = self._clear_pending
+    if clear:
+      self._clear_pending = False
+      with self.metrics.phase('clear'):
+        clear_symlinks(output_path, self.filesystem, keep=group_names)
+    start = time.monotonic()
+    links = 0
+    for index, group_name in enumerate(group_names):
+      group = mapping[group_name]
+      if deadline is not None and links:
+        group_links = sum(
+            len(group_items)
+            for group_key, group_items in group.items()
+            if not (checkpointer and
+                    checkpointer.is_completed(group_name, group_key)))
+        seconds_per_link = (time.monotonic() - start) / links
+        if time.monotonic() + group_links * seconds_per_link > deadline:
+          return group_names[index:]
+      if clear and not (checkpointer and any(
+          checkpointer.is_completed(group_name, group_key)
+          for group_key in group)):
+        with self.metrics.phase('clear'):
+          clear_symlinks(output_path / group_name, self.filesystem)
+      group_links = self._generate_group(output_path / group_name, group,
+                                         dry_run, checkpointer, deadline)
+      if group_links is None:
+        return group_names[index:]
+      links += group_links
+    return []
+
+  def _generate_group(self, group_path: pathlib.Path,
+                      group: Mapping[str, Set[pathlib.Path]], dry_run: bool,
+                      checkpointer: Optional[checkpoint_lib.Checkpointer],
+                      deadline: Optional[float]) -> Optional[int]:
+    """Creates the directories and symlinks of a single group.
+
+    Returns:
+      The number of links created or skipped; or None if the deadline passed,
+      in which case the group was left as it was.
+    """
+    group_name = group_path.name
+    # What was created, to remove it again if the deadline passes.
+    created_directories: List[pathlib.Path] = []
+    created_links: List[Tuple[pathlib.Path, pathlib.Path]] = []
+    completed_keys: List[str] = []
+
+    def mkdir(path: pathlib.Path) -> None:
+      if dry_run:
+        return
+      if deadline is not None and not self.filesystem.lexists(path):
+        created_directories.append(path)
+      # We need parents because group_key may be nested.
+      self.filesystem.mkdir(path, exist_ok=True, parents=True)
+
+    mkdir(group_path)
+    links = 0
+    for group_key, group_items in group.items():
+      if checkpointer and checkpointer.is_completed(group_name, group_key):
+        self.metrics.increment('keys_resumed', phase='link')
+        continue
+      mkdir(group_path / group_key)
+      for item in group_items:
+        if deadline is not None and time.monotonic() > deadline:
+          self._remove_group(group_path, created_directories, created_links,
+                             dry_run)
+          for completed_key in completed_keys:
+            checkpointer.discard(group_name, completed_key)
+          return None
+        item_path = group_path / group_key / item.name
+        if self._link(item_path, item, dry_run) and deadline is not None:
+          created_links.append((item_path, item))
+        links += 1
+      if checkpointer and not dry_run:
+        checkpointer.complete(group_name, group_key)
+        completed_keys.append(group_key)
+    return links
+
+  def _remove_group(self, group_path: pathlib.Path,
+                    created_directories: List[pathlib.Path],
+                    created_links: List[Tuple[pathlib.Path, pathlib.Path]],
+                    dry_run: bool) -> None:
+    """Removes what was created for a group that could not be finished."""
+    logging.warning('Deadline reached; removing the %d links created for %s.',
+                    len(created_links), group_path)
+    for item_path, item in reversed(created_links):
+      self._unlink(item_path, item, dry_run)
+    for directory in reversed(created_directories):
+      # Nested group keys may have created empty parents as well.
+      while True:
+        try:
+          self.filesystem.rmdir(directory)
+        except OSError:
+          break
+        if directory.parent in (group_path, group_path.parent):
+          break
+        directory = directory.parent
+
+  def _link(self, item_path: pathlib.Path, item: pathlib.Path,
+            dry_run: bool) -> bool:
+    """Creates a symlink at item_path to item; returns whether created."""
+    if dry_run:
+      exists = self.filesystem.lexists(item_path)
+    else:
+      try:
+        self.filesystem.symlink(item_path, item)
+        exists = False
+      except FileExistsError:
+        exists = True
+
+    if exists:
+      try:
+        existing = self.filesystem.readlink(item_path)
+      except OSError:
+        existing = item_path
+      logging.warning('%s -> %s already exists; skipping %s.', item_path,
+                      existing, item)
+      self.metrics.increment('links_skipped', phase='link')
+      return False
+
+    logging.info('%s -> %s', item_path, item)
+    if not dry_run:
+      self.metrics.increment('links_created', phase='link')
+    return True
+
+  def _unlink(self, item_path: pathlib.Path, item: pathlib.Path,
+              dry_run: bool) -> bool:
+    """Removes the symlink at item_path if it points to item.
+
+    Directories left empty are also removed, up to (excluding) the group
+    directory.
+
+    Returns:
+      Whether the symlink was removed.
+    """
+    try:
+      if self.filesystem.readlink(item_path) != item:
+        # The link belongs to another item with the same name.
+        return False
+    except OSError:
+      return False
+
+    logging.info('Removing %s -> %s', item_path, item)
+    if dry_run:
+      return True
+
+    self.filesystem.unlink(item_path)
+    self.metrics.increment('links_removed', phase='link')
+    group_path = pathlib.Path(self.config.path) / item_path.relative_to(
+        self.config.path).parts[0]
+    directory = item_path.parent
+    while directory != group_path:
+      try:
+        self.filesystem.rmdir(directory)
+      except OSError:
+        break
+      directory = directory.parent
+    return True
+
+  def refresh(
+      self,
+      dry_run: bool = False,
+      changed_paths: Optional[Iterable[pathlib.Path]] = None
+  ) -> Tuple[int, int]:
+    """Rescans the source paths and reconciles the links with the mapping.
+
+    Unlike `generate`, links of items that were removed, or that no longer
+    belong in a group key, are removed. The mapping and the group keys of each
+    item are kept between calls, so only items whose metadata changed are
+    grouped again and only their links are touched. To also avoid parsing
+    unchanged metadata files again, set `cache_metadata`.
+
+    If changed_paths is given, only the items they affect are scanned again;
+    see `_get_scopes`.
+
+    Links that existed before the first call are not tracked; set
+    `Config.clear` for the first call to remove them.
+
+    Args:
+      dry_run: If set, only log the changes.
+      changed_paths: If set, the only paths that changed since the last call.
+
+    Returns:
+      The number of links added and removed.
+    """
+    if self._clear_pending:
+      self._clear_pending = False
+      with self.metrics.phase('clear'):
+        clear_symlinks(pathlib.Path(self.config.path), self.filesystem)
+    if self._refreshed_items is None:
+      self._refreshed_items = {}
+      self.paths_by_keys_by_group = {}
+      self._interned_keys = {}
+      self._intern_references = {}
+    mapping = self.paths_by_keys_by_group
+    for group_by in self.config.group_by:
+      mapping.setdefault(group_by.name, {})
+    for combination in self.config.combinations:
+      mapping.setdefault(combination.group, {})
+
+    previous_items = self._refreshed_items
+    if changed_paths is None:
+      scopes = None
+      previous_in_scope = list(previous_items)
+    else:
+      scopes = self._get_scopes(changed_paths)
+      previous_in_scope = self._in_scopes(previous_items, scopes)
+
+    items: Dict[pathlib.Path, List[Tuple[symfs_pb2.Metadata,
+                                         FrozenSet[GroupKey]]]] = {}
+    references = self._intern_references
+    for item, metadata in self.scan_metadata(scopes):
+      for previous_metadata, keys in previous_items.get(item, ()):
+        if previous_metadata is metadata:
+          break
+      else:
+        with self.metrics.phase('group'):
+          keys = frozenset(self._generate_keys(item, metadata))
+        self.metrics.increment('items_grouped', phase='group')
+        data = _get_intern_key(metadata)
+        references[data] = references.get(data, 0) + 1
+      items.setdefault(item, []).append((metadata, keys))
+
+    def all_keys(entries):
+      return frozenset().union(*(keys for _, keys in entries))
+
+    removed: List[Tuple[GroupKey, pathlib.Path]] = []
+    added: List[Tuple[GroupKey, pathlib.Path]] = []
+    for item in items.keys() | set(previous_in_scope):
+      previous_keys = previous_items.get(item, ())
+      keys = items.get(item, ())
+      if previous_keys == keys:
+        continue
+      previous_keys = all_keys(previous_keys)
+      keys = all_keys(keys)
+      removed.extend((key, item) for key in previous_keys - keys)
+      added.extend((key, item) for key in keys - previous_keys)
+    for item in previous_in_scope:
+      kept = {id(metadata) for metadata, _ in items.get(item, ())}
+      for metadata, _ in previous_items.pop(item):
+        if id(metadata) in kept:
+          continue
+        data = _get_intern_key(metadata)
+        references[data] -= 1
+        if not references[data]:
+          # No item has this data anymore; keeping its keys would leak them.
+          del references[data]
+          self._interned_keys.pop(data, None)
+    previous_items.update(items)
+
+    self._apply(mapping, removed, added, dry_run)
+    if self.config.combinations:
+      # Combinations depend on the updated groups, so are applied after them.
+      combination_removed = []
+      combination_added = []
+      for group_name, group in self._compute_combinations(mapping).items():
+        previous_group = mapping[group_name]
+        for group_key in previous_group.keys() | group.keys():
+          previous_paths = previous_group.get(group_key, set())
+          paths = group.get(group_key, set())
+          combination_removed.extend(
+              ((group_name, group_key), item)
+              for item in previous_paths - paths)
+          combination_added.extend(
+              ((group_name, group_key), item)
+              for item in paths - previous_paths)
+      self._apply(mapping, combination_removed, combination_added, dry_run)
+      removed.extend(combination_removed)
+      added.extend(combination_added)
+    return len(added), len(removed)
+
+  def reconcile(self,
+                applied: GroupToKeyToPathMapping,
+                dry_run: bool = False,
+                mapping: Optional[GroupToKeyToPathMapping] = None
+               ) -> Tuple[int, int]:
+    """Updates the links of a SymFs generated from applied to mapping.
+
+    Only the links of items that were added to or removed from a group key
+    since are touched; the SymFs itself is not walked, so links changed by
+    anything else are not noticed (see `verify`).
+
+    Args:
+      applied: The mapping the SymFs was last generated from; e.g. as recorded
+        in a `journal_lib.Journal`.
+      dry_run: If set, only log the changes.
+      mapping: If set, update to this mapping instead of the one computed from
+        `Config.source_paths`.
+
+    Returns:
+      The number of links added and removed.
+    """
+    if mapping is None:
+      mapping = self.get_mapping()
+    removed: List[Tuple[GroupKey, pathlib.Path]] = []
+    added: List[Tuple[GroupKey, pathlib.Path]] = []
+    for group_name in applied.keys() | mapping.keys():
+      applied_group = applied.get(group_name, {})
+      group = mapping.get(group_name, {})
+      for group_key in applied_group.keys() | group.keys():
+        applied_items = applied_group.get(group_key, set())
+        items = group.get(group_key, set())
+        removed.extend(((group_name, group_key), item)
+                       for item in applied_items - items)
+        added.extend(((group_name, group_key), item)
+                     for item in items - applied_items)
+
+    # Updated in place from the applied mapping to the new one.
+    current = mapping_lib.merge([applied])
+    for group_name in mapping:
+      current.setdefault(group_name, {})
+    self._apply(current, removed, added, dry_run)
+    return len(added), len(removed)
+
+  def _apply(self, mapping: Dict[str, Dict[str, Set[pathlib.Path]]],
+             removed: Iterable[Tuple[GroupKey, pathlib.Path]],
+             added: Iterable[Tuple[GroupKey, pathlib.Path]],
+             dry_run: bool) -> None:
+    """Removes and adds the links of items, updating mapping accordingly.
+
+    Args:
+      mapping: The mapping the links currently reflect; updated in place.
+      removed: The group keys and items to remove the links of.
+      added: The group keys and items to add links for.
+      dry_run: If set, only log the changes.
+    """
+    output_path = pathlib.Path(self.config.path)
+    with self.metrics.phase('link'):
+      freed = set()
+      for (group_name, group_key), item in removed:
+        paths = mapping[group_name][group_key]
+        paths.discard(item)
+        if not paths:
+          del mapping[group_name][group_key]
+        if self._unlink(output_path / group_name / group_key / item.name, item,
+                        dry_run):
+          freed.add((group_name, group_key, item.name))
+
       if not dry_run:
-        (output_path / group_name).mkdir(exist_ok=True)
-      for group_key, group_items in group.items():
+        self.filesystem.mkdir(output_path, parents=True, exist_ok=True)
+        for group_name in mapping:
+          self.filesystem.mkdir(output_path / group_name, exist_ok=True)
+      directories = set()
+      for (group_name, group_key), item in added:
+        if group_key not in mapping[group_name]:
+          mapping[group_name][group_key] = set()
+          self.metrics.increment('keys')
+        mapping[group_name][group_key].add(item)
+        directory = output_path / group_name / group_key
+        if not dry_run and directory not in directories:
+          self.filesystem.mkdir(directory, parents=True, exist_ok=True)
+          directories.add(directory)
+        self._link(directory / item.name, item, dry_run)
+
+      # Another item with the same name may now take a freed path.
+      for group_name, group_key, name in freed:
+        for item in mapping[group_name].get(group_key, ()):
+          if item.name == name:
+            if not dry_run:
+              self.filesystem.mkdir(
+                  output_path / group_name / group_key,
+                  parents=True,
+                  exist_ok=True)
+            if self._link(output_path / group_name / group_key / name, item,
+                          dry_run):
+              break
+
+  def collect_garbage(
+      self,
+      previous: GroupToKeyToPathMapping,
+      dry_run: bool = False,
+      mapping: Optional[GroupToKeyToPathMapping] = None,
+      jobs: Optional[int] = None,
+      batch_size: int = 256) -> List[Tuple[GroupKey, pathlib.Path]]:
+    """Removes the links of previous whose items were moved or deleted.
+
+    Only the links of items that are missing from mapping, or whose directory
+    changed (i.e. gained or lost items), are checked; the SymFs itself is not
+    walked. The checks are made in batches, in parallel. Directories left
+    empty are removed as well.
+
+    Args:
+      previous: The mapping of a previous run, whose links may still exist.
+      dry_run: If set, only log the removals.
+      mapping: If set, the mapping of this run instead of the one computed
+        from `Config.source_paths`.
+      jobs: The number of batches to check in parallel; defaults to the number
+        of CPUs.
+      batch_size: The number of links to check per batch.
+
+    Returns:
+      The group keys and items of previous that are missing from mapping, but
+      whose links were left as their items still exist (e.g. only their
+      metadata file was removed); the next run should check them again.
+    """
+    if mapping is None:
+      mapping = self.get_mapping()
+    items = {
+        item for group in mapping.values() for items in group.values()
+        for item in items
+    }
+    previous_items = {
+        item for group in previous.values() for items in group.values()
+        for item in items
+    }
+    changed_directories = {item.parent for item in items ^ previous_items}
+    candidates = [((group_name, group_key), item)
+                  for group_name, group in previous.items()
+                  for group_key, group_items in group.items()
+                  for item in group_items
+                  if item not in items or item.parent in changed_directories]
+
+    output_path = pathlib.Path(self.config.path)
+    # As in generate_batch.
+    import concurrent.futures  # pylint: disable=g-import-not-at-top
+
+    def check(candidate: Tuple[GroupKey, pathlib.Path]) -> Optional[bool]:
+      """Returns whether the link dangles, or None if it is not ours."""
+      (group_name, group_key), item = candidate
+      try:
+        if (self.filesystem.readlink(output_path / group_name / group_key /
+                                     item.name) != item):
+          # Belongs to another item with the same name.
+          return None
+      except OSError:
+        return None
+      return not self.filesystem.exists(item)
+
+    def check_batch(
+        batch: List[Tuple[GroupKey, pathlib.Path]]) -> List[Optional[bool]]:
+      return [check(candidate) for candidate in batch]
+
+    with self.metrics.phase('gc'):
+      with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = itertools.chain.from_iterable(
+            executor.map(check_batch, [
+                candidates[start:start + batch_size]
+                for start in range(0, len(candidates), batch_size)
+            ]))
+        dangling = []
+        left = []
+        for candidate, result in zip(candidates, results):
+          if result:
+            dangling.append(candidate)
+          elif result is not None and candidate[1] not in items:
+            left.append(candidate)
+      for (group_name, group_key), item in dangling:
+        self._unlink(output_path / group_name / group_key / item.name, item,
+                     dry_run)
+    self.metrics.increment('links_checked', len(candidates), phase='gc')
+    logging.info('Checked %d links; removed %d dangling ones.',
+                 len(candidates), len(dangling))
+    return left
+
+  def verify(self,
+             dry_run: bool = False,
+             mapping: Optional[GroupToKeyToPathMapping] = None
+            ) -> Tuple[int, int]:
+    """Walks the SymFs and repairs the links that differ from mapping.
+
+    Symlinks that do not belong to mapping (e.g. left by an interrupted run,
+    or changed by hand) are removed, and missing links are created. Other
+    files are left as they are.
+
+    Args:
+      dry_run: If set, only log the repairs.
+      mapping: If set, verify against this mapping instead of the one computed
+        from `Config.source_paths`.
+
+    Returns:
+      The number of links created and removed.
+    """
+    if mapping is None:
+      mapping = self.get_mapping()
+    output_path = pathlib.Path(self.config.path)
+    # The items each link may point to; more than one if their names collide.
+    targets: Dict[pathlib.Path, Set[pathlib.Path]] = {}
+    for group_name, group in mapping.items():
+      for group_key, items in group.items():
+        for item in items:
+          targets.setdefault(output_path / group_name / group_key / item.name,
+                             set()).add(item)
+
+    created = removed = 0
+    with self.metrics.phase('verify'):
+      present = set()
+      for entry in self.filesystem.walk(output_path):
+        if not entry.is_symlink():
+          continue
+        try:
+          target = self.filesystem.readlink(entry.path)
+        except OSError:
+          continue
+        if target in targets.get(entry.path, ()):
+          present.add(entry.path)
+          continue
+        logging.warning('Removing unexpected link %s -> %s.', entry.path,
+                        target)
         if not dry_run:
-          # We need parents because group_key may be nested.
-          (output_path / group_name / group_key).mkdir(
-              exist_ok=True, parents=True)
-        for item in group_items:
-          item_path = output_path / group_name / group_key / item.name
-          if item_path.exists():
-            logging.warning('%s -> %s already exists; skipping %s.', item_path,
-                            item_path.resolve(), item)
-            continue
-          logging.info('%s -> %s', item_path, item)
-          if not dry_run:
-            item_path.symlink_to(item, target_is_directory=item.is_dir())
+          self.filesystem.unlink(entry.path)
+        removed += 1
 
+      for item_path in sorted(targets.keys() - present):
+        if not dry_run:
+          self.filesystem.mkdir(item_path.parent, parents=True, exist_ok=True)
+        if self._link(item_path, min(targets[item_path]), dry_run):
+          created += 1
+    self.metrics.increment('links_repaired', created + removed, phase='verify')
+    return created, removed
+
+
+def _get_metadata_key(config: symfs_pb2.Config) -> bytes:
+  """Returns a key that is equal for configs that scan for metadata alike."""
+  which_metadata = config.WhichOneof('metadata')
+  key = symfs_pb2.Config(deduplication=config.deduplication)
+  getattr(key, which_metadata).CopyFrom(getattr(config, which_metadata))
+  return key.SerializeToString(deterministic=True)
+
+
+def _scan_shared(
+    symfs_objects: Iterable[SymFs]
+) -> Dict[Tuple[bytes, pathlib.Path], List[Tuple[pathlib.Path,
+                                                 symfs_pb2.Metadata]]]:
+  """Scans the source paths of all symfs_objects, each only once.
+
+  Source paths are shared by configs with the same `Config.metadata`. Source
+  paths nested in another are not walked again; their items are taken from the
+  scan of the outer one instead. With `Config.metadata_files.inherit`, the
+  metadata is scanned without inheriting it, which is then done for each
+  source path, so that items only inherit up to the source path they are
+  taken for, as when the config is generated on its own.
 
-def main(argv):
-  del argv
+  Args:
+    symfs_objects: The SymFs objects to scan the source paths of.
 
-  if not _CONFIG_FILE.value and not all(
-      (_PATH.value, _SOURCE_PATHS.value, _GROUP_BY.value)):
-    raise ValueError('Must provide a config file or flags to build config.')
+  Returns:
+    The items and metadata, by metadata key (see `_get_metadata_key`) and source
+    path.
+  """
+  symfs_objects = list(symfs_objects)
+  source_paths_by_key: Dict[bytes, Set[pathlib.Path]] = {}
+  for symfs in symfs_objects:
+    source_paths_by_key.setdefault(
+        _get_metadata_key(symfs.config),
+        set()).update(map(pathlib.Path, symfs.config.source_paths))
+
+  items = {}
+  for key, source_paths in source_paths_by_key.items():
+    symfs = next(
+        symfs for symfs in symfs_objects
+        if _get_metadata_key(symfs.config) == key)
+    # Scan all of the source paths as one config, so that each source path is
+    # excluded from the items as usual.
+    config = symfs_pb2.Config()
+    config.CopyFrom(symfs.config)
+    config.clear = False
+    config.source_paths[:] = sorted(map(str, source_paths))
+    inherit = (
+        config.HasField('metadata_files') and config.metadata_files.inherit)
+    if inherit:
+      config.metadata_files.inherit = False
+    scanner = SymFs(config, metrics=symfs.metrics, filesystem=symfs.filesystem)
+
+    for root in sorted(source_paths):
+      if source_paths.intersection(root.parents):
+        continue
+      scanned = list(scanner.scan_metadata([(root, True)]))
+      for source_path in source_paths:
+        if source_path == root:
+          items[key, source_path] = scanned
+        elif root in source_path.parents:
+          prefix = f'{source_path}{os.sep}'
+          items[key, source_path] = [
+              (item, metadata)
+              for item, metadata in scanned
+              if str(item).startswith(prefix) or
+              (item == source_path and config.HasField('metadata_files'))
+          ]
+        else:
+          continue
+        if inherit:
+          items[key, source_path] = scanner._inherit_items(
+              items[key, source_path])
+
+    for source_path in sorted(source_paths):
+      if not items[key, source_path]:
+        logging.warning(
+            'No metadata files found in %s.' if config.HasField(
+                'metadata_files') else 'No items found in %s.', source_path)
+  return items
+
+
+def generate_batch(configs: Iterable[symfs_pb2.Config],
+                   metrics: Optional[metrics_lib.Metrics] = None,
+                   filesystem: Optional[fs_lib.FileSystem] = None,
+                   dry_run: bool = False,
+                   jobs: Optional[int] = None,
+                   deadline: Optional[float] = None) -> List[SymFs]:
+  """Generates the SymFs of each config, scanning shared source paths once.
+
+  The source paths of configs that scan for metadata the same way (i.e. have
+  the same `Config.metadata`) are walked and their metadata parsed or derived
+  once; see `_scan_shared`. The mapping of each config is then computed from
+  the shared metadata, and each SymFs is generated in parallel.
+
+  Args:
+    configs: The configs to generate.
+    metrics: Where to record the metrics of all configs.
+    filesystem: The filesystem to use; defaults to the local filesystem.
+    dry_run: If set, only log during generate.
+    jobs: The number of SymFs to generate in parallel; defaults to the number
+      of CPUs.
+    deadline: If set, the time to stop by; see `SymFs.generate`.
+
+  Returns:
+    The SymFs of each config.
+  """
+  # Imported here, as it is slow to import and only needed for batches.
+  import concurrent.futures  # pylint: disable=g-import-not-at-top
+
+  metrics = metrics or metrics_lib.Metrics()
+  symfs_objects = [
+      SymFs(config, metrics=metrics, filesystem=filesystem)
+      for config in configs
+  ]
+  items = _scan_shared(symfs_objects)
+
+  def generate(symfs: SymFs) -> None:
+    key = _get_metadata_key(symfs.config)
+    # As on its own, source paths nested in another are not scanned again with
+    # `Config.deduplication`.
+    symfs._compute_mapping(
+        itertools.chain.from_iterable(
+            items[key, source_path]
+            for source_path, _ in symfs._get_source_scopes()))
+    symfs.generate(dry_run=dry_run, deadline=deadline)
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    for future in [
+        executor.submit(generate, symfs) for symfs in symfs_objects
+    ]:
+      future.result()
+  return symfs_objects
+
+
+def _log_mapping(mapping: GroupToKeyToPathMapping) -> None:
+  """Logs mapping, if debug logging is enabled."""
+  if logging.level_debug():
+    # Slow to import, and formatting is slow for large mappings.
+    import pprint  # pylint: disable=g-import-not-at-top
+    logging.debug('\n%s', pprint.pformat(mapping))
+
+
+def _write_shard(config: symfs_pb2.Config, metrics: metrics_lib.Metrics,
+                 filesystem: fs_lib.FileSystem) -> None:
+  """Writes the mapping of config to --shard_output."""
+  config.clear = False
+  symfs = SymFs(config, metrics=metrics, filesystem=filesystem)
+  mapping = mapping_lib.to_proto(symfs.get_mapping(), config.source_paths)
+  mapping_lib.write_mapping(pathlib.Path(_SHARD_OUTPUT.value), mapping)
+  logging.info('Wrote mapping of %d items to %s.', len(mapping.items),
+               _SHARD_OUTPUT.value)
+
+
+def _write_stats(config: symfs_pb2.Config, metrics: metrics_lib.Metrics,
+                 filesystem: fs_lib.FileSystem) -> None:
+  """Writes the statistics of the groups of config to --stats_file."""
+  config.clear = False
+  symfs = SymFs(config, metrics=metrics, filesystem=filesystem)
+  stats = symfs.get_stats(
+      preflight=_STATS_PREFLIGHT.value, top_n=_STATS_TOP.value)
+  stats_file = pathlib.Path(_STATS_FILE.value)
+  stats_file.parent.mkdir(parents=True, exist_ok=True)
+  stats_file.write_text(json.dumps(stats, indent=2) + '\n')
+  logging.info('Projected %d links; wrote statistics to %s.',
+               stats['projected_links'], stats_file)
+
+
+def _merge_shards(config: symfs_pb2.Config, metrics: metrics_lib.Metrics,
+                  filesystem: fs_lib.FileSystem, deadline: Optional[float],
+                  change_log: Optional[changes_lib.ChangeLog]) -> None:
+  """Generates the SymFs of config from the mappings in --merge."""
+  remaps = [mapping_lib.parse_remap(remap) for remap in _REMAP.value or ()]
+  symfs = SymFs(config, metrics=metrics, filesystem=filesystem)
+
+  mappings = []
+  for shard_file in _MERGE.value:
+    with metrics.phase('merge'):
+      mapping = mapping_lib.read_mapping(pathlib.Path(shard_file))
+      mappings.append(mapping_lib.from_proto(mapping, remaps))
+    metrics.increment('shards_merged', phase='merge')
+    metrics.increment('items_merged', len(mapping.items), phase='merge')
+  with metrics.phase('merge'):
+    mapping = mapping_lib.merge(mappings)
+
+  _log_mapping(mapping)
+  deferred = symfs.generate(
+      dry_run=_DRY_RUN.value, mapping=mapping, deadline=deadline)
+  _finish_generate(symfs, mapping, deferred, change_log)
+
+
+def _generate_with_checkpoints(
+    config: symfs_pb2.Config, metrics: metrics_lib.Metrics,
+    filesystem: fs_lib.FileSystem, deadline: Optional[float],
+    change_log: Optional[changes_lib.ChangeLog]) -> None:
+  """Generates the SymFs of config, checkpointing to --state_file."""
+  checkpointer = checkpoint_lib.Checkpointer(
+      pathlib.Path(_STATE_FILE.value),
+      filesystem,
+      interval=_CHECKPOINT_INTERVAL.value,
+      metrics=metrics)
+  # SymFs sets defaults in its config, so keep the config as given.
+  given_config = symfs_pb2.Config()
+  given_config.CopyFrom(config)
+
+  # A resumed run does not clear the groups the killed run completed keys of;
+  # see SymFs.generate.
+  mapping = checkpointer.resume(given_config) if _RESUME.value else None
+  symfs = SymFs(config, metrics=metrics, filesystem=filesystem)
+  if mapping is None:
+    mapping = symfs.get_mapping()
+    if not _DRY_RUN.value:
+      checkpointer.start(given_config, mapping)
+
+  _log_mapping(mapping)
+  deferred = symfs.generate(
+      dry_run=_DRY_RUN.value,
+      mapping=mapping,
+      checkpointer=checkpointer,
+      deadline=deadline)
+  _finish_generate(symfs, mapping, deferred, change_log)
+  if _DRY_RUN.value:
+    return
+  if deferred:
+    checkpointer.write()
+    logging.info('Run with --resume to generate the deferred groups.')
+  else:
+    checkpointer.finish()
+
+
+def _generate_with_journal(config: symfs_pb2.Config,
+                           metrics: metrics_lib.Metrics,
+                           filesystem: fs_lib.FileSystem,
+                           change_log: Optional[changes_lib.ChangeLog]) -> None:
+  """Generates the SymFs of config, reconciling it with --journal."""
+  journal = journal_lib.Journal(pathlib.Path(_JOURNAL.value))
+  applied = journal.read()
+  if applied is not None:
+    # Only the links that changed are removed.
+    config.clear = False
+  symfs = SymFs(config, metrics=metrics, filesystem=filesystem)
+  mapping = symfs.get_mapping()
+  _log_mapping(mapping)
+
+  if applied is None:
+    symfs.generate(dry_run=_DRY_RUN.value, mapping=mapping)
+  else:
+    added, removed = symfs.reconcile(
+        applied, dry_run=_DRY_RUN.value, mapping=mapping)
+    logging.info('Reconciled with %s: added %d and removed %d links.',
+                 journal.path, added, removed)
+  if not _DRY_RUN.value:
+    journal.write(mapping)
+  _finish_generate(
+      symfs, mapping, [], change_log, reconciled=applied is not None)
+
+
+def _finish_generate(symfs: SymFs,
+                     mapping: GroupToKeyToPathMapping,
+                     deferred: List[str],
+                     change_log: Optional[changes_lib.ChangeLog],
+                     reconciled: bool = False) -> None:
+  """Verifies, collects garbage, and logs changes as requested by the flags.
 
-  config = symfs_pb2.Config()
+  Args:
+    symfs: The SymFs that was generated.
+    mapping: The mapping it was generated from.
+    deferred: The groups that were deferred; see `SymFs.generate`.
+    change_log: If set, where to log the changes.
+    reconciled: Whether the SymFs was reconciled with a journal, and so had
+      the links of items missing from mapping removed.
+  """
+  verify = _VERIFY.value and not deferred
+  if verify:
+    symfs.verify(dry_run=_DRY_RUN.value, mapping=mapping)
+  if _GC_JOURNAL.value:
+    # Links that could not be collected yet are still there.
+    mapping = _collect_garbage(symfs, mapping)
+  if change_log:
+    # Otherwise, links are only ever added.
+    removes = (
+        reconciled or verify or symfs.config.clear or bool(_GC_JOURNAL.value))
+    change_log.append(mapping, unchanged_groups=deferred, removes=removes)
+
+
+def _collect_garbage(
+    symfs: SymFs,
+    mapping: GroupToKeyToPathMapping) -> GroupToKeyToPathMapping:
+  """Removes the links left dangling since the last run; see --gc_journal.
 
-  if _CONFIG_FILE.value:
-    with open(_CONFIG_FILE.value) as stream:
-      text_format.Parse(stream.read(), config)
+  Returns:
+    The links left, i.e. those of mapping and those not collected yet.
+  """
+  journal = journal_lib.Journal(pathlib.Path(_GC_JOURNAL.value))
+  previous = journal.read()
+  left = []
+  if previous is not None:
+    left = symfs.collect_garbage(
+        previous, dry_run=_DRY_RUN.value, mapping=mapping, jobs=_JOBS.value)
+  recorded = mapping_lib.merge([mapping])
+  for (group_name, group_key), item in left:
+    recorded.setdefault(group_name, {}).setdefault(group_key, set()).add(item)
+  if not _DRY_RUN.value:
+    journal.write(recorded)
+  return recorded
+
+
+def _profile(symfs: SymFs) -> None:
+  """Generates symfs while profiling each phase; see --profile."""
+  # Only needed with --profile.
+  import profile_lib  # pylint: disable=g-import-not-at-top
+
+  profiler = profile_lib.Profiler(
+      pathlib.Path(_PROFILE.value), memory=_PROFILE_MEMORY.value)
+
+  # Scanning is normally interleaved with computing the mapping; separate them
+  # so each can be profiled on its own.
+  with profiler.phase('scan'):
+    items = list(symfs.scan_metadata())
+  with profiler.phase('compute_mapping'):
+    symfs._compute_mapping(items)
+  del items
+  _log_mapping(symfs.get_mapping())
+  with profiler.phase('generate'):
+    symfs.generate(dry_run=_DRY_RUN.value)
+
+  profiler.write_summary()
+  logging.info('Wrote profiles to %s.', profiler.directory)
+
+
+def _load_configs() -> List[symfs_pb2.Config]:
+  """Returns the configs built from --config_file and the other flags."""
+  if _MERGE.value:
+    # The groups and items come from the merged mappings.
+    required_flags = (_PATH.value,)
+  else:
+    required_flags = (_PATH.value, _SOURCE_PATHS.value, _GROUP_BY.value)
+  if not _CONFIG_FILE.value and not all(required_flags):
+    raise ValueError('Must provide a config file or flags to build config.')
 
-  if _GROUP_BY.value:
-    if not _APPEND.value:
-      del config.group_by[:]
-    for group_by in _GROUP_BY.value:
-      name, field = group_by.split(':')
-      config.group_by.append(symfs_pb2.Config.GroupBy(name=name, field=[field]))
+  config_files = _CONFIG_FILE.value or [None]
+  if len(config_files) > 1 and _PATH.value:
+    raise ValueError('Cannot override the path of multiple config files.')
+
+  configs = []
+  for config_file in config_files:
+    config = symfs_pb2.Config()
+
+    if config_file:
+      with open(config_file) as stream:
+        text_format.Parse(stream.read(), config)
+
+    if _GROUP_BY.value:
+      if not _APPEND.value:
+        del config.group_by[:]
+      for group_by in _GROUP_BY.value:
+        name, field = group_by.split(':')
+        config.group_by.append(
+            symfs_pb2.Config.GroupBy(name=name, field=[field]))
+
+    if _PATH.value:
+      config.path = _PATH.value
+
+    if _SOURCE_PATHS.value:
+      if not _APPEND.value:
+        del config.source_paths[:]
+      config.source_paths.extend(_SOURCE_PATHS.value)
+
+    configs.append(config)
+  return configs
+
+
+def _write_metrics(metrics: metrics_lib.Metrics,
+                   configs: Iterable[symfs_pb2.Config]) -> None:
+  """Writes metrics as requested by --metrics_file and --prometheus_file."""
+  if _METRICS_FILE.value:
+    metrics.write_json(pathlib.Path(_METRICS_FILE.value))
+  if _PROMETHEUS_FILE.value:
+    paths = [config.path for config in configs]
+    metrics.write_prometheus(
+        pathlib.Path(_PROMETHEUS_FILE.value),
+        labels={'path': paths[0]} if len(paths) == 1 else {})
+
+
+def _make_watch(configs: Iterable[symfs_pb2.Config]) -> Any:
+  """Returns a daemon_lib.Watch of the source paths of each config."""
+  # Only needed with --watch.
+  import inotify_lib  # pylint: disable=g-import-not-at-top
+
+  return inotify_lib.TreesWatch({
+      config.path: [pathlib.Path(path) for path in config.source_paths]
+      for config in configs
+  })
+
+
+def _serve(configs: List[symfs_pb2.Config], metrics: metrics_lib.Metrics,
+           filesystem: fs_lib.FileSystem,
+           change_log: Optional[changes_lib.ChangeLog]) -> None:
+  """Refreshes the SymFs of each config until stopped; see --serve."""
+  if not any((_REFRESH_INTERVAL.value, _SOCKET.value, _WATCH.value)):
+    raise ValueError(
+        'Must provide --refresh_interval, --socket, or --watch to serve.')
+  if _PROFILE.value:
+    raise ValueError('Cannot profile while serving.')
+  if _STATE_FILE.value or _DEADLINE.value is not None:
+    raise ValueError('Cannot checkpoint or set a deadline while serving.')
+  if any((_JOURNAL.value, _GC_JOURNAL.value, _VERIFY.value)):
+    raise ValueError('Cannot journal, verify, or collect garbage while '
+                     'serving; refresh removes the links of removed items.')
+  if len({config.path for config in configs}) != len(configs):
+    raise ValueError('Each config must have a different path.')
+  if change_log and len(configs) > 1:
+    raise ValueError('Can only log the changes of a single config.')
+  # Only needed with --serve.
+  import daemon_lib  # pylint: disable=g-import-not-at-top
+
+  def make_refresh(symfs: SymFs) -> Callable[..., Mapping[str, int]]:
+
+    def refresh(
+        changed_paths: Optional[Set[pathlib.Path]] = None) -> Mapping[str, int]:
+      with metrics.phase('refresh'):
+        added, removed = symfs.refresh(
+            dry_run=_DRY_RUN.value, changed_paths=changed_paths)
+      if change_log and (added or removed):
+        change_log.append(symfs.paths_by_keys_by_group)
+      _write_metrics(metrics, configs)
+      return {'links_added': added, 'links_removed': removed}
+
+    return refresh
+
+  daemon = daemon_lib.Daemon(
+      {
+          config.path: make_refresh(
+              SymFs(
+                  config,
+                  metrics=metrics,
+                  filesystem=filesystem,
+                  cache_metadata=True))
+          for config in configs
+      },
+      interval=_REFRESH_INTERVAL.value or None,
+      socket_path=pathlib.Path(_SOCKET.value) if _SOCKET.value else None,
+      watch=_make_watch(configs) if _WATCH.value else None)
+  # Stop on SIGTERM (e.g. from systemd) as on SIGINT.
+  signal.signal(signal.SIGTERM, signal.default_int_handler)
+  try:
+    daemon.serve_forever()
+  except KeyboardInterrupt:
+    logging.info('Stopped serving.')
+
+
+def _make_filesystem() -> fs_lib.FileSystem:
+  """Returns the filesystem to use, throttled as requested by the flags."""
+  filesystem = fs_lib.LocalFileSystem()
+  limits = (_MAX_SCAN_ENTRIES_PER_SECOND.value, _MAX_READS_PER_SECOND.value,
+            _MAX_READ_BYTES_PER_SECOND.value, _MAX_LINKS_PER_SECOND.value)
+  if not any(limits):
+    return filesystem
+  return throttle_lib.ThrottledFileSystem(filesystem, *limits)
 
-  if _PATH.value:
-    config.path = _PATH.value
 
-  if _SOURCE_PATHS.value:
-    if not _APPEND.value:
-      del config.source_paths[:]
-    config.source_paths.extend(_SOURCE_PATHS.value)
+def main(argv):
+  del argv
 
-  symfs = SymFs(config)
-  logging.debug('\n%s', pprint.pformat(symfs.get_mapping()))
-  symfs.generate(dry_run=_DRY_RUN.value)
+  deadline = None
+  if _DEADLINE.value is not None:
+    deadline = time.monotonic() + _DEADLINE.value
+  configs = _load_configs()
+  metrics = metrics_lib.Metrics()
+  backend = ext_lib.get_protobuf_backend()
+  if backend == 'python':
+    logging.warning('Using the pure Python protobuf backend, which is much '
+                    'slower; install a protobuf wheel with upb for speed.')
+  else:
+    logging.info('Using the %s protobuf backend.', backend)
+
+  if _IO_PRIORITY.value:
+    # Before any threads are created, so that they inherit it.
+    try:
+      throttle_lib.set_io_priority(_IO_PRIORITY.value, _IO_PRIORITY_LEVEL.value)
+    except OSError as error:
+      logging.warning('Unable to set the I/O priority: %s; continuing.', error)
+  filesystem = _make_filesystem()
+  change_log = None
+  if _CHANGE_LOG.value and not _DRY_RUN.value:
+    change_log = changes_lib.ChangeLog(
+        pathlib.Path(_CHANGE_LOG.value), _CHANGE_LOG_FORMAT.value)
+
+  if _SERVE.value:
+    _serve(configs, metrics, filesystem, change_log)
+    return
+
+  if _PROFILE.value and len(configs) > 1:
+    raise ValueError('Can only profile a single config.')
+  if (_SHARD_OUTPUT.value or _MERGE.value) and len(configs) > 1:
+    raise ValueError('Can only shard or merge a single config.')
+  if _STATS_FILE.value and len(configs) > 1:
+    raise ValueError('Can only compute statistics of a single config.')
+  if _RESUME.value and not _STATE_FILE.value:
+    raise ValueError('Can only resume with --state_file.')
+  if _STATE_FILE.value and (len(configs) > 1 or _PROFILE.value or any(
+      (_SHARD_OUTPUT.value, _MERGE.value, _STATS_FILE.value))):
+    raise ValueError('Can only checkpoint generating a single config.')
+  if _SHARD_OUTPUT.value and _MERGE.value:
+    raise ValueError('Cannot both shard and merge.')
+  if _CHANGE_LOG.value and (len(configs) > 1 or _PROFILE.value or any(
+      (_SHARD_OUTPUT.value, _STATS_FILE.value))):
+    raise ValueError('Can only log the changes of generating a single config.')
+  if any((_JOURNAL.value, _VERIFY.value, _GC_JOURNAL.value)) and (
+      len(configs) > 1 or
+      any((_PROFILE.value, _SHARD_OUTPUT.value, _STATS_FILE.value))):
+    raise ValueError('Can only journal, verify, or collect garbage when '
+                     'generating a single config.')
+  if _JOURNAL.value and _MERGE.value:
+    raise ValueError('Cannot journal with --merge.')
+  if _JOURNAL.value and (_STATE_FILE.value or deadline is not None):
+    raise ValueError('Cannot journal with --state_file or --deadline.')
+
+  with metrics.phase('total'):
+    if _SHARD_OUTPUT.value:
+      _write_shard(configs[0], metrics, filesystem)
+    elif _MERGE.value:
+      _merge_shards(configs[0], metrics, filesystem, deadline, change_log)
+    elif _STATS_FILE.value:
+      _write_stats(configs[0], metrics, filesystem)
+    elif len(configs) > 1:
+      generate_batch(
+          configs,
+          metrics=metrics,
+          filesystem=filesystem,
+          dry_run=_DRY_RUN.value,
+          jobs=_JOBS.value,
+          deadline=deadline)
+    elif _JOURNAL.value:
+      _generate_with_journal(configs[0], metrics, filesystem, change_log)
+    elif _STATE_FILE.value:
+      _generate_with_checkpoints(configs[0], metrics, filesystem, deadline,
+                                 change_log)
+    else:
+      symfs = SymFs(configs[0], metrics=metrics, filesystem=filesystem)
+      if _PROFILE.value:
+        _profile(symfs)
+      else:
+        _log_mapping(symfs.get_mapping())
+        deferred = symfs.generate(dry_run=_DRY_RUN.value, deadline=deadline)
+        _finish_generate(symfs, symfs.get_mapping(), deferred, change_log)
+
+  _write_metrics(metrics, configs)
 
 
 if __name__ == '__main__':
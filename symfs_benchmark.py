@@ -0,0 +1,273 @@
+"""Benchmarks SymFs on synthetic corpora of increasing size.
+
+For each corpus size, a corpus is generated with `corpus_lib` and each
+benchmark below is run. The time (best of `--repetitions` runs) and the peak
+traced memory (from a separate run under tracemalloc, since tracing slows the
+run down) are reported, along with the time per item so that super-linear
+regressions are easy to spot across sizes.
+
+Usage:
+    bazel run :symfs_benchmark -- --sizes=1000,10000 [--output_json=<path>]
+
+Pass `--verbosity=-1` to leave the per-link INFO logging out of the timings.
+
+To compare protobuf backends (see `ext_lib.get_protobuf_backend`), pass e.g.
+`--protobuf_backends=upb,python`: as the backend is fixed when protobuf is
+first imported, the benchmarks are then run in a subprocess per backend.
+Combine with `--metadata_format=binary` to measure the binary fast path.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple
+
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import corpus_lib
+import ext_lib
+import symfs
+
+_CARDINALITY = flags.DEFINE_integer(
+    'cardinality', 100, 'Number of distinct values of each field.')
+
+_COLUMNAR = flags.DEFINE_bool(
+    'columnar', False, 'If set, group with Config.columnar, which requires '
+    'NumPy.')
+
+_DEPTH = flags.DEFINE_integer('depth', 2,
+                              'Directory levels above each item.')
+
+_DISTRIBUTION = flags.DEFINE_enum('distribution', 'uniform',
+                                  corpus_lib.DISTRIBUTIONS,
+                                  'Distribution of the field values.')
+
+_MAX_REPEATED_GROUP = flags.DEFINE_integer(
+    'max_repeated_group', 2, 'The max_repeated_group of each group_by.')
+
+_MAX_VALUES = flags.DEFINE_integer(
+    'max_values', 3, 'Maximum number of values in each repeated field.')
+
+_METADATA_FORMAT = flags.DEFINE_enum('metadata_format', 'text',
+                                     corpus_lib.METADATA_FORMATS,
+                                     'The format of the metadata files.')
+
+_METADATA_TYPE = flags.DEFINE_enum('metadata_type', 'Media',
+                                   corpus_lib.METADATA_TYPES,
+                                   'The metadata type of the corpus.')
+
+_OUTPUT_JSON = flags.DEFINE_string(
+    'output_json', None, 'If set, also write the results as JSON here.')
+
+_PROTOBUF_BACKENDS = flags.DEFINE_list(
+    'protobuf_backends', [],
+    'If set, run the benchmarks once per protobuf backend (e.g. upb, cpp, '
+    'python), each in a subprocess.')
+
+_REPETITIONS = flags.DEFINE_integer('repetitions', 3,
+                                    'Number of timed runs per benchmark.')
+
+_SIZES = flags.DEFINE_list('sizes', ['1000', '10000'],
+                           'The corpus sizes (number of items) to run.')
+
+# A benchmark is a setup function, which returns the arguments to pass to the
+# run function; only the run function is measured.
+Benchmark = Tuple[Callable[[], Tuple[Any, ...]], Callable[..., Any]]
+
+
+def _measure(benchmark: Benchmark, repetitions: int) -> Tuple[float, int]:
+  """Returns the best time in seconds and the peak memory in bytes."""
+  setup, run = benchmark
+
+  best = float('inf')
+  for _ in range(repetitions):
+    arguments = setup()
+    start = time.perf_counter()
+    run(*arguments)
+    best = min(best, time.perf_counter() - start)
+
+  arguments = setup()
+  tracemalloc.start()
+  try:
+    run(*arguments)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return best, peak
+
+
+def _make_benchmarks(
+    config_factory: Callable[[], Any]) -> Dict[str, Benchmark]:
+  """Returns the benchmarks for the corpus of config_factory."""
+  output_path = pathlib.Path(config_factory().path)
+
+  def make_symfs() -> symfs.SymFs:
+    return symfs.SymFs(config_factory())
+
+  def scanned() -> Tuple[symfs.SymFs, List[Any]]:
+    instance = make_symfs()
+    return instance, list(instance.scan_metadata())
+
+  def mapped() -> Tuple[symfs.SymFs]:
+    symfs.clear_symlinks(output_path)
+    instance = make_symfs()
+    instance.get_mapping()
+    return (instance,)
+
+  def generated() -> Tuple[pathlib.Path]:
+    symfs.clear_symlinks(output_path)
+    instance = make_symfs()
+    instance.generate()
+    return (output_path,)
+
+  def generate_groups(instance: symfs.SymFs, items: Iterable[Any]) -> None:
+    for _, metadata in items:
+      message = symfs.ext_lib.get_prototype(metadata.data.TypeName())()
+      metadata.data.Unpack(message)
+      for group_by in instance.config.group_by:
+        for _ in symfs.generate_groups(message, group_by.field,
+                                       group_by.max_repeated_group):
+          pass
+
+  def compute_mapping(instance: symfs.SymFs, items: Iterable[Any]) -> None:
+    instance._compute_mapping(items)
+
+  return {
+      'scan_metadata': (lambda: (make_symfs(),),
+                        lambda instance: list(instance.scan_metadata())),
+      'generate_groups': (scanned, generate_groups),
+      'compute_mapping': (scanned, compute_mapping),
+      'generate': (mapped, lambda instance: instance.generate()),
+      'clear_symlinks': (generated, symfs.clear_symlinks),
+  }
+
+
+def run_benchmarks(sizes: Iterable[int],
+                   repetitions: int = 3,
+                   max_repeated_group: int = 2,
+                   columnar: bool = False,
+                   **corpus_kwargs) -> List[Mapping[str, Any]]:
+  """Runs all benchmarks at each size.
+
+  Args:
+    sizes: The corpus sizes (number of items) to run the benchmarks at.
+    repetitions: The number of timed runs per benchmark.
+    max_repeated_group: The max_repeated_group of each group_by.
+    columnar: Whether to group with `Config.columnar`.
+    **corpus_kwargs: Passed to corpus_lib.generate_corpus.
+
+  Returns:
+    One result per size and benchmark.
+  """
+  metadata_type = corpus_kwargs.get('metadata_type', 'Media')
+  backend = ext_lib.get_protobuf_backend()
+
+  results = []
+  for size in sizes:
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory) / 'corpus'
+      corpus_lib.generate_corpus(root, size, **corpus_kwargs)
+
+      def config_factory():
+        config = corpus_lib.make_config(root,
+                                        pathlib.Path(directory) / 'views',
+                                        metadata_type, max_repeated_group)
+        config.columnar = columnar
+        return config
+
+      for name, benchmark in _make_benchmarks(config_factory).items():
+        seconds, peak_bytes = _measure(benchmark, repetitions)
+        logging.info('%s at %d items: %.3fs.', name, size, seconds)
+        results.append({
+            'size': size,
+            'benchmark': name,
+            'protobuf_backend': backend,
+            'seconds': seconds,
+            'microseconds_per_item': seconds / size * 1e6,
+            'peak_memory_bytes': peak_bytes,
+        })
+  return results
+
+
+def run_backends(backends: Iterable[str],
+                 args: Iterable[str]) -> List[Mapping[str, Any]]:
+  """Runs this benchmark with args in a subprocess per protobuf backend.
+
+  Args:
+    backends: The protobuf backends to run with; a backend that is not
+      installed is skipped with a warning.
+    args: The flags to run the benchmark with.
+
+  Returns:
+    The results of all backends.
+  """
+  results = []
+  for backend in backends:
+    with tempfile.TemporaryDirectory() as directory:
+      output_json = pathlib.Path(directory) / 'results.json'
+      # Later flags override earlier ones.
+      command = [
+          sys.executable, __file__, *args, '--protobuf_backends=',
+          f'--output_json={output_json}'
+      ]
+      environment = dict(
+          os.environ,
+          PYTHONPATH=os.pathsep.join(sys.path),
+          PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=backend)
+      try:
+        subprocess.run(
+            command, env=environment, check=True, stdout=subprocess.DEVNULL)
+      except subprocess.CalledProcessError as error:
+        logging.warning('Unable to benchmark the %s backend: %s; skipping.',
+                        backend, error)
+        continue
+      backend_results = json.loads(output_json.read_text())
+    if any(result['protobuf_backend'] != backend
+           for result in backend_results):
+      logging.warning('The %s backend is not installed; skipping.', backend)
+      continue
+    results.extend(backend_results)
+  return results
+
+
+def main(argv):
+  del argv
+
+  if _PROTOBUF_BACKENDS.value:
+    results = run_backends(_PROTOBUF_BACKENDS.value, sys.argv[1:])
+  else:
+    results = run_benchmarks(
+        map(int, _SIZES.value),
+        repetitions=_REPETITIONS.value,
+        depth=_DEPTH.value,
+        metadata_type=_METADATA_TYPE.value,
+        cardinality=_CARDINALITY.value,
+        max_values=_MAX_VALUES.value,
+        distribution=_DISTRIBUTION.value,
+        max_repeated_group=_MAX_REPEATED_GROUP.value,
+        columnar=_COLUMNAR.value,
+        metadata_format=_METADATA_FORMAT.value)
+
+  print(f'{"benchmark":<16} {"backend":>8} {"size":>9} {"seconds":>9} '
+        f'{"us/item":>9} {"peak MiB":>9}')
+  for result in results:
+    print(f'{result["benchmark"]:<16} {result["protobuf_backend"]:>8} '
+          f'{result["size"]:>9} '
+          f'{result["seconds"]:>9.3f} {result["microseconds_per_item"]:>9.1f} '
+          f'{result["peak_memory_bytes"] / 2**20:>9.1f}')
+
+  if _OUTPUT_JSON.value:
+    pathlib.Path(_OUTPUT_JSON.value).write_text(
+        json.dumps(results, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,36 @@
+from absl.testing import absltest
+
+import symfs_benchmark
+
+
+class SymFsBenchmarkTest(absltest.TestCase):
+  """Tests for symfs_benchmark."""
+
+  def test_run_benchmarks(self):
+    """Ensures every benchmark runs and reports at each size."""
+    results = symfs_benchmark.run_benchmarks([5, 10], repetitions=1, depth=1)
+
+    self.assertEqual([(result['size'], result['benchmark'])
+                      for result in results],
+                     [(size, benchmark)
+                      for size in (5, 10)
+                      for benchmark in ('scan_metadata', 'generate_groups',
+                                        'compute_mapping', 'generate',
+                                        'clear_symlinks')])
+    for result in results:
+      self.assertGreater(result['seconds'], 0)
+      self.assertGreaterEqual(result['peak_memory_bytes'], 0)
+
+  def test_run_backends(self):
+    """Ensures each backend is run, and uninstalled ones are skipped."""
+    results = symfs_benchmark.run_backends(
+        ['python', 'not_a_backend'],
+        ['--sizes=5', '--repetitions=1', '--depth=1', '--verbosity=-1'])
+
+    self.assertLen(results, 5)
+    self.assertEqual({result['protobuf_backend'] for result in results},
+                     {'python'})
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -1,22 +1,31 @@
 from pathlib import Path, PosixPath
 from unittest import mock
 
+import json
 import os
 import pathlib
 import re
+import subprocess
+import sys
 import tempfile
 
 from absl.testing import absltest
 from absl.testing import flagsaver
 from absl.testing import parameterized
 from google.protobuf import any_pb2
+from google.protobuf import descriptor_pb2
 from google.protobuf import text_format
 from python.runfiles import runfiles
 
+import changes_lib
+import corpus_lib
+import daemon_lib
 import ext_lib
+import fs_lib
 import protos.ext_pb2 as ext_pb2
 import protos.symfs_pb2 as symfs_pb2
 import symfs
+import throttle_lib
 
 r = runfiles.Create()
 TEST_CONFIG_FILE = r.Rlocation('everchanging/test_data/config.textproto')
@@ -271,7 +280,7 @@ class SymFsTest(parameterized.TestCase):
       config = symfs_pb2.Config(path=path_str, clear=True)
       with mock.patch.object(
           symfs, 'clear_symlinks', autospec=True) as mock_clear:
-        symfs.SymFs(config)
+        symfs.SymFs(config).generate(mapping={})
 
     mock_clear.assert_called()
 
@@ -281,7 +290,7 @@ class SymFsTest(parameterized.TestCase):
       config = symfs_pb2.Config(path=path_str, clear=False)
       with mock.patch.object(
           symfs, 'clear_symlinks', autospec=True) as mock_clear:
-        symfs.SymFs(config)
+        symfs.SymFs(config).generate(mapping={})
 
     mock_clear.assert_not_called()
 
@@ -313,6 +322,1000 @@ class SymFsTest(parameterized.TestCase):
 
     self.assertEqual(symfs.SymFs(config).get_mapping(), expected_mapping)
 
+  def test_descriptor_set_files(self):
+    """Ensures metadata types can be loaded from Config.descriptor_set_files."""
+    # A copy of ext.proto in a different package, which is not built in.
+    file_descriptor = descriptor_pb2.FileDescriptorProto()
+    ext_pb2.DESCRIPTOR.CopyToProto(file_descriptor)
+    file_descriptor.name = 'symfs_test/runtime.proto'
+    file_descriptor.package = 'everchanging.symfs.symfs_test'
+
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      descriptor_set_file = path / 'runtime.pb'
+      descriptor_set_file.write_bytes(
+          descriptor_pb2.FileDescriptorSet(
+              file=[file_descriptor]).SerializeToString())
+      (path / 'media').mkdir()
+      (path / 'media' / 'metadata.textproto').write_text(
+          'data { [type.googleapis.com/everchanging.symfs.symfs_test.Media] '
+          '{ casts: "a" casts: "b" } }')
+
+      config = symfs_pb2.Config(
+          path=str(path / 'views'),
+          source_paths=[str(path / 'media')],
+          descriptor_set_files=[str(descriptor_set_file)],
+          group_by=[symfs_pb2.Config.GroupBy(name='cast', field=['casts'])])
+
+      self.assertEqual(
+          symfs.SymFs(config).get_mapping(), {
+              'cast': {
+                  'a': {path / 'media'},
+                  'b': {path / 'media'},
+              },
+          })
+
+  def test_in_memory_filesystem(self):
+    """Ensures SymFs only uses the filesystem, with one syscall per link."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.mkdir(pathlib.Path('/media/m_0'), parents=True)
+    filesystem.mkdir(pathlib.Path('/media/m_1'), parents=True)
+    filesystem.write_text(
+        pathlib.Path('/media/m_0/metadata.textproto'),
+        'data { [type.googleapis.com/everchanging.symfs.ext.Media] '
+        '{ casts: "a" casts: "b" studio: "s" } }')
+    filesystem.write_text(
+        pathlib.Path('/media/m_1/metadata.textproto'),
+        'data { [type.googleapis.com/everchanging.symfs.ext.Media] '
+        '{ casts: "b" studio: "s" } }')
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts']),
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+        ])
+
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    mapping = symfs_object.get_mapping()
+    filesystem.syscalls.clear()
+    symfs_object.generate()
+
+    num_links = sum(
+        len(items) for group in mapping.values() for items in group.values())
+    num_directories = len(mapping) + sum(
+        len(group) for group in mapping.values())
+    self.assertEqual(num_links, 5)
+    self.assertEqual(filesystem.syscalls['symlink'], num_links)
+    # One stat and mkdir for the output path, and a mkdir per directory.
+    self.assertLessEqual(
+        sum(filesystem.syscalls.values()), num_links + num_directories + 2)
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/cast/b/m_1')),
+        pathlib.Path('/media/m_1'))
+
+    # Generating again skips all existing links.
+    filesystem.syscalls.clear()
+    symfs_object.generate()
+    self.assertEqual(symfs_object.metrics.counters['links_skipped'], num_links)
+
+    symfs.clear_symlinks(pathlib.Path('/views'), filesystem)
+    self.assertFalse(filesystem.exists(pathlib.Path('/views')))
+
+  def _make_in_memory_media(self, filesystem, name, casts):
+    filesystem.mkdir(pathlib.Path('/media') / name, parents=True, exist_ok=True)
+    filesystem.write_text(
+        pathlib.Path('/media') / name / 'metadata.textproto',
+        'data { [type.googleapis.com/everchanging.symfs.ext.Media] { ' +
+        ''.join(f'casts: "{cast}" ' for cast in casts) + 'studio: "s" } }')
+
+  @parameterized.named_parameters(
+      # The cast group takes 3 seconds; the studio group is then expected to
+      # take 2 seconds, so it is not started.
+      ('estimate', 4, ['studio'], 0),
+      # The deadline passes while linking the cast group.
+      ('remove', 1.5, ['cast', 'studio'], 2),
+  )
+  def test_generate_deadline(self, deadline, expected_deferred,
+                             expected_removed):
+    """Ensures groups are generated by priority, whole or not at all."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts'], priority=1),
+        ])
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    symfs_object.get_mapping()
+
+    # Each link takes a second.
+    now = [0.0]
+    link = symfs.SymFs._link
+
+    def slow_link(self, *args):
+      now[0] += 1
+      return link(self, *args)
+
+    with mock.patch.object(symfs.time, 'monotonic', lambda: now[0]):
+      with mock.patch.object(symfs.SymFs, '_link', slow_link):
+        with self.assertLogs(level='WARNING'):
+          deferred = symfs_object.generate(deadline=deadline)
+
+    self.assertEqual(deferred, expected_deferred)
+    self.assertEqual(symfs_object.metrics.counters['links_removed'],
+                     expected_removed)
+    for group_name in ('cast', 'studio'):
+      self.assertEqual(
+          filesystem.exists(pathlib.Path('/views') / group_name),
+          group_name not in expected_deferred)
+
+  def test_generate_order(self):
+    """Ensures groups of the same priority are generated in config order."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    config = symfs_pb2.Config(
+        path='/views',
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts']),
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+            symfs_pb2.Config.GroupBy(name='year', field=['year'], priority=1),
+        ])
+    item = pathlib.Path('/media/m_0')
+    # As merged from shards, in a different order than the config.
+    mapping = {
+        'studio': {'s': {item}},
+        'cast': {'a': {item}},
+        'year': {'2000': {item}},
+    }
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    with mock.patch.object(
+        symfs_object, '_generate_group',
+        wraps=symfs_object._generate_group) as mock_generate_group:
+      symfs_object.generate(mapping=mapping)
+
+    self.assertEqual(
+        [call.args[0].name for call in mock_generate_group.call_args_list],
+        ['year', 'cast', 'studio'])
+
+  def test_generate_deadline_clear(self):
+    """Ensures clear leaves the links of deferred groups untouched."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    for link in ('/views/stray', '/views/cast/c/m_2', '/views/studio/t/m_2'):
+      filesystem.mkdir(pathlib.Path(link).parent, parents=True, exist_ok=True)
+      filesystem.symlink(pathlib.Path(link), pathlib.Path('/media/m_2'))
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        clear=True,
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts'], priority=1),
+        ])
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/stray')))
+
+    # Each link takes a second, so the studio group is deferred.
+    now = [0.0]
+    link = symfs.SymFs._link
+
+    def slow_link(self, *args):
+      now[0] += 1
+      return link(self, *args)
+
+    with mock.patch.object(symfs.time, 'monotonic', lambda: now[0]):
+      with mock.patch.object(symfs.SymFs, '_link', slow_link):
+        with self.assertLogs(level='WARNING'):
+          deferred = symfs_object.generate(deadline=4)
+
+    self.assertEqual(deferred, ['studio'])
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/stray')))
+    self.assertCountEqual(
+        [entry.name for entry in filesystem.walk(pathlib.Path('/views/cast'))],
+        ['a', 'b', 'm_0', 'm_0', 'm_1'])
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/studio/t/m_2')),
+        pathlib.Path('/media/m_2'))
+
+  @parameterized.parameters(
+      (symfs_pb2.Config.Deduplication.NO_DEDUPLICATION,
+       ['/media/deep/m_0', '/alias/m_0'], 0),
+      (symfs_pb2.Config.Deduplication.FIRST_PATH, ['/media/deep/m_0'], 1),
+      (symfs_pb2.Config.Deduplication.SHORTEST_PATH, ['/alias/m_0'], 1),
+  )
+  def test_deduplication(self, deduplication, expected_items,
+                         expected_deduplicated):
+    """Ensures items reachable through multiple paths are scanned once."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'deep/m_0', ['a'])
+    filesystem.symlink(pathlib.Path('/alias'), pathlib.Path('/media/deep'))
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media', '/alias'],
+        deduplication=deduplication)
+    config.metadata_files.patterns.append('^metadata.textproto$')
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    items = [str(item) for item, _ in symfs_object.scan_metadata()]
+
+    self.assertEqual(items, expected_items)
+    self.assertEqual(
+        symfs_object.metrics.counters['items_deduplicated'],
+        expected_deduplicated)
+
+  def test_deduplication_nested_source_paths(self):
+    """Ensures source paths nested in another are not walked again."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media', '/media/m_0'],
+        deduplication=symfs_pb2.Config.Deduplication.FIRST_PATH)
+    config.metadata_files.patterns.append('^metadata.textproto$')
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    items = [str(item) for item, _ in symfs_object.scan_metadata()]
+
+    self.assertEqual(items, ['/media/m_0'])
+    self.assertEqual(symfs_object.metrics.counters['items_scanned'], 2)
+
+  def test_refresh(self):
+    """Ensures refresh only parses and links what changed."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts']),
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+        ])
+    symfs_object = symfs.SymFs(
+        config, filesystem=filesystem, cache_metadata=True)
+    counters = symfs_object.metrics.counters
+
+    self.assertEqual(symfs_object.refresh(), (5, 0))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/a/m_0')))
+
+    filesystem.syscalls.clear()
+    self.assertEqual(symfs_object.refresh(), (0, 0))
+    self.assertEqual(counters['metadata_parsed'], 2)
+    self.assertEqual(counters['metadata_cached'], 2)
+    self.assertEqual(counters['items_grouped'], 2)
+    self.assertContainsSubset(filesystem.syscalls,
+                              {'getdents', 'stat', 'mkdir'})
+
+    self._make_in_memory_media(filesystem, 'm_1', ['c'])
+    self.assertEqual(symfs_object.refresh(), (1, 1))
+    self.assertEqual(counters['metadata_parsed'], 3)
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/cast/b/m_1')))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/c/m_1')))
+
+    filesystem.rmtree(pathlib.Path('/media/m_0'))
+    self.assertEqual(symfs_object.refresh(), (0, 3))
+    self.assertFalse(filesystem.exists(pathlib.Path('/views/cast/a')))
+    self.assertTrue(filesystem.exists(pathlib.Path('/views/cast')))
+    self.assertEqual(counters['links_removed'], 4)
+    self.assertEqual(
+        symfs_object.get_mapping(), {
+            'cast': {
+                'c': {pathlib.Path('/media/m_1')}
+            },
+            'studio': {
+                's': {pathlib.Path('/media/m_1')}
+            },
+        })
+
+  def test_binary_metadata_files(self):
+    """Ensures binary metadata is parsed, falling back to the text format."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    text = filesystem.read_text(pathlib.Path('/media/m_0/metadata.textproto'))
+    filesystem.unlink(pathlib.Path('/media/m_0/metadata.textproto'))
+    filesystem.write_bytes(
+        pathlib.Path('/media/m_0/metadata.binpb'),
+        text_format.Parse(text, symfs_pb2.Metadata()).SerializeToString())
+    filesystem.mkdir(pathlib.Path('/media/m_1'))
+    filesystem.write_text(
+        pathlib.Path('/media/m_1/metadata.binpb'), text.replace('"a"', '"b"'))
+    config = self._make_in_memory_config()
+    config.metadata_files.patterns.append(r'^metadata\.binpb$')
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    with self.assertLogs(level='WARNING'):
+      mapping = symfs_object.get_mapping()
+
+    self.assertEqual(
+        mapping['cast'], {
+            'a': {pathlib.Path('/media/m_0')},
+            'b': {pathlib.Path('/media/m_1')},
+        })
+    self.assertEqual(symfs_object.metrics.counters['metadata_parsed'], 2)
+    self.assertEqual(symfs_object.metrics.counters['metadata_parsed_binary'],
+                     1)
+    self.assertEqual(symfs_object.metrics.info['protobuf_backend'],
+                     symfs.ext_lib.get_protobuf_backend())
+
+  def test_merge_metadata(self):
+    """Ensures metadata is merged as with MergeFrom on its data."""
+
+    def make_metadata(message):
+      metadata = symfs_pb2.Metadata()
+      metadata.data.Pack(message)
+      return metadata
+
+    parent = make_metadata(ext_pb2.Media(studio='s', casts=['a']))
+    merged = symfs.merge_metadata(
+        parent, make_metadata(ext_pb2.Media(casts=['b'], genre=['g'])))
+    media = ext_pb2.Media()
+    merged.data.Unpack(media)
+
+    self.assertEqual(media,
+                     ext_pb2.Media(studio='s', casts=['a', 'b'], genre=['g']))
+    self.assertIs(symfs.merge_metadata(parent, symfs_pb2.Metadata()), parent)
+    other = make_metadata(symfs_pb2.Config(path='/p'))
+    self.assertIs(symfs.merge_metadata(parent, other), other)
+
+  def _make_inheriting_media(self, filesystem):
+    filesystem.mkdir(pathlib.Path('/media/m_0/m_00'), parents=True)
+    filesystem.mkdir(pathlib.Path('/media/m_1'))
+    filesystem.write_text(
+        pathlib.Path('/media/metadata.textproto'),
+        'data { [type.googleapis.com/everchanging.symfs.ext.Media] { '
+        'casts: "a" studio: "s" } }')
+    self._make_in_memory_media(filesystem, 'm_0', ['b'])
+    filesystem.write_text(pathlib.Path('/media/m_0/m_00/metadata.textproto'),
+                          '')
+    config = self._make_in_memory_config()
+    config.metadata_files.patterns.append(r'^metadata\.textproto$')
+    config.metadata_files.inherit = True
+    return config
+
+  def test_inherit_metadata(self):
+    """Ensures metadata applies to its subtree, parsing each file once."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    config = self._make_inheriting_media(filesystem)
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    mapping = symfs_object.get_mapping()
+
+    self.assertEqual(
+        mapping['cast'], {
+            'a': {
+                pathlib.Path('/media'),
+                pathlib.Path('/media/m_0'),
+                pathlib.Path('/media/m_0/m_00')
+            },
+            'b': {pathlib.Path('/media/m_0'),
+                  pathlib.Path('/media/m_0/m_00')},
+        })
+    self.assertEqual(mapping['studio']['s'], mapping['cast']['a'])
+    self.assertEqual(symfs_object.metrics.counters['metadata_parsed'], 3)
+    self.assertEqual(symfs_object.metrics.counters['metadata_inherited'], 2)
+
+  def test_inherit_metadata_refresh(self):
+    """Ensures changed metadata is inherited by the items under it."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    config = self._make_inheriting_media(filesystem)
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    symfs_object.refresh()
+
+    self._make_in_memory_media(filesystem, 'm_0', ['c'])
+    symfs_object.refresh(
+        changed_paths=[pathlib.Path('/media/m_0/metadata.textproto')])
+
+    self.assertEqual(
+        symfs_object.paths_by_keys_by_group['cast'], {
+            'a': {
+                pathlib.Path('/media'),
+                pathlib.Path('/media/m_0'),
+                pathlib.Path('/media/m_0/m_00')
+            },
+            'c': {pathlib.Path('/media/m_0'),
+                  pathlib.Path('/media/m_0/m_00')},
+        })
+
+  def test_inherit_metadata_refresh_unchanged(self):
+    """Ensures unchanged inherited metadata is not grouped again."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    config = self._make_inheriting_media(filesystem)
+    symfs_object = symfs.SymFs(
+        config, filesystem=filesystem, cache_metadata=True)
+    symfs_object.refresh()
+    self.assertEqual(symfs_object.metrics.counters['items_grouped'], 3)
+
+    symfs_object.refresh()
+    symfs_object.refresh(changed_paths=[pathlib.Path('/media/m_0/m_00')])
+
+    self.assertEqual(symfs_object.metrics.counters['items_grouped'], 3)
+
+  def test_intern_keys(self):
+    """Ensures identical metadata is only grouped once per scan."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    for name in ('m_0', 'm_1', 'm_2'):
+      self._make_in_memory_media(filesystem, name, ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_3', ['c'])
+    config = self._make_in_memory_config()
+    config.group_by.add(name='missing', field=['does_not_exist'])
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    with mock.patch.object(
+        symfs, 'generate_groups',
+        wraps=symfs.generate_groups) as generate_groups:
+      with self.assertLogs(level='ERROR') as logs:
+        mapping = symfs_object.get_mapping()
+
+    self.assertEqual(
+        mapping['cast']['a'],
+        {pathlib.Path('/media') / name for name in ('m_0', 'm_1', 'm_2')})
+    self.assertEqual(mapping['cast']['c'], {pathlib.Path('/media/m_3')})
+    self.assertLen(mapping['studio']['s'], 4)
+    # Once per group_by for each of the 2 distinct metadata.
+    self.assertEqual(generate_groups.call_count, 6)
+    self.assertEqual(symfs_object.metrics.counters['metadata_interned'], 2)
+    # The error is still logged for every item.
+    self.assertLen(logs.output, 4)
+
+  def test_intern_keys_refresh(self):
+    """Ensures incremental refreshes drop the keys no item has anymore."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    self._make_in_memory_media(filesystem, 'm_1', ['a'])
+    symfs_object = symfs.SymFs(
+        self._make_in_memory_config(), filesystem=filesystem)
+    symfs_object.refresh()
+
+    for index in range(10):
+      self._make_in_memory_media(filesystem, 'm_0', [f'c_{index}'])
+      symfs_object.refresh(
+          changed_paths=[pathlib.Path('/media/m_0/metadata.textproto')])
+
+      # The data of m_0, and that of m_1.
+      self.assertLen(symfs_object._interned_keys, 2)
+
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    symfs_object.refresh(
+        changed_paths=[pathlib.Path('/media/m_0/metadata.textproto')])
+    filesystem.rmtree(pathlib.Path('/media/m_1'))
+    symfs_object.refresh(changed_paths=[pathlib.Path('/media/m_1')])
+
+    self.assertLen(symfs_object._interned_keys, 1)
+    self.assertEqual(symfs_object.paths_by_keys_by_group['cast'],
+                     {'a': {pathlib.Path('/media/m_0')}})
+
+  @absltest.skipUnless(symfs.columnar_lib.AVAILABLE, 'NumPy is not installed.')
+  def test_columnar_mapping(self):
+    """Ensures group_bys of scalar fields are grouped as usual."""
+    with tempfile.TemporaryDirectory() as directory:
+      root = pathlib.Path(directory) / 'corpus'
+      corpus_lib.generate_corpus(
+          root, 50, metadata_type='TestMessage', cardinality=5)
+      config = corpus_lib.make_config(root,
+                                      pathlib.Path(directory) / 'views',
+                                      'TestMessage')
+      config.group_by.add(name='by_s_m_value', field=['s', 'm.value'])
+      items = list(symfs.SymFs(config).scan_metadata())
+
+      expected_mapping = symfs.SymFs(config).get_mapping()
+      config.columnar = True
+      symfs_object = symfs.SymFs(config)
+      symfs_object._compute_mapping(items)
+
+    self.assertEqual(symfs_object.paths_by_keys_by_group, expected_mapping)
+    # Each item, for by_s, by_m_value, and by_s_m_value.
+    self.assertEqual(
+        symfs_object.metrics.counters['items_grouped_columnar'], 150)
+
+  def test_columnar_without_numpy(self):
+    """Ensures Config.columnar is rejected without NumPy."""
+    config = symfs_pb2.Config(path='/views', columnar=True)
+
+    with mock.patch.object(symfs.columnar_lib, 'AVAILABLE', False):
+      with self.assertRaisesRegex(ValueError, 'requires NumPy'):
+        symfs.SymFs(config)
+
+  def _make_combinations_config(self):
+    config = self._make_in_memory_config()
+    Combination = symfs_pb2.Config.Combination
+    config.combinations.add(
+        group='picks',
+        key='a_and_b',
+        operands=[
+            Combination.Operand(group='cast', key='a'),
+            Combination.Operand(group='cast', key='b'),
+        ])
+    config.combinations.add(
+        group='picks',
+        key='a_or_c',
+        operation=Combination.UNION,
+        operands=[
+            Combination.Operand(group='cast', key='a'),
+            Combination.Operand(group='cast', key='c'),
+        ])
+    config.combinations.add(
+        group='picks',
+        key='none',
+        operands=[Combination.Operand(group='studio', key='does_not_exist')])
+    return config
+
+  def test_combinations(self):
+    """Ensures only the requested combinations of group keys are linked."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b', 'c'])
+    self._make_in_memory_media(filesystem, 'm_2', ['a'])
+    symfs_object = symfs.SymFs(
+        self._make_combinations_config(), filesystem=filesystem)
+
+    symfs_object.generate()
+
+    self.assertEqual(
+        symfs_object.get_mapping()['picks'], {
+            'a_and_b': {pathlib.Path('/media/m_0')},
+            'a_or_c': {
+                pathlib.Path('/media/m_0'),
+                pathlib.Path('/media/m_1'),
+                pathlib.Path('/media/m_2')
+            },
+        })
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/picks/a_and_b/m_0')),
+        pathlib.Path('/media/m_0'))
+    self.assertEqual(symfs_object.metrics.counters['combinations'], 3)
+
+  def test_combinations_refresh(self):
+    """Ensures the links of combinations follow the groups they combine."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b', 'c'])
+    symfs_object = symfs.SymFs(
+        self._make_combinations_config(), filesystem=filesystem)
+    symfs_object.refresh()
+
+    self._make_in_memory_media(filesystem, 'm_1', ['a', 'b'])
+
+    # The cast links of m_1 change by 1 each; its picks links by 1 added.
+    self.assertEqual(symfs_object.refresh(), (2, 1))
+    self.assertTrue(
+        filesystem.lexists(pathlib.Path('/views/picks/a_and_b/m_1')))
+    self.assertTrue(
+        filesystem.lexists(pathlib.Path('/views/picks/a_or_c/m_1')))
+
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+
+    self.assertEqual(symfs_object.refresh(), (0, 3))
+    self.assertFalse(
+        filesystem.lexists(pathlib.Path('/views/picks/a_and_b/m_1')))
+    self.assertFalse(
+        filesystem.lexists(pathlib.Path('/views/picks/a_or_c/m_1')))
+
+  @parameterized.parameters(('', 'k', 'cast'), ('cast', 'k', 'cast'),
+                            ('picks', 'k', 'does_not_exist'))
+  def test_combinations_invalid(self, group, key, operand_group):
+    config = self._make_in_memory_config()
+    config.combinations.add(
+        group=group,
+        key=key,
+        operands=[
+            symfs_pb2.Config.Combination.Operand(group=operand_group, key='a')
+        ])
+
+    with self.assertRaises(ValueError):
+      symfs.SymFs(config, filesystem=fs_lib.InMemoryFileSystem())
+
+  def _make_in_memory_config(self):
+    return symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts']),
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+        ])
+
+  def test_reconcile(self):
+    """Ensures only the links of changed items are touched."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    config = self._make_in_memory_config()
+    applied = symfs.SymFs(config, filesystem=filesystem).get_mapping()
+    symfs.SymFs(config, filesystem=filesystem).generate(mapping=applied)
+
+    self._make_in_memory_media(filesystem, 'm_1', ['c'])
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    symfs_object.get_mapping()
+    filesystem.syscalls.clear()
+
+    self.assertEqual(symfs_object.reconcile(applied), (1, 1))
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/cast/b/m_1')))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/b/m_0')))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/c/m_1')))
+    self.assertEqual(filesystem.syscalls['getdents'], 0)
+    self.assertEqual(filesystem.syscalls['symlink'], 1)
+    self.assertEqual(filesystem.syscalls['unlink'], 1)
+
+  def test_collect_garbage(self):
+    """Ensures only the links of moved or deleted items are checked."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    self._make_in_memory_media(filesystem, 'm_2', ['b'])
+    self._make_in_memory_media(filesystem, 'other/m_3', ['b'])
+    config = self._make_in_memory_config()
+    previous = symfs.SymFs(config, filesystem=filesystem).get_mapping()
+    symfs.SymFs(config, filesystem=filesystem).generate(mapping=previous)
+
+    filesystem.rmtree(pathlib.Path('/media/m_0'))
+    filesystem.unlink(pathlib.Path('/media/m_1/metadata.textproto'))
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+    symfs_object.get_mapping()
+    filesystem.syscalls.clear()
+
+    left = symfs_object.collect_garbage(previous, batch_size=2)
+
+    self.assertCountEqual(left, [(('cast', 'b'), pathlib.Path('/media/m_1')),
+                                 (('studio', 's'), pathlib.Path('/media/m_1'))])
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/cast/a')))
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/studio/s/m_0')))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/b/m_1')))
+    # The links of m_0, m_1, and m_2, as /media changed; not of m_3.
+    self.assertEqual(filesystem.syscalls['readlink'], 6 + 2)
+    self.assertEqual(filesystem.syscalls['getdents'], 0)
+    self.assertEqual(symfs_object.metrics.counters['links_checked'], 6)
+    self.assertEqual(symfs_object.metrics.counters['links_removed'], 2)
+
+  def test_verify(self):
+    """Ensures links that differ from the mapping are repaired."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a'])
+    self._make_in_memory_media(filesystem, 'm_1', ['a'])
+    symfs_object = symfs.SymFs(
+        self._make_in_memory_config(), filesystem=filesystem)
+    symfs_object.generate()
+    filesystem.unlink(pathlib.Path('/views/cast/a/m_0'))
+    filesystem.unlink(pathlib.Path('/views/studio/s/m_1'))
+    filesystem.symlink(
+        pathlib.Path('/views/studio/s/m_1'), pathlib.Path('/media/m_0'))
+    filesystem.symlink(
+        pathlib.Path('/views/cast/a/stray'), pathlib.Path('/media/m_0'))
+
+    self.assertEqual(symfs_object.verify(), (2, 2))
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/cast/a/m_0')),
+        pathlib.Path('/media/m_0'))
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/studio/s/m_1')),
+        pathlib.Path('/media/m_1'))
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/cast/a/stray')))
+    self.assertEqual(symfs_object.verify(), (0, 0))
+    self.assertEqual(symfs_object.metrics.counters['links_repaired'], 4)
+
+  def test_refresh_name_collision(self):
+    """Ensures an item takes the link of a removed item with the same name."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'x/m', ['a'])
+    self._make_in_memory_media(filesystem, 'y/m', ['a'])
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[symfs_pb2.Config.GroupBy(name='cast', field=['casts'])])
+    symfs_object = symfs.SymFs(config, filesystem=filesystem)
+
+    symfs_object.refresh()
+    winner = filesystem.readlink(pathlib.Path('/views/cast/a/m'))
+    filesystem.rmtree(winner)
+    symfs_object.refresh()
+
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views/cast/a/m')),
+        ({pathlib.Path('/media/x/m'), pathlib.Path('/media/y/m')} -
+         {winner}).pop())
+
+  def test_refresh_changed_paths(self):
+    """Ensures refresh with changed_paths only scans the affected items."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'm_0', ['a', 'b'])
+    self._make_in_memory_media(filesystem, 'm_1', ['b'])
+    config = symfs_pb2.Config(
+        path='/views',
+        source_paths=['/media'],
+        group_by=[
+            symfs_pb2.Config.GroupBy(name='cast', field=['casts']),
+            symfs_pb2.Config.GroupBy(name='studio', field=['studio']),
+        ])
+    symfs_object = symfs.SymFs(
+        config, filesystem=filesystem, cache_metadata=True)
+    counters = symfs_object.metrics.counters
+    symfs_object.refresh()
+
+    self._make_in_memory_media(filesystem, 'm_1', ['c'])
+    filesystem.syscalls.clear()
+    self.assertEqual(
+        symfs_object.refresh(
+            changed_paths=[pathlib.Path('/media/m_1/metadata.textproto')]),
+        (1, 1))
+    self.assertEqual(counters['metadata_parsed'], 3)
+    self.assertEqual(counters['metadata_cached'], 0)
+    # The metadata file itself, and its directory.
+    self.assertEqual(filesystem.syscalls['getdents'], 2)
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/c/m_1')))
+
+    self._make_in_memory_media(filesystem, 'new/m_2', ['a'])
+    self.assertEqual(
+        symfs_object.refresh(changed_paths=[pathlib.Path('/media/new')]),
+        (2, 0))
+    self.assertTrue(filesystem.lexists(pathlib.Path('/views/cast/a/m_2')))
+
+    filesystem.rmtree(pathlib.Path('/media/m_0'))
+    self.assertEqual(
+        symfs_object.refresh(changed_paths=[pathlib.Path('/media/m_0')]),
+        (0, 3))
+    self.assertFalse(filesystem.lexists(pathlib.Path('/views/cast/a/m_0')))
+
+    filesystem.syscalls.clear()
+    self.assertEqual(
+        symfs_object.refresh(changed_paths=[pathlib.Path('/other')]), (0, 0))
+    self.assertEqual(filesystem.syscalls['getdents'], 0)
+
+    # A full refresh agrees with the incremental ones.
+    self.assertEqual(symfs_object.refresh(), (0, 0))
+    self.assertEqual(
+        symfs_object.get_mapping(), {
+            'cast': {
+                'a': {pathlib.Path('/media/new/m_2')},
+                'c': {pathlib.Path('/media/m_1')},
+            },
+            'studio': {
+                's': {
+                    pathlib.Path('/media/m_1'),
+                    pathlib.Path('/media/new/m_2')
+                }
+            },
+        })
+
+  @parameterized.named_parameters(
+      ('metadata_file', 'metadata_files', ['/src/a/metadata.textproto'], [
+          ('/src/a', False),
+          ('/src/a/metadata.textproto', True),
+      ]),
+      ('covered', 'metadata_files',
+       ['/src/a/metadata.textproto', '/src/a/b/c', '/src/a', '/other'], [
+           ('/src/a', True),
+       ]),
+      ('derived_directories', 'derived_metadata', ['/src/a/b/file'], [
+          ('/src/a', False),
+          ('/src/a/b', False),
+          ('/src/a/b/file', True),
+      ]),
+  )
+  def test_get_scopes(self, which_metadata, changed_paths, expected_scopes):
+    """Ensures the scopes cover the items affected by changed paths."""
+    config = symfs_pb2.Config(path='/views', source_paths=['/src'])
+    if which_metadata == 'metadata_files':
+      config.metadata_files.patterns.append(r'^metadata\.textproto$')
+    else:
+      config.derived_metadata.item_mode = (
+          symfs_pb2.Config.DerivedMetadata.ItemMode.DIRECTORIES)
+    symfs_object = symfs.SymFs(config, filesystem=fs_lib.InMemoryFileSystem())
+
+    self.assertEqual(
+        symfs_object._get_scopes(map(pathlib.Path, changed_paths)),
+        [(pathlib.Path(path), recursive)
+         for path, recursive in expected_scopes])
+
+  def test_source_paths_watch(self):
+    """Ensures changes reported by inotify are refreshed."""
+    root = pathlib.Path(self.create_tempdir().full_path)
+    (root / 'media' / 'm_0').mkdir(parents=True)
+    config = symfs_pb2.Config(
+        path=str(root / 'views'),
+        source_paths=[str(root / 'media')],
+        group_by=[symfs_pb2.Config.GroupBy(name='studio', field=['studio'])])
+    symfs_object = symfs.SymFs(config, cache_metadata=True)
+    watch = symfs._make_watch([config])
+    try:
+      watch.start()
+    except OSError as error:
+      self.skipTest(f'inotify is not available: {error}')
+    self.addCleanup(watch.close)
+    symfs_object.refresh()
+
+    (root / 'media' / 'm_0' / 'metadata.textproto').write_text(
+        'data { [type.googleapis.com/everchanging.symfs.ext.Media] '
+        '{ studio: "s" } }')
+    changes = watch.changes(timeout=10)
+    self.assertEqual(list(changes), [config.path])
+    symfs_object.refresh(changed_paths=changes[config.path])
+
+    self.assertTrue((root / 'views' / 'studio' / 's' / 'm_0').is_symlink())
+
+  def test_generate_batch(self):
+    """Ensures configs share the scan of their source paths."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    self._make_in_memory_media(filesystem, 'x/m_0', ['a'])
+    self._make_in_memory_media(filesystem, 'y/m_1', ['b'])
+    configs = [
+        symfs_pb2.Config(
+            path='/views_a',
+            source_paths=['/media'],
+            group_by=[symfs_pb2.Config.GroupBy(name='studio',
+                                               field=['studio'])]),
+        symfs_pb2.Config(
+            path='/views_b',
+            source_paths=['/media'],
+            group_by=[symfs_pb2.Config.GroupBy(name='cast', field=['casts'])]),
+        symfs_pb2.Config(
+            path='/views_c',
+            source_paths=['/media/x', '/media/z'],
+            group_by=[symfs_pb2.Config.GroupBy(name='cast', field=['casts'])]),
+    ]
+    metrics = symfs.metrics_lib.Metrics()
+
+    with self.assertLogs(level='WARNING') as logs:
+      symfs_objects = symfs.generate_batch(
+          configs, metrics=metrics, filesystem=filesystem, jobs=2)
+
+    self.assertLen(logs.output, 1)
+    self.assertIn('/media/z', logs.output[0])
+    self.assertEqual(metrics.counters['metadata_parsed'], 2)
+    # Only /media and the directories under it are read.
+    self.assertEqual(filesystem.syscalls['getdents'], 5)
+    self.assertEqual(metrics.counters['links_created'], 5)
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views_a/studio/s/m_1')),
+        pathlib.Path('/media/y/m_1'))
+    self.assertEqual(
+        filesystem.readlink(pathlib.Path('/views_b/cast/b/m_1')),
+        pathlib.Path('/media/y/m_1'))
+    self.assertEqual(symfs_objects[2].get_mapping(),
+                     {'cast': {
+                         'a': {pathlib.Path('/media/x/m_0')}
+                     }})
+
+  @parameterized.parameters(False, True)
+  def test_generate_batch_inherit_metadata(self, deduplication):
+    """Ensures items inherit up to the source path of their own config."""
+    filesystem = fs_lib.InMemoryFileSystem()
+    config = self._make_inheriting_media(filesystem)
+    config.deduplication = deduplication
+    nested_config = symfs_pb2.Config()
+    nested_config.CopyFrom(config)
+    nested_config.path = '/views_nested'
+    nested_config.source_paths[:] = ['/media/m_0']
+    both_config = symfs_pb2.Config()
+    both_config.CopyFrom(config)
+    both_config.path = '/views_both'
+    both_config.source_paths.append('/media/m_0')
+    configs = [config, nested_config, both_config]
+
+    batch_mappings = [
+        symfs_object.get_mapping() for symfs_object in symfs.generate_batch(
+            configs, filesystem=filesystem, dry_run=True)
+    ]
+    mappings = [
+        symfs.SymFs(config, filesystem=filesystem).get_mapping()
+        for config in configs
+    ]
+
+    self.assertEqual(batch_mappings, mappings)
+    # Not cast "a" of /media, which is above the source path.
+    self.assertEqual(mappings[1]['cast'], {
+        'b': {pathlib.Path('/media/m_0'),
+              pathlib.Path('/media/m_0/m_00')},
+    })
+
+  def test_generate_batch_from_main(self):
+    """Ensures multiple --config_file are generated from a shared scan."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      config_files = []
+      for name in ('a', 'b'):
+        config = symfs_pb2.Config()
+        text_format.Parse(pathlib.Path(TEST_CONFIG_FILE).read_text(), config)
+        config.path = str(path / name)
+        config_files.append(path / f'{name}.textproto')
+        config_files[-1].write_text(text_format.MessageToString(config))
+
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, list(map(str, config_files))),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._METRICS_FILE, str(path / 'metrics.json'))):
+        symfs.main(None)
+
+      metrics = json.loads((path / 'metrics.json').read_text())
+      self.assertTrue((path / 'a' / 'by_s' / 's_value').exists())
+      self.assertTrue((path / 'b' / 'by_s' / 's_value').exists())
+      self.assertEqual(metrics['counters']['metadata_parsed'], 2)
+
+  def test_shard_and_merge_from_main(self):
+    """Ensures shards scanned in separate processes are merged."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      shard_files = []
+      for name in ('a', 'b'):
+        item = path / f'shard_{name}' / f'item_{name}'
+        item.mkdir(parents=True)
+        (item / 'metadata.textproto').write_text(
+            'data { [type.googleapis.com/everchanging.symfs.ext.TestMessage] '
+            f'{{ s: "{name}" rs: "shared" }} }}')
+        shard_files.append(path / f'{name}.pb')
+        subprocess.run([
+            sys.executable, symfs.__file__,
+            f'--config_file={TEST_CONFIG_FILE}',
+            f'--path={path / "unused"}',
+            f'--source_paths={item.parent}',
+            f'--shard_output={shard_files[-1]}',
+        ],
+                       check=True,
+                       env={
+                           **os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)
+                       })
+      # The merging machine sees shard_a elsewhere.
+      (path / 'mnt').mkdir()
+      (path / 'mnt' / 'a').symlink_to(path / 'shard_a')
+
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._PATH, str(path / 'output')),
+          (symfs._MERGE, list(map(str, shard_files))),
+          (symfs._REMAP, [f'{path / "shard_a"}:{path / "mnt" / "a"}']),
+          (symfs._METRICS_FILE, str(path / 'metrics.json'))):
+        symfs.main(None)
+
+      metrics = json.loads((path / 'metrics.json').read_text())
+      self.assertFalse((path / 'unused').exists())
+      self.assertEqual(
+          os.readlink(path / 'output' / 'by_s' / 'a' / 'item_a'),
+          str(path / 'mnt' / 'a' / 'item_a'))
+      self.assertEqual(
+          os.readlink(path / 'output' / 'by_s' / 'b' / 'item_b'),
+          str(path / 'shard_b' / 'item_b'))
+      self.assertCountEqual(
+          os.listdir(path / 'output' / 'by_rs' / 'shared'),
+          ['item_a', 'item_b'])
+      self.assertEqual(metrics['counters']['shards_merged'], 2)
+      self.assertNotIn('metadata_parsed', metrics['counters'])
+
+  def test_serve_from_main(self):
+    """Ensures --serve refreshes the SymFs of each config."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE, TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]), (symfs._SERVE, True),
+          (symfs._REFRESH_INTERVAL, 60)):
+        with self.assertRaisesRegex(ValueError, 'different path'):
+          symfs.main(None)
+
+      config_files = []
+      for name in ('a', 'b'):
+        config = symfs_pb2.Config()
+        text_format.Parse(pathlib.Path(TEST_CONFIG_FILE).read_text(), config)
+        config.path = str(path / name)
+        config_files.append(path / f'{name}.textproto')
+        config_files[-1].write_text(text_format.MessageToString(config))
+
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, list(map(str, config_files))),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]), (symfs._SERVE, True),
+          (symfs._REFRESH_INTERVAL, 60)):
+        with mock.patch.object(
+            daemon_lib.Daemon,
+            'serve_forever',
+            autospec=True,
+            side_effect=lambda daemon: daemon.refresh()) as serve_forever:
+          symfs.main(None)
+
+      serve_forever.assert_called_once()
+      self.assertTrue((path / 'a' / 'by_s' / 's_value').exists())
+      self.assertTrue((path / 'b' / 'by_s' / 's_value').exists())
+
   def test_generate_from_main(self):
     """E2E test to ensure SymFs is correctly generated."""
     not_exist = '{}: no such field in message type {}; skipping'
@@ -330,7 +1333,8 @@ class SymFsTest(parameterized.TestCase):
 
     with tempfile.TemporaryDirectory() as output_path:
       with flagsaver.flagsaver(
-          (symfs._APPEND, True), (symfs._CONFIG_FILE, TEST_CONFIG_FILE),
+          (symfs._APPEND, True),
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
           (symfs._GROUP_BY, ['by_m:m.value', 'by_m:m']),
           (symfs._PATH, output_path),
           (symfs._SOURCE_PATHS, [TEST_DATA_DIR, '/does/not/exist'])):
@@ -349,11 +1353,240 @@ class SymFsTest(parameterized.TestCase):
 
       self.assertDictEqual(mapping, EXPECTED_MAPPING)
 
+  def test_metrics_from_main(self):
+    """Ensures metrics are written when the flags are set."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._GROUP_BY, ['by_m:m.value']), (symfs._APPEND, True),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._METRICS_FILE, str(path / 'metrics.json')),
+          (symfs._PROMETHEUS_FILE, str(path / 'symfs.prom'))):
+        symfs.main(None)
+
+      metrics = json.loads((path / 'metrics.json').read_text())
+      prometheus = (path / 'symfs.prom').read_text()
+
+    self.assertContainsSubset(('walk', 'parse', 'group', 'link', 'total'),
+                              metrics['phases'])
+    self.assertEqual(metrics['counters']['metadata_parsed'], 2)
+    self.assertEqual(metrics['counters']['items_grouped'], 2)
+    self.assertEqual(metrics['counters']['keys'], 5)
+    self.assertEqual(metrics['counters']['links_created'], 5)
+    self.assertIn('links_created', metrics['rates'])
+    self.assertIn(
+        f'symfs_count{{counter="links_created",path="{path / "views"}"}} 5',
+        prometheus)
+
+  @parameterized.parameters(True, False)
+  def test_stats_from_main(self, preflight):
+    """Ensures statistics are written instead of generating the SymFs."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._STATS_FILE, str(path / 'stats.json')),
+          (symfs._STATS_PREFLIGHT, preflight)):
+        symfs.main(None)
+
+      stats = json.loads((path / 'stats.json').read_text())
+      self.assertFalse((path / 'views').exists())
+
+    self.assertEqual(stats['projected_links'], 4)
+    self.assertEqual(stats['groups']['by_rs']['values_per_item'],
+                     {'rs': {'2-3': 1}})
+    self.assertEqual(stats['groups']['by_rs']['top_items'],
+                     [{'item': TEST_DATA_DIR, 'keys': 3}])
+    if preflight:
+      self.assertNotIn('links', stats)
+    else:
+      self.assertEqual(stats['links'], 4)
+      self.assertEqual(stats['groups']['by_s']['top_keys'],
+                       [{'key': 's_value', 'items': 1}])
+
+  def test_throttle_from_main(self):
+    """Ensures the SymFs is generated with throttling and I/O priority set."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._MAX_SCAN_ENTRIES_PER_SECOND, 1e6),
+          (symfs._MAX_READS_PER_SECOND, 1e6),
+          (symfs._MAX_READ_BYTES_PER_SECOND, 1e9),
+          (symfs._MAX_LINKS_PER_SECOND, 1e6),
+          (symfs._IO_PRIORITY, 'best-effort'),
+          (symfs._IO_PRIORITY_LEVEL, 7)):
+        self.assertIsInstance(symfs._make_filesystem(),
+                              throttle_lib.ThrottledFileSystem)
+        with mock.patch.object(
+            throttle_lib, 'set_io_priority',
+            autospec=True) as set_io_priority:
+          symfs.main(None)
+
+      set_io_priority.assert_called_once_with('best-effort', 7)
+      self.assertTrue((path / 'views' / 'by_s' / 's_value').exists())
+
+  def test_resume_from_main(self):
+    """Ensures a killed run is resumed without redoing completed keys."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      link = symfs.SymFs._link
+      links = []
+
+      def link_until_killed(self, *args):
+        if len(links) == 2:
+          raise KeyboardInterrupt()
+        links.append(args)
+        return link(self, *args)
+
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._STATE_FILE, str(path / 'state.pb')),
+          (symfs._CHECKPOINT_INTERVAL, 0),
+          (symfs._METRICS_FILE, str(path / 'metrics.json'))):
+        with mock.patch.object(symfs.SymFs, '_link', link_until_killed):
+          with self.assertRaises(KeyboardInterrupt):
+            symfs.main(None)
+        self.assertTrue((path / 'state.pb').exists())
+
+        with flagsaver.flagsaver((symfs._RESUME, True)):
+          symfs.main(None)
+
+      metrics = json.loads((path / 'metrics.json').read_text())
+      self.assertFalse((path / 'state.pb').exists())
+      self.assertCountEqual(
+          os.listdir(path / 'views' / 'by_rs'),
+          ['rs_value_0', 'rs_value_1', 'rs_value_0-rs_value_1'])
+
+    self.assertEqual(metrics['counters']['keys_resumed'], 2)
+    self.assertEqual(metrics['counters']['links_created'], 2)
+    self.assertNotIn('metadata_parsed', metrics['counters'])
+
+  def test_deadline_from_main(self):
+    """Ensures groups deferred by --deadline are generated on --resume."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._STATE_FILE, str(path / 'state.pb'))):
+        with flagsaver.flagsaver((symfs._DEADLINE, 0)):
+          with self.assertLogs(level='WARNING'):
+            symfs.main(None)
+        self.assertTrue((path / 'state.pb').exists())
+        self.assertEqual(os.listdir(path / 'views'), [])
+
+        with flagsaver.flagsaver((symfs._RESUME, True)):
+          symfs.main(None)
+
+      self.assertFalse((path / 'state.pb').exists())
+      self.assertCountEqual(os.listdir(path / 'views'), ['by_s', 'by_rs'])
+
+  @parameterized.named_parameters(
+      ('journal', True, [('REMOVED', 'by_rs')] * 3),
+      # The links of the by_rs group are left behind.
+      ('no_journal', False, []),
+  )
+  def test_change_log_from_main(self, journal, expected_removed):
+    """Ensures each run appends its changes since the previous run."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._CHANGE_LOG, str(path / 'changes.jsonl')),
+          (symfs._JOURNAL, str(path / 'journal.pb') if journal else None)):
+        symfs.main(None)
+        with flagsaver.flagsaver((symfs._GROUP_BY, ['by_s:s'])):
+          symfs.main(None)
+
+      changes = list(
+          changes_lib.read_changes(path / 'changes.jsonl', 'json'))
+
+    self.assertEqual([(symfs_pb2.Change.Kind.Name(change.kind), change.group)
+                      for change in changes],
+                     [('ADDED', 'by_rs')] * 3 + [('ADDED', 'by_s')] +
+                     expected_removed)
+    self.assertEqual({change.item for change in changes}, {TEST_DATA_DIR})
+
+  def test_journal_from_main(self):
+    """Ensures the next run only removes the links that changed."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._JOURNAL, str(path / 'journal.pb')),
+          (symfs._VERIFY, True)):
+        symfs.main(None)
+        self.assertTrue((path / 'journal.pb').exists())
+        (path / 'views' / 'by_s' / 'stray').symlink_to(TEST_DATA_DIR)
+
+        with flagsaver.flagsaver((symfs._GROUP_BY, ['by_s:s'])):
+          symfs.main(None)
+
+      self.assertEqual(os.listdir(path / 'views' / 'by_s'), ['s_value'])
+      self.assertEqual(os.listdir(path / 'views' / 'by_rs'), [])
+
+  def test_gc_from_main(self):
+    """Ensures links of deleted items are removed on the next run."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      item = path / 'media' / 'item'
+      item.mkdir(parents=True)
+      (item / 'metadata.textproto').write_text(
+          (pathlib.Path(TEST_DATA_DIR) / 'metadata.textproto').read_text())
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [str(path / 'media')]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._GC_JOURNAL, str(path / 'gc.pb'))):
+        symfs.main(None)
+        self.assertTrue(
+            (path / 'views' / 'by_s' / 's_value' / 'item').is_symlink())
+
+        (item / 'metadata.textproto').unlink()
+        item.rmdir()
+        with self.assertLogs(level='WARNING'):
+          symfs.main(None)
+
+      self.assertEqual(os.listdir(path / 'views' / 'by_s'), [])
+
+  def test_profile_from_main(self):
+    """Ensures each phase is profiled when --profile is set."""
+    with tempfile.TemporaryDirectory() as path_str:
+      path = pathlib.Path(path_str)
+      with flagsaver.flagsaver(
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
+          (symfs._SOURCE_PATHS, [TEST_DATA_DIR]),
+          (symfs._PATH, str(path / 'views')),
+          (symfs._PROFILE, str(path / 'profiles')),
+          (symfs._PROFILE_MEMORY, True)):
+        symfs.main(None)
+
+      self.assertContainsSubset(
+          {f'{phase}.{extension}'
+           for phase in ('scan', 'compute_mapping', 'generate')
+           for extension in ('pstats', 'txt', 'tracemalloc')},
+          {item.name for item in (path / 'profiles').iterdir()})
+      self.assertTrue((path / 'views' / 'by_s' / 's_value').exists())
+
   def test_dry_run(self):
     """Ensures dry_run does not create anything."""
     with tempfile.TemporaryDirectory() as output_path:
       with flagsaver.flagsaver(
-          (symfs._CONFIG_FILE, TEST_CONFIG_FILE),
+          (symfs._CONFIG_FILE, [TEST_CONFIG_FILE]),
           (symfs._SOURCE_PATHS, [TEST_DATA_DIR, '/does/not/exist']),
           (symfs._PATH, output_path), (symfs._DRY_RUN, True)):
         symfs.main(None)
@@ -412,6 +1645,43 @@ class SymFsTest(parameterized.TestCase):
 
     self.assertEqual(metadata, expected_metadata)
 
+  def test_derived_metadata_prepare(self):
+    """Ensures derivation classes are prepared with all items first."""
+    calls = []
+
+    class Derivation(ext_lib.DerivedMetadataClass):
+
+      def prepare(self, paths):
+        calls.append(('prepare', sorted(paths)))
+
+      def derive(self, path):
+        calls.append(('derive', path))
+        return symfs_pb2.Metadata()
+
+    filesystem = fs_lib.InMemoryFileSystem()
+    filesystem.mkdir(pathlib.Path('/media'))
+    for name in ('a', 'b'):
+      filesystem.write_text(pathlib.Path('/media', name), '')
+    config = symfs_pb2.Config(source_paths=['/media'], path='/views')
+    config.derived_metadata.item_mode = (
+        symfs_pb2.Config.DerivedMetadata.ItemMode.FILES)
+
+    with mock.patch.object(
+        ext_lib, 'get_derived_metadata_derivation',
+        return_value=Derivation) as get_derived_metadata_derivation:
+      symfs_object = symfs.SymFs(config, filesystem=filesystem)
+      list(symfs_object.scan_metadata())
+      scoped_calls = len(calls)
+      # Only the changed item is scanned, which is not prepared for.
+      list(symfs_object.scan_metadata([(Path('/media/a'), False)]))
+
+    paths = [Path('/media/a'), Path('/media/b')]
+    self.assertEqual(calls[0], ('prepare', paths))
+    self.assertCountEqual(calls[1:scoped_calls],
+                          [('derive', path) for path in paths])
+    self.assertEqual(calls[scoped_calls:], [('derive', Path('/media/a'))])
+    get_derived_metadata_derivation.assert_called_once()
+
   def test_derived_metadata_unmatched(self):
     """Ensures items only match those specified."""
     config = symfs_pb2.Config()
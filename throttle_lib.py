@@ -0,0 +1,241 @@
+"""Library to limit the rate of I/O of SymFs.
+
+A full scan or generate can saturate the metadata IOPS of a (network)
+filesystem, slowing down everything else using it. `ThrottledFileSystem` wraps
+another filesystem and limits, with token buckets, the rate of:
+
+- scan entries: entries yielded by `walk`, which paces the directory reads;
+- reads: files read, and the bytes read;
+- link operations: symlinks, directories, and removals created or made.
+
+Each limit is an average rate; up to a second's worth of operations (the
+burst) may happen at once after being idle. A bucket may be shared by
+multiple threads, in which case the rate is shared between them.
+
+Separately, `set_io_priority` lowers the I/O priority of the whole process,
+so that the kernel serves other processes first (with schedulers that support
+it, e.g. BFQ).
+"""
+
+from typing import Callable, Dict, Iterator, Optional
+
+import errno
+import os
+import pathlib
+import threading
+import time
+
+import fs_lib
+
+# From <linux/ioprio.h>.
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+IO_PRIORITY_CLASSES = {
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+
+# The ioprio_set syscall number, by machine.
+_SYS_IOPRIO_SET = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'riscv64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+
+
+class TokenBucket:
+  """Limits the average rate of operations.
+
+  Attributes:
+    rate: The number of tokens added per second.
+    burst: The maximum number of tokens that can accumulate.
+    waited_seconds: The total number of seconds `acquire` waited.
+  """
+
+  def __init__(self,
+               rate: float,
+               burst: Optional[float] = None,
+               clock: Callable[[], float] = time.monotonic,
+               sleep: Callable[[float], None] = time.sleep) -> None:
+    """Initializes a full bucket.
+
+    Args:
+      rate: The number of tokens added per second; must be positive.
+      burst: The maximum number of tokens; defaults to rate (at least 1).
+      clock: Returns the current time in seconds.
+      sleep: Sleeps for the given number of seconds.
+    """
+    if rate <= 0:
+      raise ValueError(f'Rate must be positive; got {rate}.')
+    self.rate = rate
+    self.burst = burst if burst is not None else max(rate, 1)
+    self.waited_seconds = 0.0
+
+    self._clock = clock
+    self._sleep = sleep
+    self._tokens = self.burst
+    self._updated = clock()
+    self._lock = threading.Lock()
+
+  def acquire(self, tokens: float = 1) -> None:
+    """Takes tokens, waiting until the bucket is no longer in debt.
+
+    Tokens may be more than the burst (e.g. the size of a large file), in
+    which case the bucket goes into debt, and this and later calls wait until
+    it is paid off.
+    """
+    with self._lock:
+      now = self._clock()
+      self._tokens = min(self.burst,
+                         self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      self._tokens -= tokens
+      wait = -self._tokens / self.rate if self._tokens < 0 else 0
+      self.waited_seconds += wait
+    # Later callers see the debt, so they wait their turn without the lock.
+    if wait > 0:
+      self._sleep(wait)
+
+
+class ThrottledFileSystem(fs_lib.FileSystem):
+  """Limits the rate of operations on another filesystem.
+
+  Stats and readlinks are not limited themselves, as SymFs only makes them
+  alongside the limited operations (e.g. before linking).
+
+  Attributes:
+    filesystem: The filesystem to perform the operations on.
+    buckets: The bucket limiting each kind of operation, by name: `scan`,
+      `read`, `read_bytes`, and `link`.
+  """
+
+  def __init__(self,
+               filesystem: fs_lib.FileSystem,
+               scan_entries_per_second: Optional[float] = None,
+               reads_per_second: Optional[float] = None,
+               read_bytes_per_second: Optional[float] = None,
+               links_per_second: Optional[float] = None,
+               clock: Callable[[], float] = time.monotonic,
+               sleep: Callable[[float], None] = time.sleep) -> None:
+    """Initializes the throttled filesystem.
+
+    Args:
+      filesystem: The filesystem to perform the operations on.
+      scan_entries_per_second: If set, the limit of entries walked.
+      reads_per_second: If set, the limit of files read.
+      read_bytes_per_second: If set, the limit of bytes read.
+      links_per_second: If set, the limit of symlinks, directories, and
+        removals created or made.
+      clock: As in `TokenBucket`.
+      sleep: As in `TokenBucket`.
+    """
+    self.filesystem = filesystem
+    rates = {
+        'scan': scan_entries_per_second,
+        'read': reads_per_second,
+        'read_bytes': read_bytes_per_second,
+        'link': links_per_second,
+    }
+    self.buckets: Dict[str, TokenBucket] = {
+        name: TokenBucket(rate, clock=clock, sleep=sleep)
+        for name, rate in rates.items()
+        if rate
+    }
+
+  def _acquire(self, name: str, tokens: float = 1) -> None:
+    bucket = self.buckets.get(name)
+    if bucket is not None:
+      bucket.acquire(tokens)
+
+  def walk(
+      self,
+      path: pathlib.Path,
+      recursive: bool = True,
+      descend: Optional[Callable[[fs_lib.Entry], bool]] = None
+  ) -> Iterator[fs_lib.Entry]:
+    for entry in self.filesystem.walk(
+        path, recursive=recursive, descend=descend):
+      self._acquire('scan')
+      yield entry
+
+  def stat(self,
+           path: pathlib.Path,
+           follow_symlinks: bool = True) -> fs_lib.StatResult:
+    return self.filesystem.stat(path, follow_symlinks=follow_symlinks)
+
+  def read_bytes(self, path: pathlib.Path) -> bytes:
+    self._acquire('read')
+    content = self.filesystem.read_bytes(path)
+    self._acquire('read_bytes', len(content))
+    return content
+
+  def write_bytes(self, path: pathlib.Path, content: bytes) -> None:
+    self.filesystem.write_bytes(path, content)
+
+  def mkdir(self,
+            path: pathlib.Path,
+            parents: bool = False,
+            exist_ok: bool = False) -> None:
+    self._acquire('link')
+    self.filesystem.mkdir(path, parents=parents, exist_ok=exist_ok)
+
+  def symlink(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    self._acquire('link')
+    self.filesystem.symlink(path, target)
+
+  def readlink(self, path: pathlib.Path) -> pathlib.Path:
+    return self.filesystem.readlink(path)
+
+  def unlink(self, path: pathlib.Path) -> None:
+    self._acquire('link')
+    self.filesystem.unlink(path)
+
+  def rmdir(self, path: pathlib.Path) -> None:
+    self._acquire('link')
+    self.filesystem.rmdir(path)
+
+  def replace(self, path: pathlib.Path, target: pathlib.Path) -> None:
+    self.filesystem.replace(path, target)
+
+  def write_bytes_atomically(self, path: pathlib.Path, content: bytes) -> None:
+    self.filesystem.write_bytes_atomically(path, content)
+
+
+def set_io_priority(io_class: str, level: int = 4) -> None:
+  """Sets the I/O priority of the calling thread, and threads it creates.
+
+  Call this before creating any threads (e.g. in main) to cover the whole
+  process.
+
+  Args:
+    io_class: One of `IO_PRIORITY_CLASSES`. Only root may use `realtime`.
+    level: The priority within the class, from 0 (highest) to 7 (lowest);
+      ignored for `idle`.
+
+  Raises:
+    OSError: If unable to set the priority; e.g. with ENOSYS if not on Linux.
+    ValueError: If io_class or level is invalid.
+  """
+  # Imported here to keep the startup of runs without --io_priority fast.
+  import ctypes  # pylint: disable=g-import-not-at-top
+  import ctypes.util  # pylint: disable=g-import-not-at-top
+  import platform  # pylint: disable=g-import-not-at-top
+
+  if io_class not in IO_PRIORITY_CLASSES:
+    raise ValueError(f'Unknown I/O priority class: {io_class}.')
+  if not 0 <= level <= 7:
+    raise ValueError(f'I/O priority level must be in [0, 7]; got {level}.')
+  number = _SYS_IOPRIO_SET.get(platform.machine())
+  if platform.system() != 'Linux' or number is None:
+    raise OSError(errno.ENOSYS, 'ioprio_set is not available.')
+
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  priority = IO_PRIORITY_CLASSES[io_class] << _IOPRIO_CLASS_SHIFT | level
+  if libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, priority) < 0:
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error))
@@ -0,0 +1,129 @@
+import pathlib
+
+from absl.testing import absltest
+
+import fs_lib
+import throttle_lib
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class TokenBucketTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+
+  def _make_bucket(self, rate, burst=None):
+    return throttle_lib.TokenBucket(
+        rate, burst, clock=lambda: self.clock.now, sleep=self.clock.sleep)
+
+  def test_acquire(self):
+    """Ensures the burst is free and the rest is paced at the rate."""
+    bucket = self._make_bucket(10, burst=2)
+
+    for _ in range(4):
+      bucket.acquire()
+
+    self.assertEqual(self.clock.sleeps, [0.1, 0.1])
+    self.assertAlmostEqual(bucket.waited_seconds, 0.2)
+
+  def test_acquire_refills(self):
+    """Ensures tokens accumulate while idle, up to the burst."""
+    bucket = self._make_bucket(10, burst=2)
+    bucket.acquire(2)
+    self.clock.now += 60
+
+    bucket.acquire(2)
+    bucket.acquire()
+
+    self.assertEqual(self.clock.sleeps, [0.1])
+
+  def test_acquire_debt(self):
+    """Ensures taking more than the burst makes later calls wait."""
+    bucket = self._make_bucket(100)
+
+    bucket.acquire(300)
+    bucket.acquire(50)
+
+    self.assertEqual(self.clock.sleeps, [2, 0.5])
+
+  def test_invalid_rate(self):
+    with self.assertRaises(ValueError):
+      throttle_lib.TokenBucket(0)
+
+
+class ThrottledFileSystemTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+    self.root = pathlib.Path('/root')
+    self.inner = fs_lib.InMemoryFileSystem()
+    self.inner.mkdir(self.root / 'a', parents=True)
+    self.inner.write_bytes(self.root / 'a' / 'file', b'x' * 100)
+    self.filesystem = throttle_lib.ThrottledFileSystem(
+        self.inner,
+        scan_entries_per_second=1,
+        read_bytes_per_second=50,
+        links_per_second=1,
+        clock=lambda: self.clock.now,
+        sleep=self.clock.sleep)
+
+  def test_buckets(self):
+    """Ensures only the given limits have buckets."""
+    self.assertCountEqual(self.filesystem.buckets,
+                          ['scan', 'read_bytes', 'link'])
+
+  def test_walk(self):
+    """Ensures each entry walked takes a token."""
+    entries = [entry.path for entry in self.filesystem.walk(self.root)]
+
+    self.assertEqual(entries, [self.root / 'a', self.root / 'a' / 'file'])
+    self.assertEqual(self.clock.sleeps, [1])
+
+  def test_read_bytes(self):
+    """Ensures bytes read take tokens."""
+    self.assertEqual(
+        self.filesystem.read_text(self.root / 'a' / 'file'), 'x' * 100)
+    self.assertEqual(self.clock.sleeps, [1])
+
+  def test_links(self):
+    """Ensures creating and removing links and directories take tokens."""
+    self.filesystem.mkdir(self.root / 'b')
+    self.filesystem.symlink(self.root / 'b' / 'link', self.root / 'a')
+    self.assertTrue(self.filesystem.is_symlink(self.root / 'b' / 'link'))
+    self.filesystem.rmtree(self.root / 'b')
+
+    self.assertFalse(self.inner.exists(self.root / 'b'))
+    # mkdir, symlink, walk (1 entry), unlink, and rmdir; the first link and
+    # scan are free.
+    self.assertEqual(self.clock.sleeps, [1, 1, 1])
+
+
+class SetIoPriorityTest(absltest.TestCase):
+
+  def test_set_io_priority(self):
+    try:
+      throttle_lib.set_io_priority('best-effort', 7)
+    except OSError as error:
+      self.skipTest(f'ioprio_set is not available: {error}')
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      throttle_lib.set_io_priority('unknown')
+    with self.assertRaises(ValueError):
+      throttle_lib.set_io_priority('idle', 8)
+
+
+if __name__ == '__main__':
+  absltest.main()